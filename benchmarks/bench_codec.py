@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Compare the installed JSON codecs on reaktor payloads.
+
+    python -m benchmarks.bench_codec [documents] [repeat]
+"""
+import sys
+import timeit
+
+from holon.codec import available_codecs, get_codec
+from benchmarks import payloads
+
+
+def bench(codec, response, post, number):
+    """Best time of number runs, in ms per run, for decoding and encoding."""
+    decode = min(timeit.repeat(lambda: codec.decode(response), number=number, repeat=3))
+    encode = min(timeit.repeat(lambda: codec.encode(post), number=number, repeat=3))
+    return decode * 1000 / number, encode * 1000 / number
+
+
+def main(count=100, number=20):
+    response = get_codec('json').encode(payloads.envelope(payloads.documents(count)))
+    post = {u'method': u'WSDocMgmt.getDocuments',
+            u'params': payloads.request(count), u'id': u'abcd1234'}
+    print 'response of %i documents, %i kB' % (count, len(response) / 1024)
+    results = [(name, bench(get_codec(name), response, post, number))
+               for name in available_codecs()]
+    # speedups are relative to python batteries' json
+    baseline = dict(results)['json']
+    for name, (decode, encode) in results:
+        print '%-12s decode %8.3f ms (%5.2fx)  encode %8.3f ms (%5.2fx)' % (
+            name, decode, baseline[0] / decode, encode, baseline[1] / encode)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
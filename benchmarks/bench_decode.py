@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Compare decoding responses and converting them to ReaktorObject's in two
+passes with building the ReaktorObject's while decoding, and the same with
+the keys translated.
+
+    python -m benchmarks.bench_decode [documents] [number] [repeat]
+
+On 200 documents simplejson in a single pass is 1.0x to 1.9x as fast as
+ujson plus conversion, json 0.9x to 1.6x: building the ReaktorObject's while
+decoding saves up to 45% of the CPU time of a response, not half, and less
+since simplejson decodes into unicode like the others. The timings vary a
+lot with the load of the machine, so compare runs of the same session only.
+"""
+import sys
+import timeit
+
+from holon.codec import available_codecs, get_codec
+from holon.reaktor import ReaktorObject
+from holon.translate import KeyTranslator
+from benchmarks import payloads
+from examples.patch import patch
+
+
+def two_pass(codec, response):
+    return ReaktorObject.to_reaktorobject(codec.decode(response)['result'])
+
+
+def single_pass(codec, response):
+    return codec.decode(response, object_pairs_hook=ReaktorObject)['result']
+
+
+def patched(codec, response):
+    return patch(two_pass(codec, response))
+
+
+def translated(codec, response, translator=KeyTranslator()):
+    return codec.decode(response, object_pairs_hook=translator.object_pairs_hook)['result']
+
+
+def best(function, number, repeat=5):
+    """Best time of number runs, in ms per run."""
+    return min(timeit.repeat(function, number=number, repeat=repeat)) * 1000 / number
+
+
+def main(count=100, number=20, repeat=5):
+    response = get_codec('json').encode(payloads.envelope(payloads.documents(count)))
+    print 'response of %i documents, %i kB' % (count, len(response) / 1024)
+    hooks = available_codecs(object_hooks=True)
+    baseline = None
+    for name in available_codecs():
+        codec = get_codec(name)
+        duration = best(lambda: two_pass(codec, response), number, repeat)
+        baseline = baseline or duration
+        print '%-12s two pass    %8.3f ms (%5.2fx)' % (name, duration, baseline / duration)
+        if name in hooks:
+            duration = best(lambda: single_pass(codec, response), number, repeat)
+            print '%-12s single pass %8.3f ms (%5.2fx)' % (name, duration, baseline / duration)
+
+    print 'with keys translated'
+    baseline = None
+    for name in available_codecs():
+        codec = get_codec(name)
+        duration = best(lambda: patched(codec, response), number, repeat)
+        baseline = baseline or duration
+        print '%-12s patched     %8.3f ms (%5.2fx)' % (name, duration, baseline / duration)
+        if name in hooks:
+            duration = best(lambda: translated(codec, response), number, repeat)
+            print '%-12s translated  %8.3f ms (%5.2fx)' % (name, duration, baseline / duration)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
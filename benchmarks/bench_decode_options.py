@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Compare the memory held by and the peak memory of decoding a large list
+result of documents with the decode options of Reaktor.call: interned keys
+and strings, projected fields, and both.
+
+    python -m benchmarks.bench_decode_options [documents]
+"""
+import os
+import resource
+import sys
+import timeit
+
+from holon.codec import get_codec
+from holon.decoding import Decoding, Interner
+from holon.reaktor import ReaktorObject
+from benchmarks import payloads
+from benchmarks.bench_records import deep_size
+
+
+# the title attribute is keyed by its UUID
+FIELDS = ['documentID', 'size', 'attributes.65534960-94f7-4cb8-b473-d2ce34740f44',
+          'categories.name']
+
+OPTIONS = (('plain', None, False),
+           ('intern', None, True),
+           ('fields', FIELDS, False),
+           ('fields+intern', FIELDS, True))
+
+
+def decode(codec, response, fields, intern):
+    decoding = Decoding(fields, Interner() if intern else None)
+    return decoding.decode(codec, response, ReaktorObject)['result']
+
+
+def peak(function):
+    """Growth of the peak resident memory while running function, in kB,
+    measured in a child process.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        function()
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write, str(after - before))
+        os._exit(0)
+    os.close(write)
+    growth = os.read(read, 64)
+    os.close(read)
+    os.waitpid(pid, 0)
+    return int(growth)
+
+
+def main(count=5000):
+    codec = get_codec('simplejson')
+    response = codec.encode(payloads.envelope(payloads.documents(count)))
+    print 'response of %i documents, %i kB' % (count, len(response) / 1024)
+    print '%-14s %10s %10s %10s' % ('', 'held', 'peak', 'time')
+    for name, fields, intern in OPTIONS:
+        run = lambda: decode(codec, response, fields, intern)
+        duration = min(timeit.repeat(run, number=1, repeat=3)) * 1000
+        print '%-14s %7.0f kB %7i kB %7.0f ms' % (
+            name, deep_size(run()) / 1024.0, peak(run), duration)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
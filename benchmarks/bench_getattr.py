@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of attribute access on ReaktorObject's, compared to the
+former implementation matching the getter regex on every access.
+
+    python -m benchmarks.bench_getattr [number]
+"""
+import sys
+import timeit
+
+from holon.reaktor import ReaktorObject, __GETTER_REGEX__
+
+
+class RegexReaktorObject(ReaktorObject):
+    """ReaktorObject with the former, uncached attribute resolution."""
+
+    def __getattr__(self, name):
+        match = __GETTER_REGEX__.match(name)
+        if match:
+            key = match.group(1)
+            key = key[0].lower() + key[1:]
+            if key in self:
+                return lambda: self[key]
+        elif name == "name" and len(self) == 1 and name in self:
+            return lambda: self["name"]
+        else:
+            try:
+                return self[name]
+            except KeyError:
+                pass
+        raise AttributeError(
+            u"ReaktorObject object has no attribute '%s'" % name)
+
+
+STATEMENTS = [
+    ('attribute', 'o.documentID'),
+    ('getter', 'o.getDocumentID()'),
+    ('enum', 'e.name()'),
+    ('missing', 'getattr(o, "missing", None)'),
+]
+
+
+SETUP = """
+from benchmarks.bench_getattr import DATA, %s as cls
+o, e = cls(DATA), cls({'name': 'PUBLISHED'})
+"""
+
+DATA = {'documentID': 'doc00000001', 'title': 'Title', 'size': 42}
+
+
+def main(number=200000):
+    for label, statement in STATEMENTS:
+        times = [min(timeit.repeat(statement, SETUP % cls, repeat=3, number=number))
+                 * 10 ** 9 / number
+                 for cls in ('RegexReaktorObject', 'ReaktorObject')]
+        print '%-10s before %7.1f ns  after %7.1f ns  (%4.2fx)' % (
+            label, times[0], times[1], times[0] / times[1])
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Compare the memory held by a list result of documents as ReaktorObject's
+and as RecordSet, for the lazily wrapped ones also once all their nested
+values were accessed.
+
+    python -m benchmarks.bench_records [documents]
+"""
+import gc
+import sys
+import timeit
+
+from holon.codec import get_codec
+from holon.reaktor import ReaktorObject
+from holon.records import RecordSet
+from benchmarks import payloads
+
+
+def deep_size(obj):
+    """Bytes held by obj and all objects it refers to, each counted once.
+    Classes and functions are not counted.
+    """
+    seen, size, pending = set(), 0, [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, type) or callable(obj):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+
+def access_all(value):
+    """Access all nested values of a result, so the ones wrapped lazily are
+    wrapped.
+    """
+    if isinstance(value, RecordSet):
+        for key in value.keys:
+            access_all(value.column(key))
+    elif isinstance(value, list):
+        for member in value:
+            access_all(member)
+    elif isinstance(value, dict):
+        for member in value.itervalues():
+            access_all(member)
+
+
+def main(count=1000):
+    codec = get_codec('json')
+    response = codec.encode(payloads.envelope(payloads.documents(count)))
+    print 'response of %i documents, %i kB' % (count, len(response) / 1024)
+    for name, converter in (('ReaktorObject', ReaktorObject.to_reaktorobject),
+                            ('lazy', ReaktorObject.to_lazy_reaktorobject),
+                            ('RecordSet', RecordSet.from_result)):
+        convert = lambda: converter(codec.decode(response)['result'])
+        duration = min(timeit.repeat(convert, number=3, repeat=3)) * 1000 / 3
+        result = convert()
+        print '%-14s %8.1f kB  %8.3f ms' % (name, deep_size(result) / 1024.0, duration)
+        if name != 'ReaktorObject':
+            # nested values wrapped on access
+            access = lambda: access_all(converter(codec.decode(response)['result']))
+            duration = min(timeit.repeat(access, number=3, repeat=3)) * 1000 / 3
+            access_all(result)
+            print '%-14s %8.1f kB  %8.3f ms' % ('  all accessed', deep_size(result) / 1024.0,
+                                                duration)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
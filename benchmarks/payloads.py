@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Representative txtr-reaktor payloads for the benchmarks.
+"""
+import random
+
+from holon.translate import ID_TO_NAME
+
+
+def document(i):
+    """A document as returned by WSDocMgmt.getDocument."""
+    rnd = random.Random(i)
+    attributes = dict(
+        (key, u'%s %s – %i' % (name, u'ä' * rnd.randint(0, 3), rnd.randint(0, 10 ** 6)))
+        for key, name in ID_TO_NAME.items())
+    return {
+        u'documentID': u'doc%08i' % i,
+        u'version': rnd.randint(1, 20),
+        u'size': rnd.randint(10 ** 4, 10 ** 7),
+        u'contentType': u'application/epub+zip',
+        u'attributes': attributes,
+        u'categories': [{u'categoryID': u'cat%i' % rnd.randint(0, 500),
+                         u'name': u'Category %i' % c} for c in range(3)],
+        u'status': {u'name': u'PUBLISHED'},
+        u'deliverables': [{u'name': u'EPUB', u'price': rnd.random() * 20,
+                           u'available': True, u'drm': None}],
+    }
+
+
+def documents(count):
+    """A list result of count documents, e.g. of a search."""
+    return [document(i) for i in range(count)]
+
+
+def envelope(result, request_id=u'abcd1234'):
+    """The JSON-RPC response carrying result."""
+    return {u'result': result, u'error': None, u'id': request_id}
+
+
+def request(count):
+    """The params of a request asking for count documents."""
+    return [u'txtr.de', [u'doc%08i' % i for i in range(count)],
+            {u'offset': 0, u'size': count, u'sortBy': u'title'}]
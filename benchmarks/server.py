@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in for txtr reaktor, answering each JSON-RPC request with
+the same list result of documents after a given latency.
+
+    with StubServer(documents=100, latency=0.005) as port:
+        reaktor = Reaktor(host='127.0.0.1', port=port, path='/rpc', ...)
+
+or standalone, e.g. to benchmark against from another process:
+
+    python -m benchmarks.server [port] [documents] [latency ms]
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import json
+import socket
+import sys
+import threading
+import time
+
+from benchmarks import payloads
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Answers each request with the result of its server, under the id of
+    the request.
+    """
+    protocol_version = 'HTTP/1.1'
+    # the response is sent at once, not delayed by Nagle's algorithm
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = self.server.template % json.dumps(request.get('id'))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """Threaded http server replaying a list result of documents.
+    Use it as context manager to run it on a thread, yielding its port.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, documents=100, latency=0.0, port=0):
+        """Init.
+        documents: int, number of documents of the result
+        latency: float, seconds each request is delayed
+        port: int, 0 for any free port
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), ReplayHandler)
+        self.latency = latency
+        result = json.dumps(payloads.documents(documents),
+                            ensure_ascii=False).encode('utf-8')
+        # the id is filled in per request
+        self.template = '{"result":%s,"error":null,"id":%%s}' % result.replace('%', '%%')
+        self.response_size = len(self.template)
+        self.thread = None
+        # the sockets of the connections being served
+        self.connections = set()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def finish_request(self, request, client_address):
+        self.connections.add(request)
+        try:
+            HTTPServer.finish_request(self, request, client_address)
+        finally:
+            self.connections.discard(request)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05, ))
+        self.thread.daemon = True
+        self.thread.start()
+        return self.port
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        # idle keep-alive connections end their threads
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self.server_close()
+
+
+def main(port=8080, documents=100, latency=0):
+    server = StubServer(documents, latency / 1000.0, port)
+    print 'serving %i documents, %i kB, on port %i' % (
+        documents, server.response_size / 1024, server.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
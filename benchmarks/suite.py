@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite of holon, against a local stand-in for txtr reaktor (see
+benchmarks.server):
+- end-to-end throughput and latency percentiles of calls through each http
+  service, from encoding the request to the converted result
+- the time of the phases of a call on its own: encoding the request
+  envelope, json-decoding the response and converting the result to
+  ReaktorObject's (and doing both in one pass, as calls do by default)
+
+The results are saved as JSON to compare them with the ones of other
+versions:
+
+    python -m benchmarks.suite --output before.json
+    # change holon
+    python -m benchmarks.suite --output after.json --compare before.json
+
+See --help for the size of the responses, their latency and the load.
+"""
+from itertools import count
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+from holon import __version__
+from holon.codec import get_codec
+from holon.reaktor import Reaktor, ReaktorError, ReaktorObject
+from benchmarks import payloads
+from benchmarks.server import StubServer
+
+
+SERVICES = {
+    'httplib': 'services.httplib.HttpLibHttpService',
+    'pycurl': 'services.pycurl.PyCurlHttpService',
+}
+
+FUNCTION = 'WSDocMgmt.getDocuments'
+
+# metrics compared between results, and whether more is better
+COMPARED = {'best': False, 'p50': False, 'p99': False, 'throughput': True}
+
+
+def percentile(ordered, q):
+    """Get the q-th percentile of sorted samples, by nearest rank."""
+    rank = int(round(q / 100.0 * len(ordered) + 0.5)) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def latencies(durations):
+    """Get the summary of the durations (seconds) of calls, in ms."""
+    ordered = sorted(duration * 1000 for duration in durations)
+    return dict(
+        mean=sum(ordered) / len(ordered),
+        p50=percentile(ordered, 50),
+        p90=percentile(ordered, 90),
+        p99=percentile(ordered, 99),
+        max=ordered[-1],
+    )
+
+
+def bench_service(http_service, port, documents, calls, concurrency):
+    """Make calls from concurrency threads through a Reaktor with
+    http_service, get their throughput (calls/s) and latencies.
+    """
+    reaktor = Reaktor(http_service=http_service, host='127.0.0.1', port=port,
+                      path='/rpc', ssl=False, connect_timeout=5, run_timeout=60,
+                      communication_error_class='reaktor.ReaktorIOError',
+                      keep_history=False)
+    args = payloads.request(documents)
+    # connections are set up and codecs warmed
+    for _ in range(concurrency):
+        reaktor.call(FUNCTION, args)
+
+    durations, errors, tickets = [], [], count()
+
+    def worker():
+        while next(tickets) < calls:
+            start = time.time()
+            try:
+                reaktor.call(FUNCTION, args)
+            except ReaktorError as e:
+                errors.append(e)
+                continue
+            durations.append(time.time() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    result = latencies(durations) if durations else {}
+    result.update(calls=calls, errors=len(errors),
+                  throughput=len(durations) / elapsed)
+    return result
+
+
+def timings(function, number, repeat=5):
+    """Get the best and median time of function, in ms per run."""
+    runs = sorted(timeit.repeat(function, number=number, repeat=repeat))
+    return dict(best=runs[0] * 1000 / number,
+                median=runs[len(runs) // 2] * 1000 / number)
+
+
+def bench_phases(documents, number):
+    """Time the phases of a call with the default codecs of a Reaktor."""
+    codec, hook_codec = get_codec(), get_codec(object_hooks=True)
+    params = payloads.request(documents)
+    response = json.dumps(payloads.envelope(payloads.documents(documents)),
+                          ensure_ascii=False).encode('utf-8')
+    result = codec.decode(response)['result']
+    return {
+        'encode': timings(lambda: codec.encode_request(FUNCTION, params, 'abcd1234'),
+                          number * 10),
+        'decode': timings(lambda: codec.decode(response), number),
+        'convert': timings(lambda: ReaktorObject.to_reaktorobject(result), number),
+        'decode_objects': timings(
+            lambda: hook_codec.decode(response, object_pairs_hook=ReaktorObject),
+            number),
+    }, dict(codec=codec.name, object_codec=hook_codec.name, response_size=len(response))
+
+
+def revision():
+    """Get the git revision of the working tree, None outside of one."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options):
+    """Run the suite, get its results."""
+    phases, codecs = bench_phases(options.documents, options.number)
+    services = {}
+    with StubServer(options.documents, options.latency / 1000.0) as port:
+        for name in options.services:
+            services[name] = bench_service(SERVICES[name], port, options.documents,
+                                           options.calls, options.concurrency)
+    config = dict((key, getattr(options, key)) for key in (
+        'documents', 'latency', 'calls', 'concurrency', 'number'))
+    config.update(codecs)
+    return dict(
+        holon=__version__,
+        revision=revision(),
+        python=platform.python_version(),
+        timestamp=time.time(),
+        config=config,
+        phases=phases,
+        services=services,
+    )
+
+
+def report(results, baseline=None):
+    """Print results, relative to the ones of baseline if given."""
+    config = results['config']
+    print 'holon %s (%s), python %s' % (results['holon'], results['revision'],
+                                        results['python'])
+    print ('%(documents)i documents (%(response_size)i bytes), latency %(latency)i ms, '
+           '%(calls)i calls from %(concurrency)i threads' % config)
+
+    def change(section, name, metric, value):
+        try:
+            before = baseline[section][name][metric]
+        except (TypeError, KeyError):
+            return ''
+        if metric not in COMPARED or not before:
+            return ''
+        ratio = value / before
+        better = ratio > 1 if COMPARED[metric] else ratio < 1
+        return ' (%+.1f%% %s)' % ((ratio - 1) * 100, 'better' if better else 'worse')
+
+    print 'phases (ms per run)'
+    for name, values in sorted(results['phases'].items()):
+        print '  %-16s best %9.3f%s  median %9.3f' % (
+            name, values['best'], change('phases', name, 'best', values['best']),
+            values['median'])
+    print 'services'
+    for name, values in sorted(results['services'].items()):
+        if not values.get('p50'):
+            print '  %-16s all %i calls failed' % (name, values['errors'])
+            continue
+        print '  %-16s %8.1f calls/s%s' % (
+            name, values['throughput'],
+            change('services', name, 'throughput', values['throughput']))
+        for metric in ('mean', 'p50', 'p90', 'p99', 'max'):
+            print '  %16s %8.3f ms%s' % (
+                metric, values[metric], change('services', name, metric, values[metric]))
+        if values['errors']:
+            print '  %16s %8i' % ('errors', values['errors'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Benchmark suite of holon.')
+    parser.add_argument('--documents', type=int, default=100,
+                        help=u'documents of each response')
+    parser.add_argument('--latency', type=int, default=0,
+                        help=u'ms the stub server delays each response')
+    parser.add_argument('--calls', type=int, default=500,
+                        help=u'calls made through each http service')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help=u'threads making the calls')
+    parser.add_argument('--number', type=int, default=20,
+                        help=u'runs of each phase per repetition')
+    parser.add_argument('--services', nargs='+', choices=sorted(SERVICES),
+                        default=sorted(SERVICES))
+    parser.add_argument('--output', help=u'file to save the results to, as JSON')
+    parser.add_argument('--compare', help=u'results of another run to compare to')
+    options = parser.parse_args(argv)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+    results = run(options)
+    report(results, baseline)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,38 +1,30 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-"""Example for howto patch ugly UUID's in results of txtr-reaktor.
+"""Example for howto translate ugly UUID's in results of txtr-reaktor.
 """
 
 if __name__ == "__main__":
 
     import os, sys
-    sys.path.insert(0,
-        os.path.join(os.path.dirname(__file__), os.pardir, 'holon')) # pythonpath
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir)) # pythonpath
 
-    import reaktor, patch
+    from holon import Reaktor
+    from holon.translate import KeyTranslator
 
-    reaktor.REAKTOR_HOST = u"staging.txtr.com"
-    reaktor.REAKTOR_PORT = 80
-    reaktor.REAKTOR_SSL  = False
-    reaktor.REAKTOR_PATH = u"/json/rpc?v=2"
-
-    reaktor = reaktor.Reaktor()
-    token, docId = "txtr.de", "bfzs289"
     keepIds = False
+    reaktor = Reaktor(http_service='services.pycurl.PyCurlHttpService',
+                      host=u"staging.txtr.com", port=80, ssl=False,
+                      path=u"/json/rpc?v=2",
+                      key_translator=KeyTranslator(keep_ids=keepIds))
+    token, docId = "txtr.de", "bfzs289"
 
     doc = reaktor.WSDocMgmt.getDocument(token, docId)
     # access author via keys of dicts
-    print doc["attributes"]["20514d7d-7591-49a4-a62d-f5c02a8f5edd"]
-    # the same with attributes
-    # sadly python doesn't accept attributes with "-" in its names
-    print doc.attributes["20514d7d-7591-49a4-a62d-f5c02a8f5edd"]
-
-    patch.patch(doc, keepIds)
-    # access author via keys of dicts
     print doc["attributes"]["author"]
     # the same with attributes
+    # without translation, python doesn't accept attributes with "-" in its
+    # names: doc.attributes["20514d7d-7591-49a4-a62d-f5c02a8f5edd"]
     print doc.attributes.author
 
-    # You should now have seen for times the author 'Hart, Maarten &apos;t'
-
+    # You should now have seen twice the author 'Hart, Maarten &apos;t'
@@ -11,6 +11,7 @@ __version__ = "0.1.4"
 
 # these are imported for module visibility, do not clean up
 from reaktor import Reaktor
+from reaktor import AsyncReaktor
 from reaktor import ReaktorApiError
 from reaktor import ReaktorAuthError
 from reaktor import ReaktorAccessError
@@ -21,3 +22,4 @@ from reaktor import ReaktorError
 from reaktor import ReaktorHttpError
 from reaktor import ReaktorIOError
 from reaktor import ReaktorJSONRPCError
+from reaktor import ReaktorTimeoutError
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Caching of results of read-only txtr-reaktor functions.
+
+    cache = ResponseCache({'WSDocMgmt.getDocument': 300,
+                           'WSCatalog.getCategories': 3600})
+    reaktor = Reaktor(cache=cache, **config)
+
+Only the listed functions are cached, each for its own TTL in seconds.
+Results are kept json-encoded, so every caller gets objects of its own and
+shared backends (memcached, redis, ...) can store them as they are.
+
+Identical calls running at the same time can be coalesced, so only one of
+them is sent to txtr-reaktor while the others wait for its outcome:
+
+    reaktor = Reaktor(coalesce=['WSDocMgmt.getDocument'], **config)
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def canonical(params):
+    """Get the same string for equal (JSON-serializable) params."""
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+
+class CacheBackend(object):
+    """Interface of the storages used by ResponseCache. Implement it to share
+    a cache between processes.
+    """
+
+    def get(self, key):
+        """Get the value stored for key, None if there is none."""
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl):
+        """Store value for key, for ttl seconds."""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Forget the value stored for key."""
+        raise NotImplementedError()
+
+    def clear(self):
+        """Forget all values."""
+        raise NotImplementedError()
+
+    def delete_prefix(self, prefix):
+        """Forget the values of the keys starting with prefix, if the storage
+        can. Otherwise they are left to expire, which is fine since they
+        are not asked for anymore.
+        """
+        pass
+
+
+class LocalCache(CacheBackend):
+    """Thread-safe in-process CacheBackend, evicting the least recently used
+    value once it holds max_size values.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return None
+            if expires < time.time():
+                return None
+            self._data[key] = expires, value  # most recently used
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = time.time() + ttl, value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+def new_generation():
+    """Get a generation token, unique across processes."""
+    return os.urandom(6).encode('hex')
+
+
+class ResponseCache(object):
+    """Cache of the results of txtr-reaktor functions, keyed on the function,
+    its generation and its canonicalised params.
+
+    The generation of each function is kept in the backend, so invalidating
+    a function invalidates it for all processes sharing the backend. It is
+    a random token rather than a counter, so a generation that expired or
+    was evicted never leads back to older results.
+    """
+    # seconds the generation of a function is kept, it is renewed on expiry
+    generation_ttl = 30 * 24 * 3600
+
+    def __init__(self, methods, backend=None, max_size=1000):
+        """Init.
+        methods: dict, TTL in seconds by '<interface>.<function>' to cache
+        backend: CacheBackend, defaults to a LocalCache of max_size values
+        """
+        self.methods = dict(methods)
+        self.backend = backend if backend is not None else LocalCache(max_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def cacheable(self, function):
+        return function in self.methods
+
+    def generation(self, function):
+        """Get the current generation of function from the backend, starting
+        a new one if there is none.
+        """
+        key = 'gen:%s' % function
+        generation = self.backend.get(key)
+        if generation is None:
+            generation = new_generation()
+            self.backend.set(key, generation, self.generation_ttl)
+        return generation
+
+    def key(self, function, params):
+        """Get the backend key for a call."""
+        return '%s:%s:%s' % (function, self.generation(function),
+                             hashlib.sha1(canonical(params)).hexdigest())
+
+    def get(self, function, params):
+        """Get the cached (json-encoded) result of a call, None if there is
+        none.
+        """
+        value = self.backend.get(self.key(function, params))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, function, params, value):
+        """Cache the (json-encoded) result of a call."""
+        self.backend.set(self.key(function, params), value,
+                         self.methods[function])
+
+    def invalidate(self, function=None, params=None):
+        """Forget cached results.
+        function: '<interface>.<function>', defaults to all functions
+        params: forget the result for these params only, defaults to all
+        """
+        if function is None:
+            self.backend.clear()
+        elif params is not None:
+            self.backend.delete(self.key(function, params))
+        else:
+            # the keys of older generations are not asked for anymore
+            self.backend.set('gen:%s' % function, new_generation(),
+                             self.generation_ttl)
+            self.backend.delete_prefix('%s:' % function)
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses)
+
+
+class SingleFlight(object):
+    """Coalesces concurrent identical calls: while a call for a key is in
+    flight, other threads calling for the same key wait for its outcome
+    instead of calling themselves.
+    """
+
+    class Flight(object):
+        """A call in flight. Internal only."""
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.value, self.error = None, None
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """Get the return value of function(), or raise its exception,
+        sharing it with the concurrent callers for the same key.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = SingleFlight.Flight()
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = function()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return flight.value
+
+    def stats(self):
+        with self._lock:
+            return dict(calls=self.calls, shared=self.shared,
+                        in_flight=len(self._flights))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""JSON codecs used by Reaktor to encode requests and decode responses.
+
+Reaktor picks the fastest codec available unless told otherwise:
+
+    reaktor = Reaktor(codec='simplejson', **config)
+
+Codecs decode straight from the raw (utf-8 encoded) response data, all of
+them into unicode strings like python batteries' json. Codecs with
+object_hooks can build the objects of a response while decoding it,
+which saves walking the decoded structure a second time:
+
+    codec.decode(data, object_pairs_hook=ReaktorObject)
+"""
+from collections import OrderedDict
+from importlib import import_module
+
+
+class Codec(object):
+    """Base class of the codecs.
+    module: name of the module implementing the codec
+    """
+    name = None
+    module = None
+    # whether decode supports object_pairs_hook
+    object_hooks = False
+    # bound on the number of envelope templates kept
+    max_envelopes = 1000
+
+    def __init__(self):
+        """Init.
+        Raises ImportError if the module of the codec is not installed.
+        """
+        self.json = import_module(self.module)
+        self._envelopes = {}
+
+    def encode_request(self, function, params, request_id):
+        """Get the JSON-RPC request envelope for a call. Only params are
+        encoded per call, the part up to them is encoded once per function.
+        request_id: string, must not need escaping (see reaktor.RequestIds)
+        """
+        try:
+            head = self._envelopes[function]
+        except KeyError:
+            if len(self._envelopes) >= self.max_envelopes:
+                self._envelopes.clear()
+            head = self._envelopes[function] = '{"method":%s,"params":' % (
+                self.encode(function))
+        return '%s%s,"id":"%s"}' % (head, self.encode(params), request_id)
+
+    def encode(self, obj):
+        """Get the JSON string for obj."""
+        return self.json.dumps(obj)
+
+    def decode(self, data, object_pairs_hook=None):
+        """Get the python structure for a JSON string or utf-8 encoded bytes.
+        object_pairs_hook: callable building the objects from lists of
+                           (key, value) pairs instead of dicts, only for
+                           codecs with object_hooks
+        """
+        if object_pairs_hook is None:
+            return self.json.loads(data)
+        return self.json.loads(data, object_pairs_hook=object_pairs_hook)
+
+    def __repr__(self):
+        return u'<%s %s>' % (self.__class__.__name__, self.name)
+
+
+class JsonCodec(Codec):
+    """Codec using python batteries' json."""
+    name = module = 'json'
+    object_hooks = True
+
+
+class SimpleJsonCodec(Codec):
+    """Codec using simplejson, speedy with its C extension."""
+    name = module = 'simplejson'
+    object_hooks = True
+
+    def decode(self, data, object_pairs_hook=None):
+        """See Codec.decode."""
+        # simplejson decodes ASCII strings of bytes into str
+        if isinstance(data, str):
+            data = data.decode('utf-8')
+        return super(SimpleJsonCodec, self).decode(data, object_pairs_hook)
+
+
+class UJsonCodec(Codec):
+    """Codec using ultrajson."""
+    name = module = 'ujson'
+
+
+# codecs in order of preference
+CODECS = OrderedDict((codec.name, codec) for codec in (
+    UJsonCodec,
+    SimpleJsonCodec,
+    JsonCodec,
+))
+
+
+def available_codecs(object_hooks=False):
+    """Get the names of the installed codecs, in order of preference.
+    object_hooks: only the ones supporting object_pairs_hook
+    """
+    names = []
+    for name, codec in CODECS.items():
+        if object_hooks and not codec.object_hooks:
+            continue
+        try:
+            import_module(codec.module)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_codec(codec=None, object_hooks=False):
+    """Get a codec.
+    codec: Codec instance, name of a codec (see CODECS) or None for the
+           fastest one installed
+    object_hooks: pick the fastest one supporting object_pairs_hook if codec
+                  is None
+    Raises ImportError if the requested codec is not installed and
+    ValueError if it is not known at all.
+    """
+    if isinstance(codec, Codec):
+        return codec
+    if codec is None:
+        return CODECS[available_codecs(object_hooks)[0]]()
+    try:
+        return CODECS[codec]()
+    except KeyError:
+        raise ValueError(u"unknown codec '%s', use one of %s" % (
+            codec, u', '.join(CODECS)))
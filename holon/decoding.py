@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Decode options of Reaktor.call saving memory on large results.
+
+    # only the fields needed
+    documents = reaktor.WSDocMgmt.getDocuments(
+        token, document_ids,
+        fields=['documentID', 'attributes.title', 'categories.name'])
+    # equal short keys and strings shared across objects and calls
+    documents = reaktor.WSDocMgmt.getDocuments(token, document_ids, intern=True)
+
+The items of list results are decoded and projected one after the other
+while the response is parsed, so the fields dropped are never held for all
+items at once. Other results are decoded at once and then projected.
+"""
+from .streaming import ResultParser
+
+
+# response data is parsed in chunks of that many bytes, so it is never
+# decoded to unicode as a whole
+CHUNK_SIZE = 65536
+
+
+def compile_fields(fields):
+    """Get the tree of a list of paths like 'attributes.title': a dict of the
+    keys to keep, mapping to True to keep all of a value or to the tree of
+    the keys to keep of it.
+    """
+    tree = {}
+    for path in fields:
+        node = tree
+        keys = path.split('.')
+        for key in keys[:-1]:
+            child = node.get(key)
+            if child is True:
+                # all of it is kept anyway
+                break
+            if child is None:
+                child = node[key] = {}
+            node = child
+        else:
+            node[keys[-1]] = True
+    return tree
+
+
+def project(value, tree):
+    """Get the fields of a tree of a decoded value. The objects of lists are
+    projected alike.
+    """
+    if tree is True:
+        return value
+    if isinstance(value, list):
+        return [project(member, tree) for member in value]
+    if isinstance(value, dict):
+        return type(value)([(key, project(value[key], subtree))
+                            for key, subtree in tree.iteritems() if key in value])
+    return value
+
+
+def chunked(data, size=CHUNK_SIZE):
+    """Iterate data in chunks of size."""
+    for start in xrange(0, len(data), size):
+        yield data[start:start + size]
+
+
+class Interner(object):
+    """Table of the short keys and string values of decoded objects, making
+    equal ones the same object, within and across responses.
+    Once the table holds max_size strings it takes no new ones, but keeps
+    sharing the ones it has. It is never cleared, so concurrent calls don't
+    lose the strings they share: the keys and values repeated most are
+    usually the first ones seen.
+    """
+
+    def __init__(self, max_length=32, max_key_length=64, max_size=100000):
+        """Init.
+        max_length: int, string values of at most that many characters are
+                    interned
+        max_key_length: int, keys of at most that many characters are
+                        interned, enough for the UUID keys of attributes
+        max_size: int, number of strings the table takes at most
+        """
+        self.max_length = max_length
+        self.max_key_length = max_key_length
+        self.max_size = max_size
+        self.strings = {}
+
+    def hook(self, object_pairs_hook):
+        """Wrap an object_pairs_hook to intern the keys and values of the
+        pairs first.
+        """
+        strings, lookup = self.strings, self.strings.get
+        max_length, max_key_length, max_size = \
+            self.max_length, self.max_key_length, self.max_size
+
+        def shared(string):
+            interned = lookup(string)
+            if interned is not None:
+                return interned
+            if len(strings) < max_size:
+                strings.setdefault(string, string)
+            return string
+
+        def intern_pairs(pairs):
+            return object_pairs_hook([
+                (shared(key) if len(key) <= max_key_length else key,
+                 shared(value)
+                 if isinstance(value, basestring) and len(value) <= max_length
+                 else value)
+                for key, value in pairs])
+        return intern_pairs
+
+
+class Decoding(object):
+    """Decode options of a call."""
+
+    def __init__(self, fields=None, interner=None):
+        """Init.
+        fields: list of the paths of the fields of the result to keep, like
+                'attributes.title', None for all
+        interner: Interner, None not to intern
+        """
+        self.fields = compile_fields(fields) if fields is not None else None
+        self.interner = interner
+
+    def decode(self, codec, data, object_pairs_hook, envelope=True):
+        """json-decode a JSON-RPC response.
+        codec: codec.Codec with object_hooks
+        object_pairs_hook: callable building the objects
+        envelope: bool, False if data is a result only, like the cached ones,
+                  which is projected as a whole
+        """
+        if self.interner is not None:
+            object_pairs_hook = self.interner.hook(object_pairs_hook)
+        if self.fields is None or not envelope:
+            data = codec.decode(data, object_pairs_hook=object_pairs_hook)
+            if self.fields is None:
+                return data
+            return project(data, self.fields)
+
+        # data is in memory already, values are not bounded
+        parser = ResultParser(chunked(data), codec.json.JSONDecoder(
+            object_pairs_hook=object_pairs_hook), max_value_size=None,
+            lists_only=True)
+        items = [project(item, self.fields) for item in parser]
+        if parser.list_result is False:
+            # parsing it in chunks would decode it again for every chunk
+            # it spans, and it takes the memory of the response anyway
+            response = dict(codec.decode(data, object_pairs_hook=object_pairs_hook))
+            response['result'] = project(response.get('result'), self.fields)
+            return response
+        response = dict(parser.envelope)
+        if parser.list_result:
+            response['result'] = items
+        return response
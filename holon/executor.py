@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Running blocking calls of a Reaktor concurrently on a pool of threads.
+
+    future = reaktor.submit('WSDocMgmt.getDocument', [token, document_id])
+    document = future.result()
+"""
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+
+
+class CallFuture(object):
+    """Pending result of a callable run by an Executor."""
+    __slots__ = ('async_result', 'started', 'timeout_error_class')
+
+    def __init__(self, timeout_error_class):
+        self.async_result = None
+        # when a worker started to run the callable, None while queued
+        self.started = None
+        self.timeout_error_class = timeout_error_class
+
+    @property
+    def done(self):
+        return self.async_result.ready()
+
+    def run(self, function, args):
+        """Run the callable, on a worker. Internal only."""
+        self.started = time.time()
+        return function(*args)
+
+    def result(self, timeout=None):
+        """Get the return value of the callable, or raise its exception.
+        Blocks until it is done.
+        timeout: float, seconds the callable may run (not counting the time
+                 it was queued), raises timeout_error_class once it ran for
+                 longer. The callable itself goes on, its result is dropped.
+        """
+        if timeout is not None:
+            while not self.async_result.ready():
+                started = self.started
+                if started is None:
+                    self.async_result.wait(timeout)
+                    continue
+                remaining = started + timeout - time.time()
+                if remaining <= 0:
+                    raise self.timeout_error_class(
+                        u"call did not finish within %ss" % timeout)
+                self.async_result.wait(remaining)
+        return self.async_result.get()
+
+
+class Executor(object):
+    """Runs callables on a pool of threads, which is started on first use.
+    As each thread keeps its own transport (curl handles, or connections
+    taken from a pool), calls running on the same thread reuse it. Forked
+    processes start a pool of their own, the threads are not forked.
+    """
+
+    def __init__(self, max_workers, timeout_error_class=None):
+        """Init.
+        timeout_error_class: raised by CallFuture.result on timeouts,
+                             defaults to multiprocessing.TimeoutError
+        """
+        self.max_workers = max_workers
+        self.timeout_error_class = timeout_error_class or TimeoutError
+        self._pool = None
+        self._lock = threading.Lock()
+        # the process the pool was started in
+        self._pid = os.getpid()
+
+    def submit(self, function, *args):
+        """Run function(*args) on the pool.
+        return: CallFuture
+        """
+        pool = self._pool
+        if pool is None or self._pid != os.getpid():
+            pool = self._start()
+        future = CallFuture(self.timeout_error_class)
+        future.async_result = pool.apply_async(future.run, (function, args))
+        return future
+
+    def _start(self):
+        """Get the pool, started if need be. Internal only."""
+        if self._pid != os.getpid():
+            # the pool of the parent process has no threads here, and its
+            # lock may have been held by one of them while forking
+            self._pool, self._lock = None, threading.Lock()
+            self._pid = os.getpid()
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_workers)
+            return self._pool
+
+    def shutdown(self):
+        """Stop the threads once the callables submitted are done."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Hooks into the calls of a Reaktor, for tracing and metrics.
+
+    metrics = MetricsCollector()
+    reaktor = Reaktor(hooks=[metrics], **config)
+    ...
+    print metrics.prometheus_text()
+
+Hooks get a CallInfo, whose timings hold the duration (ms) of the phases
+of the call done so far:
+    serialize: encoding the request
+    network: the http call, waiting for and reading the response
+    start_transfer: until the first byte of the response arrived, if the
+                    http service can tell
+    decode: decoding the response
+    convert: converting the result with the data_converter
+"""
+import threading
+import time
+
+
+class CallInfo(object):
+    """A call of a Reaktor, as passed to hooks.
+    cached: bool, whether the result was taken from the cache
+    coalesced: bool, whether the result was shared by an identical call
+    """
+    __slots__ = ('function', 'params', 'request_id', 'timings', 'response',
+                 'cached', 'coalesced')
+
+    def __init__(self, function, params):
+        self.function, self.params = function, params
+        self.request_id, self.response = None, None
+        self.timings = {}
+        self.cached = self.coalesced = False
+
+    def __repr__(self):
+        return u'<CallInfo %s %s>' % (self.function, self.timings)
+
+
+class PhaseTimer(object):
+    """Context manager timing a phase of a call into its timings."""
+    __slots__ = ('call', 'phase', 'start')
+
+    def __init__(self, call, phase):
+        self.call, self.phase = call, phase
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.call.timings[self.phase] = (time.time() - self.start) * 1000
+
+
+class NullTimer(object):
+    """PhaseTimer of calls nobody hooks into."""
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def timed(call, phase):
+    """Get a context manager timing a phase of call.
+    call: CallInfo, None if the call is not hooked into
+    """
+    return NULL_TIMER if call is None else PhaseTimer(call, phase)
+
+
+class ReaktorHook(object):
+    """Base class of hooks. Errors raised by hooks are logged, they don't
+    fail the call.
+    """
+
+    def before_send(self, call):
+        """The request is about to be sent. call: CallInfo"""
+        pass
+
+    def after_response(self, call):
+        """The call succeeded and its result is converted. call: CallInfo"""
+        pass
+
+    def on_error(self, call, error):
+        """The call failed. call: CallInfo, error: ReaktorError"""
+        pass
+
+
+class PhaseStats(object):
+    """Count, sum and histogram of the durations of a phase."""
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self):
+        self.count, self.total = 0, 0.0
+        self.buckets = [0] * len(MetricsCollector.BUCKETS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(MetricsCollector.BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class MetricsCollector(ReaktorHook):
+    """In-memory metrics of the phases of calls, per function, which can be
+    exported in the Prometheus text format.
+    """
+    # upper bounds (seconds) of the histogram buckets
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0, float('inf'))
+
+    def __init__(self, prefix='holon'):
+        self.prefix = prefix
+        self.phases = {}
+        self.errors = {}
+        # bytes of the response bodies by (function, 'wire' or 'decoded')
+        self.sizes = {}
+        self._lock = threading.Lock()
+
+    def after_response(self, call):
+        self._add_timings(call)
+        response = call.response
+        if response is None or response.size is None:
+            return
+        with self._lock:
+            for key, size in (((call.function, 'wire'), response.wire_size),
+                              ((call.function, 'decoded'), response.size)):
+                self.sizes[key] = self.sizes.get(key, 0) + size
+
+    def on_error(self, call, error):
+        self._add_timings(call)
+        key = call.function, error.__class__.__name__
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def _add_timings(self, call):
+        with self._lock:
+            for phase, duration in call.timings.items():
+                key = call.function, phase
+                try:
+                    stats = self.phases[key]
+                except KeyError:
+                    stats = self.phases[key] = PhaseStats()
+                stats.add(duration / 1000.0)
+
+    def snapshot(self):
+        """Get count and mean duration (ms) by (function, phase)."""
+        with self._lock:
+            return dict((key, dict(count=stats.count,
+                                   mean=stats.total * 1000 / stats.count))
+                        for key, stats in self.phases.items())
+
+    def prometheus_text(self):
+        """Get the metrics in the Prometheus text exposition format."""
+        name = '%s_call_phase_seconds' % self.prefix
+        lines = ['# HELP %s Duration of the phases of reaktor calls.' % name,
+                 '# TYPE %s histogram' % name]
+        with self._lock:
+            for (function, phase), stats in sorted(self.phases.items()):
+                labels = 'function="%s",phase="%s"' % (function, phase)
+                cumulated = 0
+                for bound, count in zip(self.BUCKETS, stats.buckets):
+                    cumulated += count
+                    lines.append('%s_bucket{%s,le="%s"} %i' % (
+                        name, labels, '+Inf' if bound == float('inf') else repr(bound),
+                        cumulated))
+                lines.append('%s_sum{%s} %r' % (name, labels, stats.total))
+                lines.append('%s_count{%s} %i' % (name, labels, stats.count))
+
+            errors = '%s_call_errors_total' % self.prefix
+            lines.append('# HELP %s Failed reaktor calls.' % errors)
+            lines.append('# TYPE %s counter' % errors)
+            for (function, error), count in sorted(self.errors.items()):
+                lines.append('%s{function="%s",error="%s"} %i' % (
+                    errors, function, error, count))
+
+            sizes = '%s_response_bytes_total' % self.prefix
+            lines.append('# HELP %s Bytes of the responses, as transferred '
+                         'and decoded.' % sizes)
+            lines.append('# TYPE %s counter' % sizes)
+            for (function, encoding), size in sorted(self.sizes.items()):
+                lines.append('%s{function="%s",encoding="%s"} %i' % (
+                    sizes, function, encoding, size))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Iterating over the items of txtr-reaktor functions returning lists page by
+page, see Reaktor.paginate:
+
+    # WSCatalog.getDocuments(token, catalog_id, offset, size)
+    for document in reaktor.paginate('WSCatalog.getDocuments',
+                                     [token, catalog_id, 0, 0],
+                                     offset_index=2, size_index=3,
+                                     page_size=500, concurrency=4):
+        index(document)
+
+Pages are fetched ahead while the current one is consumed. The end is
+reached with the first page holding less than page_size items, the pages
+fetched ahead of it are dropped.
+"""
+from collections import deque
+
+
+class Paginator(object):
+    """Iterable over the items of all pages of a paginated call."""
+
+    def __init__(self, endpoint, function, args, offset_index, size_index,
+                 page_size=100, concurrency=1, prefetch=True, start=0,
+                 data_converter=None, headers=None, timeout=None):
+        """Init. Internal only, see Reaktor.paginate.
+        endpoint: Reaktor submitting the calls
+        """
+        if page_size < 1:
+            raise ValueError(u"page_size must be positive, got %s" % page_size)
+        self.endpoint, self.function, self.args = endpoint, function, list(args)
+        self.offset_index, self.size_index = offset_index, size_index
+        self.page_size, self.start = page_size, start
+        # pages in flight at once
+        self.window = max(concurrency, 2 if prefetch else 1)
+        self.data_converter, self.headers = data_converter, headers
+        self.timeout = timeout
+
+    def page_args(self, offset):
+        """Get the args of the call fetching the page at offset."""
+        args = list(self.args)
+        args[self.offset_index] = offset
+        args[self.size_index] = self.page_size
+        return args
+
+    def __iter__(self):
+        pending = deque()
+        offset = self.start
+        while True:
+            while len(pending) < self.window:
+                pending.append(self.endpoint.submit(
+                    self.function, self.page_args(offset),
+                    self.data_converter, self.headers, self.timeout))
+                offset += self.page_size
+            page = pending.popleft().result()
+            for item in page:
+                yield item
+            if len(page) < self.page_size:
+                return
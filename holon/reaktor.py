@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
+import binascii
+import itertools
 import random
 import re
 import sys
@@ -8,10 +10,18 @@ import string
 import logging
 import urllib2
 import inspect
+import time
 from importlib import import_module
-from json import dumps as jsonwrite
-from json import loads as jsonread
+from types import MethodType
 from . import services
+from .cache import SingleFlight, canonical
+from .stats import CallHistory, CallRecord, ReaktorStats
+from .streaming import ResultParser
+from .codec import get_codec
+from .decoding import Decoding, Interner, compile_fields, project
+from .executor import Executor
+from .hooks import CallInfo, timed
+from .pagination import Paginator
 from . import __version__
 
 
@@ -39,6 +49,48 @@ except AttributeError:
 
 __GETTER_REGEX__ = re.compile("get([A-Z].*)")
 
+# number of calls kept in the history of a Reaktor by default
+DEFAULT_HISTORY_SIZE = 1000
+# number of threads running the calls submitted to a Reaktor by default
+DEFAULT_MAX_WORKERS = 8
+
+# kinds of attributes of ReaktorObject's
+ITEM, GETTER, ENUM = range(3)
+
+# resolution of attribute names of ReaktorObject's, see resolve_attribute
+__ATTRIBUTES__ = {}
+# bound on the number of resolutions kept, names beyond it are resolved
+# on each access
+MAX_ATTRIBUTES = 10000
+
+
+def resolve_attribute(name):
+    """Get the resolution of an attribute name of ReaktorObject's, a tuple of
+    its kind, the key it maps to and the function used as getter if it is
+    one. Resolutions are built once per name, as long as there is room for
+    them. Internal only.
+    """
+    try:
+        return __ATTRIBUTES__[name]
+    except KeyError:
+        pass
+
+    match = __GETTER_REGEX__.match(name)
+    if match:
+        # a getter method
+        key = match.group(1)
+        key = key[0].lower() + key[1:]
+        resolution = GETTER, key, lambda self: self[key]
+    elif name == "name":
+        # maybe a java enum
+        resolution = ENUM, name, lambda self: self["name"]
+    else:
+        resolution = ITEM, name, None
+
+    if len(__ATTRIBUTES__) < MAX_ATTRIBUTES:
+        __ATTRIBUTES__[name] = resolution
+    return resolution
+
 
 class ReaktorObject(dict):
     """A local wrapper for datastructures returned by calls to txtr-reaktor.
@@ -66,6 +118,24 @@ class ReaktorObject(dict):
 
         return attr  # attr should be a simple datatype - string, int, ...
 
+    @staticmethod
+    def from_decoded(attr):
+        """Get a result decoded into ReaktorObject's right away (see
+        Reaktor.decode) as it is. Internal only.
+        """
+        if type(attr) is dict:
+            # the default of a response without result
+            return ReaktorObject(attr)
+        return attr
+
+    @staticmethod
+    def to_lazy_reaktorobject(attr):
+        """Translation of dicts|lists into [lists of] ReaktorObject's, which
+        translate nested dicts|lists only once they are accessed.
+        Use it as data_converter of Reaktor.call for large results.
+        """
+        return lazy_reaktorobject(attr)
+
     def __init__(self, data=None):
         """Init. Internal only.
         data: dict, defaults to None
@@ -77,27 +147,39 @@ class ReaktorObject(dict):
         """Implements dequalification of an unknown attribute.
         Raises AttributeError for unknown attributes.
         """
-        match = __GETTER_REGEX__.match(name)
-        if match:
-             # requested a getter method
-            key = match.group(1)
-            key = key[0].lower() + key[1:]
+        try:
+            kind, key, getter = __ATTRIBUTES__[name]
+        except KeyError:
+            kind, key, getter = resolve_attribute(name)
+        if kind is GETTER:
+            # requested a getter method
             if key in self:
-                return lambda: self[key]
+                return self._bind(name, getter)
 
-        elif name == "name" and len(self) == 1 and name in self:
+        elif kind is ENUM and len(self) == 1 and key in self:
             # this is a java enum
-            return lambda: self["name"]
+            return self._bind(name, getter)
 
         else:
             try:
-                return self[name]
+                return self[key]
             except KeyError:
                 pass
 
         raise AttributeError(
             u"ReaktorObject object has no attribute '%s'" % name)
 
+    def _bind(self, name, getter):
+        """Bind getter to the object once, later accesses of name find it
+        without __getattr__. Internal only.
+        """
+        method = self.__dict__[name] = MethodType(getter, self)
+        return method
+
+    def __getstate__(self):
+        """The bound getters are not pickled, they are bound again."""
+        return None
+
     def __setattr__(self, name, val):
         """Implements setting an attribute.
         Raises RuntimeError because setting attributes makes no sense here.
@@ -111,6 +193,78 @@ class ReaktorObject(dict):
         raise RuntimeError(u"ReaktorObject object is readonly.")
 
 
+def lazy_reaktorobject(attr):
+    """Wrap a dict|list of a json-decoded result into a LazyReaktorObject|
+    LazyReaktorList. Internal only.
+    """
+    if type(attr) is dict:
+        return LazyReaktorObject(attr)
+
+    if type(attr) is list:
+        return LazyReaktorList(attr)
+
+    return attr  # a simple datatype or already wrapped
+
+
+class LazyReaktorObject(ReaktorObject):
+    """A ReaktorObject wrapping its nested dicts|lists on first access only.
+    Wrapped values replace the plain ones, so each is wrapped once at most.
+    See ReaktorObject.to_lazy_reaktorobject.
+    """
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        wrapped = lazy_reaktorobject(value)
+        if wrapped is not value:
+            dict.__setitem__(self, key, wrapped)
+        return wrapped
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield key, self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class LazyReaktorList(list):
+    """A list wrapping its dicts|lists into ReaktorObject's on first access
+    only. See LazyReaktorObject.
+    """
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazyReaktorList(list.__getitem__(self, index))
+        value = list.__getitem__(self, index)
+        wrapped = lazy_reaktorobject(value)
+        if wrapped is not value:
+            list.__setitem__(self, index, wrapped)
+        return wrapped
+
+    def __getslice__(self, i, j):
+        return LazyReaktorList(list.__getslice__(self, i, j))
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def __reversed__(self):
+        for index in xrange(len(self) - 1, -1, -1):
+            yield self[index]
+
+
 class ReaktorMeta(type):
     """Metaclass for the reaktor object. It hijacks the kwargs on Reaktor class
     instantiation and replaces the http service params by a shiny object of the
@@ -127,6 +281,9 @@ class ReaktorMeta(type):
         http_kwargs.pop('self')
         for k in http_kwargs:
             http_kwargs[k] = kwargs.pop(k, None)
+        for k in http_class.options:
+            if k in kwargs:
+                http_kwargs[k] = kwargs.pop(k)
 
         http_service = self.build_http_service(http_class, http_kwargs)
         try:
@@ -192,107 +349,555 @@ class Reaktor(object):
         self.__dict__[interface_name] = interface  # cache it
         return interface
 
-    def __init__(self, http_service, keep_history=False):
+    def __init__(self, http_service, keep_history=False, codec=None,
+                 cache=None, coalesce=None, log_sample_rate=1.0,
+                 log_max_length=None, hooks=None,
+                 max_workers=DEFAULT_MAX_WORKERS, retry_policy=None,
+                 circuit_breaker=None, idempotent=None, decode_objects=True,
+                 key_translator=None):
         """Init.
-        Pass True for keep_history to keep a call history and get
-        it with get_history.
+        Pass True for keep_history to keep a history of the latest
+        DEFAULT_HISTORY_SIZE calls in self.history, or the number of calls
+        to keep. Statistics of all calls are kept in self.stats anyway.
+        codec: The codec.Codec (or its name) used to encode requests and
+               decode responses, defaults to the fastest one installed
+        cache: The cache.ResponseCache keeping results of read-only functions
+        coalesce: True or a list of '<interface>.<function>', identical
+                  concurrent calls of these functions are sent only once
+        log_sample_rate: float, share of the successful requests logged to
+                         holon.request, failed ones are logged anyway
+        log_max_length: int, number of characters of params and response
+                        data logged at most
+        hooks: List of hooks.ReaktorHook's, e.g. a hooks.MetricsCollector
+        max_workers: int, number of threads running calls started by submit
+        retry_policy: services.resilience.RetryPolicy of the http service
+        circuit_breaker: services.resilience.CircuitBreaker of the http
+                         service
+        idempotent: True or a list of '<interface>.<function>', failing
+                    calls of these functions are retried by retry_policy
+        decode_objects: build the ReaktorObject's of results while decoding
+                        responses, instead of converting the decoded dicts
+                        and lists afterwards. Applies to calls without
+                        data_converter. Responses are decoded with codec if
+                        it supports that, else with the fastest codec
+                        installed which does.
+        key_translator: translate.KeyTranslator renaming the keys of
+                        results, while decoding them if decode_objects
         """
-        self.history = [] if keep_history else None
+        if keep_history is True:
+            keep_history = DEFAULT_HISTORY_SIZE
+        self.history = CallHistory(keep_history) if keep_history else None
+        self.stats = ReaktorStats()
         self.http_service = http_service
+        self.codec = get_codec(codec)
+        # decodes responses given an object_pairs_hook
+        self.hook_codec = self.codec if self.codec.object_hooks else \
+            get_codec(object_hooks=True)
+        self.object_codec = self.hook_codec if decode_objects else None
+        self.key_translator = key_translator
+        # keys and short strings of the results of calls with intern=True
+        self.interner = Interner()
+        self.cache = cache
+        self.coalesce = coalesce if coalesce in (None, True) else frozenset(coalesce)
+        self.flights = SingleFlight()
+        self.log_sample_rate = log_sample_rate
+        self.log_max_length = log_max_length
+        self.hooks = list(hooks or ())
+        self.executor = Executor(max_workers, ReaktorTimeoutError)
+        if http_service.timeout_error_class is None:
+            http_service.timeout_error_class = ReaktorTimeoutError
+        if retry_policy is not None:
+            http_service.retry_policy = retry_policy
+        if circuit_breaker is not None:
+            http_service.circuit_breaker = circuit_breaker
+        self.idempotent = idempotent if idempotent in (None, True) else frozenset(idempotent)
 
     def clear(self):
         """Clear call history if any.
         """
-        if self.history:
-            self.history = []
+        if self.history is not None:
+            self.history.clear()
 
-    def call(self, function, args, data_converter=None, headers=None):
+    def call(self, function, args, data_converter=None, headers=None,
+             timeout=None, fields=None, intern=False):
         """The actual remote call txtr reaktor. Internal only.
         function: string, '<interface>.<function>' of txtr reaktor
         args: List of arguments for '<interface>.<function>'
         data_converter: The callable used to cast the JSON structure a python
                         instance (defaults to `ReaktorObject.to_reaktorobject`)
         headers: Additional headers to pass in
+        timeout: float, seconds the call may take (retries included), raises
+                 ReaktorTimeoutError once they passed. Pass it to functions
+                 of interfaces as keyword argument:
+                 reaktor.WSDocMgmt.getDocument(token, document_id, timeout=2)
+        fields: List of the paths of the fields of the result to keep, like
+                'attributes.title', the others are dropped while decoding.
+                Applies to each item of list results.
+        intern: bool, share equal short keys and strings of the result with
+                the results of other calls made with intern=True
+        See decoding for fields and intern, results of calls with fields are
+        neither cached nor coalesced.
         return: Instance(s) built using the provided `data_converter`
         """
-        # some args might not be JSON-serializable, e.g. sets
-        params = [list(arg) if isinstance(arg, set) else arg for arg in args]
+        params = prepare_params(args)
+        decoding = self.decoding(fields, intern)
+        if not self.hooks:
+            return self.perform_call(function, params, data_converter, headers,
+                                     timeout=timeout, decoding=decoding)
 
+        info = CallInfo(function, params)
+        try:
+            result = self.perform_call(function, params, data_converter,
+                                       headers, info, timeout, decoding)
+        except ReaktorError as e:
+            self.notify('on_error', info, e)
+            raise
+        self.notify('after_response', info)
+        return result
+
+    def perform_call(self, function, params, data_converter, headers,
+                     info=None, timeout=None, decoding=None):
+        """Get the converted result of a call, from the cache, an identical
+        concurrent call or txtr reaktor. Internal only.
+        info: hooks.CallInfo to time the phases of the call into
+        decoding: decoding.Decoding of the call, see `decoding`
+        """
+        objects = self.decodes_objects(data_converter, function)
+        if objects:
+            data_converter = ReaktorObject.from_decoded
+        cache = self.cache if self.cache and self.cache.cacheable(function) else None
+        if cache is not None:
+            cached = self.get_cached(cache, function, params, headers)
+            if cached is not None:
+                if info is not None:
+                    info.cached = True
+                with timed(info, 'decode'):
+                    data = self.decode(cached, objects, decoding, envelope=False)
+                return self.convert(data, data_converter, info)
+
+        if decoding is not None and decoding.fields is not None:
+            # a partial result
+            cache = None
+        fetch = lambda: self.fetch(function, params, headers, cache, info,
+                                   timeout, objects, decoding)
+        key = None
+        if decoding is None:
+            key = self.coalescing_key(function, params, headers)
+        if key is None:
+            data = fetch()
+        else:
+            data = self.flights.do(key, fetch)
+            if info is not None:
+                # the call of another thread was shared
+                info.coalesced = info.request_id is None
+        return self.convert(data, data_converter, info)
+
+    def fetch(self, function, params, headers, cache=None, info=None,
+              timeout=None, objects=False, decoding=None):
+        """Get the checked but unconverted result of a call from txtr reaktor,
+        cache it if cache is given. Internal only.
+        info: hooks.CallInfo to time the phases of the call into
+        objects, decoding: See `decode`
+        """
         # mandatory RPC ID
-        request_id = id_generator()
+        request_id = next_request_id()
         # json-encode request data
-        post = jsonwrite({u"method": function,
-                          u"params": params,
-                          u"id": request_id})
+        with timed(info, 'serialize'):
+            post = self.codec.encode_request(function, params, request_id)
+
+        if info is not None:
+            info.request_id = request_id
+            self.notify('before_send', info)
+        with timed(info, 'network'):
+            response = self.post(function, params, post, headers, request_id,
+                                 timeout)
+        if info is not None:
+            self.add_response(info, response)
 
-        response = None
+        # json-decode response data
+        try:
+            with timed(info, 'decode'):
+                data = self.decode(response.data, objects, decoding)
+            data = self.check_result(data, request_id)
+        except ReaktorError:
+            self.stats.add_error(function)
+            raise
+        if cache is not None:
+            cache.set(function, params, self.codec.encode(data))
+        return data
+
+    def submit(self, function, args, data_converter=None, headers=None,
+               timeout=None):
+        """Start a call on a thread of self.executor.
+        See `call` for the arguments.
+        return: executor.CallFuture
+        """
+        return self.executor.submit(self.call, function, args, data_converter,
+                                    headers, timeout)
+
+    def gather(self, calls, data_converter=None, headers=None, timeout=None):
+        """Run independent calls concurrently, on the threads of
+        self.executor (see max_workers).
+        calls: List of ('<interface>.<function>', args) tuples
+        timeout: float, seconds each call may take once started, a
+                 ReaktorTimeoutError is returned for calls taking longer
+        See `call` for the other arguments.
+        return: List of the results in the order of calls, holding the
+                ReaktorError raised instead for each call that failed. A
+                failing call doesn't affect the others.
+        """
+        futures = [self.submit(function, args, data_converter, headers, timeout)
+                   for function, args in calls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout))
+            except ReaktorError as e:
+                results.append(e)
+        return results
+
+    def map(self, function, args_list, data_converter=None, headers=None,
+            timeout=None):
+        """Call function concurrently once for each args, see `gather`.
+        args_list: List of argument lists
+        """
+        return self.gather([(function, args) for args in args_list],
+                           data_converter, headers, timeout)
+
+    def paginate(self, function, args, offset_index, size_index,
+                 page_size=100, concurrency=1, prefetch=True, start=0,
+                 data_converter=None, headers=None, timeout=None):
+        """Iterate the items of a function returning a list page by page.
+        args: List of arguments, the ones for offset and size are replaced
+        offset_index, size_index: positions of offset and size in args
+        page_size: int, items per call
+        concurrency: int, number of pages fetched at once
+        prefetch: bool, fetch the next page while the current one is
+                  consumed (implied by a concurrency above 1)
+        start: int, offset of the first page
+        timeout: float, seconds the call for each page may take
+        See `call` for the other arguments.
+        return: pagination.Paginator
+        """
+        return Paginator(self, function, args, offset_index, size_index,
+                         page_size, concurrency, prefetch, start,
+                         data_converter, headers, timeout)
+
+    def stream(self, function, args, data_converter=None, headers=None,
+               timeout=None):
+        """Iterate the items of the (list) result of a call while the
+        response arrives, without holding all of it in memory. Meant for
+        large results like catalogue exports; results are neither cached
+        nor coalesced.
+        See `call` for the arguments, timeout bounds the whole transfer.
+        An error response raises before the first item, an RPC ID mismatch
+        only at the end if txtr reaktor sends the id after the result.
+        return: Iterator of instances built using `data_converter`
+        """
+        params = prepare_params(args)
+        request_id = next_request_id()
+        post = self.codec.encode_request(function, params, request_id)
+        decoder = None
+        if data_converter is None and self.object_codec is not None:
+            decoder = self.object_codec.json.JSONDecoder(
+                object_pairs_hook=self.object_pairs_hook)
+            data_converter = ReaktorObject.from_decoded
+        elif data_converter is None:
+            data_converter = self.default_converter
+
+        start_time = time.time()
+        status, data, parser, chunks = None, None, None, None
         try:
-            response = self.http_service.call(post, headers or {})
+            status, chunks = self.http_service.stream(post, headers or {},
+                                                      timeout=timeout)
+            if status != 200:
+                data = ''.join(chunks)
+                self.check_response(services.Response(status, data, 0))
+
+            parser = ResultParser(chunks, decoder)
+            checked = False
+            try:
+                for item in parser:
+                    if not checked:
+                        # check what is known before handing out any item
+                        checked = True
+                        if parser.envelope.get('error') or 'id' in parser.envelope:
+                            self.check_result(parser.envelope, request_id)
+                    yield data_converter(item)
+                self.check_result(parser.envelope, request_id)
+            except ReaktorError:
+                self.stats.add_error(function)
+                raise
         finally:
-            resp_status = response.status if response else 'ERR'
-            resp_time = response.time if response else -1
-            resp_data = response.data if response else None
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            response = None
+            if status is not None:
+                response = services.Response(status, data,
+                                             (time.time() - start_time) * 1000)
+            self.record(function, params, post, headers, request_id, response,
+                        received=parser.received if parser else None)
+
+    def notify(self, event, *args):
+        """Call event ('before_send', 'after_response' or 'on_error') of the
+        hooks, logging the errors they raise. Internal only.
+        """
+        for hook in self.hooks:
+            try:
+                getattr(hook, event)(*args)
+            except Exception:
+                logger.exception(u"hook %r failed on %s", hook, event)
+
+    @staticmethod
+    def add_response(info, response):
+        """Keep the response of a call in its hooks.CallInfo. Internal only.
+        """
+        info.response = response
+        if response.start_transfer is not None:
+            info.timings['start_transfer'] = response.start_transfer
 
+    def retryable(self, function):
+        """Tell whether calls of function, or of all functions of a batch,
+        may be retried. Internal only.
+        """
+        if not self.idempotent:
+            return False
+        if self.idempotent is True:
+            return True
+        functions = function if isinstance(function, list) else [function]
+        return all(name in self.idempotent for name in functions)
+
+    def coalesces(self, function):
+        """Tell whether identical concurrent calls of function are
+        coalesced. Internal only.
+        """
+        return bool(self.coalesce) and (self.coalesce is True or function in self.coalesce)
+
+    def coalescing_key(self, function, params, headers):
+        """Get the key identical calls are coalesced on, None if calls of
+        function are not coalesced. Internal only.
+        """
+        if not self.coalesces(function):
+            return None
+        return function, canonical(params), canonical(headers)
+
+    def get_cached(self, cache, function, params, headers):
+        """Get the cached (json-encoded) result of a call and record it as a
+        cached request, None if there is none. Internal only.
+        """
+        cached = cache.get(function, params)
+        if cached is not None:
+            self.record(function, params, u'', headers, None,
+                        services.Response(200, cached, 0), cached=True)
+        return cached
+
+    def batch(self, headers=None, timeout=None):
+        """Get a Batch to send several calls in one JSON-RPC batch request.
+        headers: Additional headers to pass in
+        timeout: float, seconds the batch request may take, see `call`
+        """
+        return Batch(self, headers, timeout)
+
+    def call_many(self, calls, data_converter=None, headers=None,
+                  timeout=None):
+        """Send several calls in one JSON-RPC batch request.
+        calls: List of ('<interface>.<function>', args) tuples
+        data_converter: See `call`
+        headers: Additional headers to pass in
+        timeout: See `batch`
+        return: List of BatchCall's, in the order of calls
+        """
+        batch = self.batch(headers, timeout)
+        pending = [batch.call(function, args, data_converter)
+                   for function, args in calls]
+        batch.send()
+        return pending
+
+    def post(self, function, params, post, headers, request_id, timeout=None):
+        """POST a json-encoded request to txtr reaktor, keep history and log
+        it. Internal only.
+        function: '<interface>.<function>', or a list of them for batches
+        params: params of the call, or a list of them for batches
+        post: string, the json-rpc payload
+        headers: Additional headers to pass in
+        request_id: RPC ID(s) of the request
+        timeout: See `call`
+        return: services.Response
+        """
+        response = None
+        try:
+            response = self.http_service.call(post, headers or {},
+                                              retry=self.retryable(function),
+                                              timeout=timeout)
+        finally:
+            self.record(function, params, post, headers, request_id, response)
+        return self.check_response(response)
+
+    def record(self, function, params, post, headers, request_id, response,
+               cached=False, received=None):
+        """Keep history of, count and log a request. Internal only.
+        function: '<interface>.<function>', or a list of them for batches
+        params: params of the call, or a list of them for batches
+        response: services.Response or None if the request failed
+        cached: bool, whether the response was taken from the cache
+        received: int, bytes received, defaults to the length of the
+                  response data
+        """
+        resp_status = response.status if response else 'ERR'
+        resp_time = response.time if response else -1
+        resp_data = response.data if response else None
+        if received is None:
+            received = len(resp_data) if resp_data else 0
+
+        batch = isinstance(function, list)
+        functions = function if batch else [function]
+        for name in functions:
+            # a batch is accounted in equal parts to its calls
+            self.stats.add(name, resp_time if response else None,
+                           len(post) / len(functions), received / len(functions),
+                           error=resp_status != 200, cached=cached)
+
+        if self.history is not None:
+            self.history.append(CallRecord(
+                tuple(function) if batch else function,
+                resp_status, len(post), received, resp_time, request_id,
+                cached, time.time(), headers, self.http_service.protocol))
+
+        # sample the logs of successful requests, build them only if logged
+        if resp_status == 200 and self.log_sample_rate < 1 and \
+                random.random() >= self.log_sample_rate:
+            return
+
+        if logger_request.isEnabledFor(logging.INFO):
+            if batch:
+                request = u'[%s]' % u', '.join(u'{fn} {params}'.format(
+                    fn=name, params=truncate(call_params, self.log_max_length))
+                    for name, call_params in zip(function, params))
+            else:
+                request = u'{fn} {params}'.format(
+                    fn=function, params=truncate(params, self.log_max_length))
             summary = dict(
-                request=u'POST {fn} {params} {protocol}'.format(
-                    fn=function, params=params,
-                    protocol=self.http_service.protocol
+                request=u'POST {request} {protocol}{cached}'.format(
+                    request=request,
+                    protocol=self.http_service.protocol,
+                    cached=u' (cached)' if cached else u''
                 ),
                 status=resp_status,
                 length=len(post),
                 duration=resp_time,
                 request_id=request_id,
-                headers=headers
+                headers=headers,
+                cached=cached
             )
-
-            if self.history is not None:
-                self.history.append(summary)
-
             logger_request.info(summary['request'], extra=summary)
-            if resp_data:
-                logger.debug(resp_data)
 
-        # raise ReaktorHttpError for http response status <> 200
+        if resp_data and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(truncate(resp_data, self.log_max_length))
+
+    def check_response(self, response):
+        """Raise ReaktorHttpError for http response status <> 200. Internal
+        only.
+        """
         if not response.status == 200:
+            data = response.data
+            if isinstance(data, str):
+                data = data.decode("utf-8", "replace")
             raise ReaktorHttpError(
-                response.status, u"server returned status %i: %s" % (response.status, response.data))
+                response.status, u"server returned status %i: %s" % (response.status, data))
+        return response
 
-        # json-decode response data
-        data = jsonread(response.data)
+    def decodes_objects(self, data_converter, function):
+        """Tell whether the result of a call of function with data_converter
+        is decoded into ReaktorObject's right away, see decode_objects. Not
+        for coalesced calls, as each caller gets objects of its own.
+        Internal only.
+        """
+        return data_converter is None and self.object_codec is not None and \
+            not self.coalesces(function)
 
+    def decoding(self, fields=None, intern=False):
+        """Get the decoding.Decoding for the decode options of a call, None
+        if there are none. Internal only.
+        """
+        if fields is None and not intern:
+            return None
+        return Decoding(fields, self.interner if intern else None)
+
+    def decode(self, data, objects=False, decoding=None, envelope=True):
+        """json-decode response data. Internal only.
+        objects: build ReaktorObject's instead of dicts while decoding, the
+                 result then needs no further conversion
+        decoding: decoding.Decoding with the decode options of the call
+        envelope: bool, False if data is a result only, like the cached ones
+        """
+        if decoding is not None:
+            return decoding.decode(self.hook_codec, data,
+                                   self.object_pairs_hook if objects else dict,
+                                   envelope)
+        if objects:
+            return self.object_codec.decode(data, object_pairs_hook=self.object_pairs_hook)
+        return self.codec.decode(data)
+
+    @property
+    def object_pairs_hook(self):
+        """Get the callable building the ReaktorObject's of results while
+        decoding them. Internal only.
+        """
+        if self.key_translator is not None:
+            return self.key_translator.object_pairs_hook
+        return ReaktorObject
+
+    @property
+    def default_converter(self):
+        """Get the data_converter of calls not given one. Internal only."""
+        if self.key_translator is not None:
+            return self.key_translator.to_reaktorobject
+        return ReaktorObject.to_reaktorobject
+
+    def get_result(self, data, request_id, data_converter=None, info=None):
+        """Check a json-decoded JSON-RPC response and convert its result.
+        Internal only.
+        data: dict, the json-decoded response
+        request_id: RPC ID of the request
+        data_converter: See `call`
+        info: hooks.CallInfo to time the conversion into
+        """
+        return self.convert(self.check_result(data, request_id), data_converter,
+                            info)
+
+    def check_result(self, data, request_id):
+        """Check a json-decoded JSON-RPC response and get its result.
+        Internal only.
+        data: dict, the json-decoded response
+        request_id: RPC ID of the request
+        """
         # raise ReaktorApiError for reaktor errors
         err = data.get("error")
         if err:
-            code = err.get("reaktorErrorCode", err.get("code", "error code unknown"))
-            msg = err.get("msg", unicode(code))
-            call_id = err.get("callId")
-            if code == ReaktorApiError.AUTHENTICATION_INVALID:
-                raise ReaktorAuthError(msg, call_id)
-            elif code == ReaktorApiError.DISCOVERY_SERVICE_ACCESS_ERROR:
-                raise ReaktorAccessError(msg, call_id)
-            elif code == ReaktorApiError.ILLEGAL_ARGUMENT_ERROR:
-                raise ReaktorArgumentError(msg, call_id)
-            elif code == ReaktorApiError.UNKNOWN_ENTITY_ERROR:
-                raise ReaktorEntityError(msg, call_id)
-            elif code == ReaktorApiError.ILLEGAL_CALL:
-                raise ReaktorIllegalCallError(msg, call_id)
-            else:
-                raise ReaktorApiError(msg, code, call_id)
+            raise api_error(err)
 
         # check response RPC ID _after_ checking for ReaktorAPIError
         # somebody didn't read http://www.jsonrpc.org/specification
         response_id = data.get("id", "")
         if response_id != request_id:
             raise ReaktorJSONRPCError(
-                response.status, u"invalid RPC ID response %s != request %s" % (
+                200, u"invalid RPC ID response %s != request %s" % (
                     response_id, request_id))
 
-        # return result as ReaktorObject('s) - if Reaktor doesn't violate the
-        # JSONRPC spec by not sending a result.
-        data = data.get("result", {})
+        # return result - if Reaktor doesn't violate the JSONRPC spec by not
+        # sending a result.
+        return data.get("result", {})
+
+    def convert(self, data, data_converter=None, info=None):
+        """Convert the result of a call. Internal only.
+        data_converter: See `call`
+        info: hooks.CallInfo to time the conversion into
+        """
+        # return result as ReaktorObject('s)
         if data_converter is None:
-            data_converter = ReaktorObject.to_reaktorobject
-        return data_converter(data)
+            data_converter = self.default_converter
+        with timed(info, 'convert'):
+            return data_converter(data)
 
     def get_remote_version(self):
         reaktor_host = self.http_service.host
@@ -315,6 +920,400 @@ class Reaktor(object):
         return re.sub(r'/api/(.*)/rpc', r'\1', self.http_service.path)
 
 
+class AsyncReaktor(Reaktor):
+    """A Reaktor not blocking on its calls.
+
+    Calling a function of an interface sends the request and returns a
+    ReaktorFuture right away, so many requests can be in flight at once:
+
+        futures = [reaktor.WSDocMgmt.getDocument(token, document_id)
+                   for document_id in document_ids]
+        documents = [future.result() for future in futures]
+
+    Requests progress whenever a result is waited for, or when run or
+    perform are called (e.g. from the event loop of the application). Use an
+    http service able to run calls concurrently on one thread, like
+    `services.pycurl.AsyncPyCurlHttpService`, other services perform each
+    call right away.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Init. See Reaktor.
+        """
+        super(AsyncReaktor, self).__init__(*args, **kwargs)
+        # futures of the coalesced calls in flight, by coalescing key
+        self.in_flight = {}
+
+    def call(self, function, args, data_converter=None, headers=None,
+             timeout=None, fields=None, intern=False):
+        """The actual remote call txtr reaktor. Internal only.
+        See Reaktor.call.
+        return: ReaktorFuture
+        """
+        params = prepare_params(args)
+        decoding = self.decoding(fields, intern)
+        future = ReaktorFuture(self)
+        info = CallInfo(function, params) if self.hooks else None
+        objects = self.decodes_objects(data_converter, function)
+        if objects:
+            data_converter = ReaktorObject.from_decoded
+
+        cache = self.cache if self.cache and self.cache.cacheable(function) else None
+        if cache is not None:
+            cached = self.get_cached(cache, function, params, headers)
+            if cached is not None:
+                if info is not None:
+                    info.cached = True
+                with timed(info, 'decode'):
+                    data = self.decode(cached, objects, decoding, envelope=False)
+                future.set_result(self.convert(data, data_converter, info))
+                if info is not None:
+                    self.notify('after_response', info)
+                return future
+
+        if decoding is not None and decoding.fields is not None:
+            # a partial result
+            cache = None
+        key = None
+        if decoding is None:
+            key = self.coalescing_key(function, params, headers)
+        flight = self.in_flight.get(key) if key is not None else None
+        if flight is None:
+            flight = self.fetch(function, params, headers, cache, info, timeout,
+                                objects, decoding)
+            if key is not None and not flight.done:
+                self.in_flight[key] = flight
+                flight.add_done_callback(lambda f: self.in_flight.pop(key, None))
+        elif info is not None:
+            info.coalesced = True
+
+        def done(flight):
+            error = flight.error
+            if error is None:
+                try:
+                    value = self.convert(flight.value, data_converter, info)
+                except Exception as e:
+                    # like a raising data_converter, kept for result()
+                    error = e
+            if error is not None:
+                if info is not None:
+                    self.notify('on_error', info, error)
+                future.set_error(error)
+            else:
+                future.set_result(value)
+                if info is not None:
+                    self.notify('after_response', info)
+
+        flight.add_done_callback(done)
+        return future
+
+    def submit(self, function, args, data_converter=None, headers=None,
+               timeout=None):
+        """Same as call, no thread needed to run calls concurrently.
+        return: ReaktorFuture
+        """
+        return self.call(function, args, data_converter, headers, timeout)
+
+    def fetch(self, function, params, headers, cache=None, info=None,
+              timeout=None, objects=False, decoding=None):
+        """Start a call to txtr reaktor. Internal only.
+        See Reaktor.fetch.
+        return: ReaktorFuture of the checked but unconverted result
+        """
+        request_id = next_request_id()
+        with timed(info, 'serialize'):
+            post = self.codec.encode_request(function, params, request_id)
+        future = ReaktorFuture(self)
+        if info is not None:
+            info.request_id = request_id
+            self.notify('before_send', info)
+            network = timed(info, 'network')
+            network.__enter__()
+
+        def done(response):
+            if info is not None:
+                network.__exit__(None, None, None)
+            if isinstance(response, Exception):
+                self.record(function, params, post, headers, request_id, None)
+                future.set_error(response)
+                return
+            self.record(function, params, post, headers, request_id, response)
+            if info is not None:
+                self.add_response(info, response)
+            try:
+                self.check_response(response)
+            except ReaktorError as e:
+                future.set_error(e)
+                return
+            try:
+                with timed(info, 'decode'):
+                    data = self.decode(response.data, objects, decoding)
+                data = self.check_result(data, request_id)
+            except Exception as e:
+                # ValueError for malformed data too, which must not escape
+                # into the http service driving the other calls
+                self.stats.add_error(function)
+                future.set_error(e)
+                return
+            if cache is not None:
+                cache.set(function, params, self.codec.encode(data))
+            future.set_result(data)
+
+        self.http_service.call_async(post, headers or {}, done, timeout=timeout)
+        return future
+
+    def perform(self):
+        """Make progress on pending requests without blocking.
+        return: int, number of requests still pending
+        """
+        return self.http_service.perform()
+
+    def run(self, futures=None):
+        """Block until the given (default: all) pending requests are done.
+        futures: List of ReaktorFuture's to wait for
+        """
+        if futures is None:
+            self.http_service.run()
+        else:
+            self.http_service.run(lambda: all(f.done for f in futures))
+
+
+class ReaktorFuture(object):
+    """Pending result of a call of an AsyncReaktor.
+    """
+
+    def __init__(self, endpoint):
+        """Init. Internal only.
+        """
+        self.endpoint = endpoint
+        self.value, self.error, self.done = None, None, False
+        self.callbacks = []
+        self.started = time.time()
+
+    def add_done_callback(self, callback):
+        """Have callback(future) called once the call is done.
+        """
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def set_result(self, value):
+        self.value = value
+        self._finish()
+
+    def set_error(self, error):
+        self.error = error
+        self._finish()
+
+    def _finish(self):
+        """Call all callbacks, even if some raise. The first error is
+        raised afterwards.
+        """
+        self.done = True
+        callbacks, self.callbacks = self.callbacks, []
+        error = None
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    def result(self, timeout=None):
+        """Get the result of the call, or raise its error. Blocks until the
+        call is done.
+        timeout: float, seconds the call may take since it was started,
+                 raises ReaktorTimeoutError once it took longer
+        """
+        if not self.done:
+            if timeout is None:
+                self.endpoint.run([self])
+            else:
+                deadline = self.started + timeout
+                self.endpoint.http_service.run(
+                    lambda: self.done or time.time() >= deadline)
+                if not self.done:
+                    raise ReaktorTimeoutError(
+                        u"call did not finish within %ss" % timeout)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class Batch(object):
+    """Collects calls to txtr-reaktor to send them in one JSON-RPC batch
+    request. Get one with Reaktor.batch.
+
+    Attributes dequalify into interfaces just like for Reaktor, but calling a
+    function of such an interface only queues the call and returns a
+    BatchCall. All queued calls are sent by send, or when leaving the batch
+    used as a context manager:
+
+        with reaktor.batch() as batch:
+            document = batch.WSDocMgmt.getDocument(token, document_id)
+            user = batch.WSUserMgmt.getUser(token)
+        document.result()
+    """
+
+    def __init__(self, endpoint, headers=None, timeout=None):
+        """Init. Internal only.
+        endpoint: Reaktor
+        headers: Additional headers to pass in
+        timeout: float, seconds the request may take
+        """
+        self.endpoint, self.headers, self.calls = endpoint, headers, []
+        self.timeout = timeout
+
+    def __getattr__(self, interface_name):
+        """Implements dequalification of an unknown attribute.
+        """
+        interface = Reaktor.Interface(interface_name, self)
+        self.__dict__[interface_name] = interface  # cache it
+        return interface
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def call(self, function, args, data_converter=None, headers=None,
+             timeout=None, fields=None, intern=False):
+        """Queue a call. See Reaktor.call.
+        headers, timeout: Apply to the whole request, pass them to
+                          Reaktor.batch instead. Raise ValueError.
+        fields: Applied to the result once the batch was decoded.
+        intern: Not supported for batches, raises ValueError.
+        return: BatchCall
+        """
+        if headers is not None or timeout is not None:
+            raise ValueError(u"headers and timeout of %s apply to the whole "
+                             u"batch, pass them to Reaktor.batch" % function)
+        if intern:
+            raise ValueError(u"intern is not supported for batched call %s" % function)
+        pending = BatchCall(function, prepare_params(args), next_request_id(),
+                            data_converter,
+                            compile_fields(fields) if fields is not None else None)
+        self.calls.append(pending)
+        return pending
+
+    def send(self):
+        """Send all queued calls in one request. Errors of single calls are
+        raised by their BatchCall.result, errors of the request itself are
+        raised here.
+        return: List of the BatchCall's sent
+        """
+        calls, self.calls = self.calls, []
+        if not calls:
+            return calls
+
+        endpoint = self.endpoint
+        # the phases of the request are shared by the calls of the batch
+        info = None
+        if endpoint.hooks:
+            info = CallInfo([pending.function for pending in calls],
+                            [pending.params for pending in calls])
+            for pending in calls:
+                pending.info = CallInfo(pending.function, pending.params)
+                pending.info.request_id = pending.request_id
+
+        codec = endpoint.codec
+        with timed(info, 'serialize'):
+            post = '[%s]' % ','.join(codec.encode_request(
+                pending.function, pending.params, pending.request_id)
+                for pending in calls)
+        self.notify(calls, 'before_send', info)
+        try:
+            with timed(info, 'network'):
+                response = endpoint.post(
+                    [pending.function for pending in calls],
+                    [pending.params for pending in calls], post, self.headers,
+                    [pending.request_id for pending in calls], self.timeout)
+        except ReaktorError as e:
+            for pending in calls:
+                pending.error = e
+            self.notify(calls, 'on_error', info)
+            raise
+
+        if info is not None:
+            endpoint.add_response(info, response)
+        # all results are decoded the same way, objects only if all calls
+        # would get them
+        objects = all(endpoint.decodes_objects(pending.data_converter,
+                                               pending.function)
+                      for pending in calls)
+        with timed(info, 'decode'):
+            data = endpoint.decode(response.data, objects)
+        if isinstance(data, list):
+            replies = dict((reply.get("id"), reply) for reply in data)
+        else:
+            # the batch was rejected as a whole
+            replies = dict((pending.request_id, data) for pending in calls)
+
+        for pending in calls:
+            reply = replies.get(pending.request_id, {})
+            if pending.fields is not None and reply.get("result") is not None:
+                reply = dict(reply, result=project(reply["result"], pending.fields))
+            try:
+                pending.value = endpoint.get_result(
+                    reply, pending.request_id,
+                    ReaktorObject.from_decoded if objects else pending.data_converter,
+                    pending.info)
+            except ReaktorError as e:
+                endpoint.stats.add_error(pending.function)
+                pending.error = e
+            pending.done = True
+        self.notify(calls, None, info)
+        return calls
+
+    def notify(self, calls, event, info):
+        """Call the hooks of the endpoint for each call sent, with the
+        timings of the request. event: None to notify the outcome of each
+        call. Internal only.
+        """
+        if info is None:
+            return
+        for pending in calls:
+            pending.info.timings.update(info.timings)
+            pending.info.response = info.response
+            if event is None and pending.error is None:
+                self.endpoint.notify('after_response', pending.info)
+            elif event is None or event == 'on_error':
+                self.endpoint.notify('on_error', pending.info, pending.error)
+            else:
+                self.endpoint.notify(event, pending.info)
+
+
+class BatchCall(object):
+    """Pending result of a call queued in a Batch.
+    """
+
+    def __init__(self, function, params, request_id, data_converter=None,
+                 fields=None):
+        """Init. Internal only.
+        fields: decoding.compile_fields tree of the fields to keep, or None
+        """
+        self.function, self.params = function, params
+        self.request_id, self.data_converter = request_id, data_converter
+        self.fields = fields
+        self.value, self.error, self.done = None, None, False
+        self.info = None
+
+    def result(self):
+        """Get the result of the call, or raise its ReaktorError.
+        Raises RuntimeError if the batch has not been sent yet.
+        """
+        if self.error is not None:
+            raise self.error
+        if not self.done:
+            raise RuntimeError(u"batch of %s was not sent yet." % self.function)
+        return self.value
+
+
 class ReaktorError(Exception):
     """Base of errors to be thrown by class Reaktor.
     Meaning of self.code depends on sub classes.
@@ -342,6 +1341,13 @@ class ReaktorIOError(ReaktorError):
     pass
 
 
+class ReaktorTimeoutError(ReaktorIOError):
+    """ReaktorError to be thrown by class Reaktor,
+    caused by a call not finishing within its timeout.
+    """
+    pass
+
+
 class ReaktorHttpError(ReaktorError):
     """ReaktorError to be thrown by Reaktor,
     caused by the remote reaktor httpserver.
@@ -419,6 +1425,120 @@ def hash_password(password):
     return hsh.hexdigest()
 
 
+def prepare_params(args):
+    """Make call arguments JSON-serializable. Internal only."""
+    # some args might not be JSON-serializable, e.g. sets
+    return [list(arg) if isinstance(arg, set) else arg for arg in args]
+
+
+def api_error(err):
+    """Get the ReaktorApiError (sub class) for an error of a JSON-RPC response.
+    err: dict, the error object of the response
+    """
+    code = err.get("reaktorErrorCode", err.get("code", "error code unknown"))
+    msg = err.get("msg", unicode(code))
+    call_id = err.get("callId")
+    if code == ReaktorApiError.AUTHENTICATION_INVALID:
+        return ReaktorAuthError(msg, call_id)
+    elif code == ReaktorApiError.DISCOVERY_SERVICE_ACCESS_ERROR:
+        return ReaktorAccessError(msg, call_id)
+    elif code == ReaktorApiError.ILLEGAL_ARGUMENT_ERROR:
+        return ReaktorArgumentError(msg, call_id)
+    elif code == ReaktorApiError.UNKNOWN_ENTITY_ERROR:
+        return ReaktorEntityError(msg, call_id)
+    elif code == ReaktorApiError.ILLEGAL_CALL:
+        return ReaktorIllegalCallError(msg, call_id)
+    else:
+        return ReaktorApiError(msg, code, call_id)
+
+
+def truncate(data, max_length):
+    """Get the (unicode) representation of data for logs, cut after
+    max_length characters. Only about max_length characters of data are
+    decoded|rendered, so large payloads cost no more than small ones.
+    Internal only.
+    """
+    if max_length is None:
+        if isinstance(data, str):
+            return data.decode("utf-8", "replace")
+        return unicode(data)
+    if isinstance(data, str):
+        if len(data) <= max_length:
+            return data.decode("utf-8", "replace")
+        # a character takes at most 4 bytes
+        text = data[:max_length * 4].decode("utf-8", "replace")[:max_length]
+        more = len(data) - len(text.encode("utf-8"))
+        if not more:
+            return text
+        return u'%s... (%i more bytes)' % (text, more)
+    if isinstance(data, unicode):
+        if len(data) <= max_length:
+            return data
+        return u'%s... (%i more)' % (data[:max_length], len(data) - max_length)
+    pieces, length = [], 0
+    for piece in repr_pieces(data, max_length + 1):
+        pieces.append(piece)
+        length += len(piece)
+        if length > max_length:
+            return u'%s... (truncated)' % u''.join(pieces)[:max_length]
+    return u''.join(pieces)
+
+
+def repr_pieces(value, max_length):
+    """Generate the representation of value piece by piece, strings cut
+    after max_length characters. Internal only, see `truncate`.
+    """
+    if isinstance(value, (list, tuple)):
+        yield u'[' if isinstance(value, list) else u'('
+        for index, member in enumerate(value):
+            if index:
+                yield u', '
+            for piece in repr_pieces(member, max_length):
+                yield piece
+        if isinstance(value, tuple) and len(value) == 1:
+            yield u','
+        yield u']' if isinstance(value, list) else u')'
+    elif isinstance(value, dict):
+        yield u'{'
+        for index, (key, member) in enumerate(value.iteritems()):
+            if index:
+                yield u', '
+            for piece in repr_pieces(key, max_length):
+                yield piece
+            yield u': '
+            for piece in repr_pieces(member, max_length):
+                yield piece
+        yield u'}'
+    elif isinstance(value, basestring):
+        yield repr(value[:max_length]).decode('ascii')
+    else:
+        yield unicode(repr(value), 'utf-8', 'replace')
+
+
 def id_generator(size=8, chars=string.ascii_lowercase + string.digits):
     """Generate random id, to be used as RPC ID."""
     return ''.join(random.choice(chars) for x in range(size))
+
+
+class RequestIds(object):
+    """Generator of RPC IDs unique across threads and processes: a prefix
+    made of the process id and random bits, and a counter. The prefix is
+    renewed in forked processes.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.prefix = '%x%s' % (self.pid, binascii.hexlify(os.urandom(4)))
+        self.counter = itertools.count(1)
+
+    def __call__(self):
+        if os.getpid() != self.pid:
+            self.reset()
+        return '%s%x' % (self.prefix, next(self.counter))
+
+
+# RPC IDs of calls to txtr-reaktor
+next_request_id = RequestIds()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Compact container for large list results of same-shaped records, like
+the documents of searches and libraries.
+
+    documents = reaktor.WSSearch.search(token, query,
+                                        data_converter=RecordSet.from_result)
+    titles = documents.column('title')
+    for document in documents.where('size', lambda size: size > 10 ** 6):
+        print document.title, document.getDocumentID()
+
+The values are stored column by column with one key schema for all records,
+instead of a dict per record. Columns of dicts in all records, like the
+attributes of documents, are stored as RecordSet's in turn. Records are
+views on a row, with the attribute, getter and item access of
+ReaktorObject's. Other nested dicts|lists are wrapped into ReaktorObject's
+on first access only.
+"""
+from types import MethodType
+
+from .reaktor import ReaktorObject, lazy_reaktorobject
+
+
+# value of the columns of keys a record doesn't have
+MISSING = object()
+
+
+def wrapped_value(values, index):
+    """Get the value at index of a column, wrapping a dict|list into a
+    LazyReaktorObject|LazyReaktorList in place. Internal only.
+    """
+    value = values[index]
+    wrapped = lazy_reaktorobject(value)
+    if wrapped is not value:
+        values[index] = wrapped
+    return wrapped
+
+
+class RecordSet(object):
+    """Records stored column-wise. Iterating, indexing and the bulk
+    operations don't build a dict per record.
+    keys: list of the keys of all records, in the order they were found
+    columns: dict of the list of values (or the RecordSet of nested
+             records) by key
+    """
+
+    def __init__(self, records=()):
+        """Init.
+        records: iterable of dicts
+        """
+        records = list(records)
+        keys, seen = [], set()
+        for record in records:
+            for key in record:
+                if key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+        self.keys = keys
+        self.columns = {}
+        for key in keys:
+            values = [record.get(key, MISSING) for record in records]
+            if all(type(value) is dict for value in values):
+                values = RecordSet(values)
+            self.columns[key] = values
+        self.length = len(records)
+
+    @staticmethod
+    def from_result(attr):
+        """Translation of a list of dicts into a RecordSet, of other results
+        into [lists of] ReaktorObject's. Use it as data_converter of
+        Reaktor.call.
+        """
+        if type(attr) is list and attr and all(type(member) is dict for member in attr):
+            return RecordSet(attr)
+        return ReaktorObject.to_reaktorobject(attr)
+
+    @classmethod
+    def from_columns(cls, keys, columns, length):
+        """Get a RecordSet of the given columns, which are not copied."""
+        records = cls.__new__(cls)
+        records.keys, records.columns, records.length = keys, columns, length
+        return records
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield Record(self, index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(xrange(*index.indices(self.length)))
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(u"record index out of range")
+        return Record(self, index)
+
+    def __repr__(self):
+        return u'<RecordSet of %i records, keys %s>' % (self.length, u', '.join(self.keys))
+
+    def column(self, key, default=None):
+        """Get the values of key of all records, default for the records
+        without it. The values of a column of nested records are returned
+        as their RecordSet.
+        """
+        values = self.columns.get(key)
+        if values is None:
+            return [default] * self.length
+        if type(values) is RecordSet:
+            return values
+        return [default if value is MISSING else wrapped_value(values, index)
+                for index, value in enumerate(values)]
+
+    def take(self, indices):
+        """Get a RecordSet of the records at indices."""
+        indices = list(indices)
+        columns = dict((key, values.take(indices) if type(values) is RecordSet
+                        else [values[index] for index in indices])
+                       for key, values in self.columns.items())
+        return RecordSet.from_columns(self.keys, columns, len(indices))
+
+    def where(self, key, predicate):
+        """Get a RecordSet of the records with a value of key for which
+        predicate(value) is true. Only that column is looked at.
+        """
+        values = self.columns.get(key, ())
+        if type(values) is RecordSet:
+            return self.take(index for index, record in enumerate(values)
+                             if predicate(record))
+        return self.take(index for index, value in enumerate(values)
+                         if value is not MISSING and predicate(wrapped_value(values, index)))
+
+    def filter(self, predicate):
+        """Get a RecordSet of the records for which predicate(record) is
+        true.
+        """
+        return self.take(index for index in xrange(self.length)
+                         if predicate(Record(self, index)))
+
+    def to_list(self):
+        """Get the records as list of ReaktorObject's."""
+        return [record.to_reaktorobject() for record in self]
+
+
+class Record(object):
+    """A record of a RecordSet, read-only like a ReaktorObject."""
+    __slots__ = ('records', 'index')
+
+    def __init__(self, records, index):
+        object.__setattr__(self, 'records', records)
+        object.__setattr__(self, 'index', index)
+
+    def __getitem__(self, key):
+        values = self.records.columns.get(key)
+        if values is None:
+            raise KeyError(key)
+        if type(values) is RecordSet:
+            return Record(values, self.index)
+        if values[self.index] is MISSING:
+            raise KeyError(key)
+        return wrapped_value(values, self.index)
+
+    def __contains__(self, key):
+        values = self.records.columns.get(key)
+        return values is not None and (type(values) is RecordSet or
+                                       values[self.index] is not MISSING)
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        return [key for key in self.records.keys if key in self]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def to_reaktorobject(self):
+        """Get the record, nested records included, as ReaktorObject."""
+        return ReaktorObject((key, value.to_reaktorobject() if type(value) is Record else value)
+                             for key, value in self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = dict(other.items())
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    # attribute access of ReaktorObject's, working on the mapping methods
+    __getattr__ = ReaktorObject.__getattr__.im_func
+
+    def _bind(self, name, getter):
+        # records are views made on access, not worth binding getters to
+        return MethodType(getter, self)
+
+    def __setattr__(self, name, val):
+        raise RuntimeError(u"Record object is readonly.")
+
+    def __delattr__(self, name):
+        raise RuntimeError(u"Record object is readonly.")
@@ -6,15 +6,39 @@ An HttpService is supposed to be injected into an API object upon its
 construction.
 """
 from collections import namedtuple
+from cStringIO import StringIO
+import gzip
+import time
 
 
-Response = namedtuple('Response', ('status', 'data', 'time'))
+# time is the duration of the call in ms, start_transfer the time (ms) until
+# the first byte of the response arrived, wire_size and size the bytes of the
+# response body as transferred (compressed) and decoded; None if the service
+# can't tell
+Response = namedtuple('Response', ('status', 'data', 'time', 'start_transfer',
+                                   'wire_size', 'size'))
+Response.__new__.__defaults__ = (None, None, None)
 
 
 class HttpService(object):
     """
     Base class defining what a HttpService is in holon
     """
+    # names of extra keyword arguments accepted by a subclass on top of the
+    # ones of `HttpService.__init__`, `ReaktorMeta` slices these out too
+    options = ()
+    # optional resilience.RetryPolicy, retrying the calls made with
+    # retry=True, and resilience.CircuitBreaker, guarding all calls and
+    # transfers
+    retry_policy = None
+    circuit_breaker = None
+    # raised for calls not done in time, defaults to communication_error_class
+    timeout_error_class = None
+    # request bodies of at least that many bytes are sent gzip compressed,
+    # None to never compress them
+    compress_threshold = None
+    # level of the request body compression, favouring speed
+    compress_level = 1
 
     def __init__(self, host=None, port=None, path=None, ssl=None,
                  user_agent=None, connect_timeout=None, run_timeout=None,
@@ -28,21 +52,207 @@ class HttpService(object):
         self.run_timeout = run_timeout
         self.communication_error_class = communication_error_class or Exception
 
-    def _call(self, body, headers):
+    def _call(self, body, headers, timeout=None):
+        """
+        :param timeout : seconds the call may take, None for run_timeout
+
+        :returns (status, data, time[, start_transfer])
+        """
         raise NotImplementedError()
 
-    def call(self, body, headers=None):
+    def call(self, body, headers=None, retry=False, timeout=None):
         """
         :param body : the json-rpc payload
         :param headers : the params of above method
+        :param retry : whether the call may be retried by the retry_policy,
+                       which is only safe for idempotent calls
+        :param timeout : seconds the call may take, retries included, on top
+                         of run_timeout; raises `timeout_error_class` once
+                         they passed
 
         :returns Response
         """
+        headers = self.prepare_headers(headers)
+        deadline = time.time() + timeout if timeout is not None else None
+        if retry and self.retry_policy is not None:
+            return self.retry_policy.run(
+                lambda: self._attempt(body, dict(headers), deadline),
+                self.retryable, deadline)
+        return self._attempt(body, headers, deadline)
+
+    def _attempt(self, body, headers, deadline=None):
+        """
+        Make one attempt of a call, if the circuit_breaker lets it through
+        and its deadline did not pass yet.
+        """
+        timeout = self.admit(deadline)
+        if self.circuit_breaker is None:
+            return Response(*self._call(body, headers, timeout))
+        # the outcome is recorded whatever _call raises, which gives back
+        # the slot of a half-open probe
+        status = None
+        try:
+            response = Response(*self._call(body, headers, timeout))
+            status = response.status
+        finally:
+            self.record_outcome(status)
+        return response
+
+    def admit(self, deadline=None):
+        """
+        Check a call or transfer may be started now: raises
+        `timeout_error_class` once its deadline passed, and
+        `communication_error_class` if the circuit_breaker is open. The
+        outcome of an admitted call must be given to `record_outcome`.
+
+        :param deadline : time.time() the call must be done by, if any
+
+        :returns seconds left until the deadline, None without one
+        """
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                raise self.timed_out(u"deadline passed, not calling %s" % self.base_url)
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow():
+            raise self.communication_error_class(
+                u"circuit breaker open, not calling %s" % self.base_url)
+        return timeout
+
+    def record_outcome(self, status):
+        """
+        Count the outcome of an admitted call on the circuit_breaker, if any.
+
+        :param status : http status of the response, None if the call failed
+        """
+        breaker = self.circuit_breaker
+        if breaker is not None:
+            breaker.record(status is not None and status < 500)
+
+    def effective_timeout(self, timeout):
+        """
+        :returns seconds a call given timeout may take, the lower of timeout
+                 and run_timeout, None for no limit
+        """
+        if timeout is None:
+            return self.run_timeout
+        if self.run_timeout is None:
+            return timeout
+        return min(timeout, self.run_timeout)
+
+    def timed_out(self, *args):
+        """
+        :returns the error for a call not done in time
+        """
+        return (self.timeout_error_class or self.communication_error_class)(*args)
+
+    def retryable(self, outcome):
+        """
+        Tell whether the outcome of an attempt, a Response or an exception,
+        is worth a retry.
+        """
+        breaker = self.circuit_breaker
+        if breaker is not None and breaker.state == breaker.OPEN:
+            return False
+        if isinstance(outcome, Exception):
+            return isinstance(outcome, self.communication_error_class)
+        return outcome.status in self.retry_policy.retry_statuses
+
+    def call_many(self, bodies, headers=None, timeout=None):
+        """
+        Perform several calls, one after another unless the service knows
+        how to run them concurrently.
+
+        :param bodies : the json-rpc payloads
+        :param headers : the headers sent along with each payload
+        :param timeout : seconds each call may take, see `call`
+
+        :returns list of Response, holding an instance of
+                 `communication_error_class` for each call that failed
+        """
+        results = []
+        for body in bodies:
+            try:
+                results.append(self.call(body, dict(headers or {}),
+                                         timeout=timeout))
+            except self.communication_error_class as e:
+                results.append(e)
+        return results
+
+    def call_async(self, body, headers, callback, timeout=None):
+        """
+        Start a call and have callback(Response) called once it is done,
+        or callback(error) with an instance of `communication_error_class`
+        if it failed. This base implementation performs the call right away.
+
+        :param body : the json-rpc payload
+        :param headers : the headers sent along with the payload
+        :param callback : the callable to pass the outcome of the call to
+        :param timeout : seconds the call may take, see `call`
+        """
+        try:
+            response = self.call(body, headers, timeout=timeout)
+        except self.communication_error_class as e:
+            callback(e)
+        else:
+            callback(response)
+
+    def stream(self, body, headers=None, timeout=None):
+        """
+        Perform a call, getting the response data chunk by chunk as it
+        arrives, so it doesn't need to be held in memory as a whole. This
+        base implementation gets all of it at once.
+
+        :param body : the json-rpc payload
+        :param headers : the headers sent along with the payload
+        :param timeout : seconds the whole transfer may take, see `call`
+
+        :returns (status, iterator of chunks of response data), the iterator
+                 raises `communication_error_class` if the call fails
+        """
+        response = self.call(body, headers, timeout=timeout)
+        return response.status, iter([response.data])
+
+    def perform(self):
+        """
+        Make progress on pending asynchronous calls without blocking.
+
+        :returns the number of calls still pending
+        """
+        return 0
+
+    def run(self, done=None):
+        """
+        Block until the asynchronous calls are done.
+
+        :param done : a callable telling when to stop before all calls are done
+        """
+        pass
+
+    def compress(self, body, headers):
+        """
+        Compress a request body of at least `compress_threshold` bytes,
+        flagging it in headers.
+
+        :returns the body to send, utf-8 encoded
+        """
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        if self.compress_threshold is None or len(body) < self.compress_threshold:
+            return body
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=self.compress_level) as f:
+            f.write(body)
+        headers['Content-Encoding'] = 'gzip'
+        return buf.getvalue()
+
+    def prepare_headers(self, headers):
         if not headers:
             headers = {}
         if self.user_agent and 'User-Agent' not in headers:
             headers['User-Agent'] = self.user_agent.encode("utf-8")
-        return Response(*self._call(body, headers))
+        return headers
 
     def get_transport(self):
         """Helper method to improve testability."""
@@ -0,0 +1,229 @@
+"""
+HttpService spreading calls over several txtr reaktor nodes.
+
+    reaktor = Reaktor(http_service='services.balancing.EndpointSetHttpService',
+                      endpoints=['reaktor1.intern:8080', 'reaktor2.intern:8080'],
+                      balancing='ewma', path='/api/1.50.32/rpc', ...)
+
+Nodes failing `eject_after` calls in a row are left out for `cooldown`
+seconds. Together with a `resilience.RetryPolicy`, retried calls of
+idempotent functions fail over to another node.
+"""
+from __future__ import absolute_import
+from . import HttpService, Response
+from .httplib import ConnectionPool
+from importlib import import_module
+import inspect
+import itertools
+import threading
+import time
+
+
+def import_class(name):
+    """
+    Get a class by its name relative to the holon package, like
+    'services.httplib.HttpLibHttpService'.
+    """
+    if not isinstance(name, basestring):
+        return name
+    module, cls = name.rsplit('.', 1)
+    return getattr(import_module('.' + module, __name__.rsplit('.', 2)[0]), cls)
+
+
+class Endpoint(object):
+    """
+    A node of an EndpointSetHttpService, with its load and health.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.outstanding = 0
+        # moving average of the latency (ms), None until the first call
+        self.ewma = None
+        self.calls = 0
+        self.errors = 0
+        self.ejections = 0
+        self.failures = 0  # in a row
+        self.ejected_until = 0
+
+    def stats(self):
+        return dict(
+            url=self.service.base_url,
+            outstanding=self.outstanding,
+            ewma=self.ewma,
+            calls=self.calls,
+            errors=self.errors,
+            ejections=self.ejections,
+            ejected=self.ejected_until > time.time(),
+        )
+
+
+class EndpointSetHttpService(HttpService):
+    """
+    HttpService calling one of several endpoints, each with a service of
+    its own (and thereby connection pool or curl handles of its own), built
+    with the arguments given for the set but host and port.
+
+    Endpoints are selected by
+      round_robin: in turn
+      least_outstanding: the one with the fewest calls in progress
+      ewma: the one with the lowest moving average of its latency, weighted
+            by its calls in progress
+    """
+    options = ('endpoints', 'balancing', 'backend', 'eject_after', 'cooldown',
+               'compress_threshold', 'max_response_size')
+    BALANCING = ('round_robin', 'least_outstanding', 'ewma')
+    # weight of the latest latency in the moving averages
+    decay = 0.3
+    # latency (ms) accounted for failed calls
+    failure_penalty = 10000
+
+    def __init__(self, *args, **kwargs):
+        """
+        :param endpoints : list of 'host:port' strings or (host, port) tuples
+        :param balancing : one of BALANCING
+        :param backend : HttpService class (or its name) of the endpoints
+        :param eject_after : number of failures in a row ejecting an endpoint
+        :param cooldown : seconds an endpoint stays ejected
+        Options of the backend, like compress_threshold, are passed on;
+        raises ValueError for options the backend doesn't support.
+        """
+        endpoints = kwargs.pop('endpoints')
+        balancing = kwargs.pop('balancing', 'round_robin')
+        backend = import_class(kwargs.pop('backend', 'services.httplib.HttpLibHttpService'))
+        self.eject_after = kwargs.pop('eject_after', 3)
+        self.cooldown = kwargs.pop('cooldown', 30)
+        if balancing not in self.BALANCING:
+            raise ValueError(u"unknown balancing '%s', use one of %s" % (
+                balancing, u', '.join(self.BALANCING)))
+        if not endpoints:
+            raise ValueError(u"no endpoints given")
+        self.balancing = balancing
+        backend_options = dict((k, kwargs.pop(k)) for k in backend.options
+                               if k in kwargs)
+        for k in self.options:
+            if k in kwargs:
+                raise ValueError(u"option '%s' is not supported by %s" % (
+                    k, backend.__name__))
+
+        service_args = inspect.getcallargs(HttpService.__init__, self, *args, **kwargs)
+        service_args.pop('self')
+        self.endpoints = []
+        for endpoint in endpoints:
+            if isinstance(endpoint, basestring):
+                host, port = endpoint.rsplit(':', 1)
+            else:
+                host, port = endpoint
+            backend_args = dict(service_args, host=host, port=int(port))
+            backend_args.update(backend_options)
+            if 'pool' in backend.options:
+                backend_args['pool'] = ConnectionPool()
+            self.endpoints.append(Endpoint(backend(**backend_args)))
+
+        first = self.endpoints[0].service
+        service_args.update(host=first.host, port=first.port)
+        super(EndpointSetHttpService, self).__init__(**service_args)
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def select(self):
+        """
+        Pick the endpoint for a call and count the call as in progress.
+        Ejected endpoints are picked only if all of them are.
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.ejected_until <= now]
+            if not candidates:
+                candidates = self.endpoints
+            # rotate, so ties go to each endpoint in turn
+            turn = next(self._turn) % len(candidates)
+            candidates = candidates[turn:] + candidates[:turn]
+            if self.balancing == 'round_robin':
+                endpoint = candidates[0]
+            elif self.balancing == 'least_outstanding':
+                endpoint = min(candidates, key=lambda e: e.outstanding)
+            else:
+                endpoint = min(candidates,
+                               key=lambda e: (e.ewma or 0) * (e.outstanding + 1))
+            endpoint.outstanding += 1
+        return endpoint
+
+    def release(self, endpoint, response):
+        """
+        Account the outcome of a call: a Response, or None if it failed.
+        """
+        success = response is not None and response.status < 500
+        latency = response.time if response is not None else self.failure_penalty
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.calls += 1
+            if endpoint.ewma is None:
+                endpoint.ewma = latency
+            else:
+                endpoint.ewma += self.decay * (latency - endpoint.ewma)
+            if success:
+                endpoint.failures = 0
+                return
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.eject_after:
+                endpoint.failures = 0
+                endpoint.ejections += 1
+                endpoint.ejected_until = time.time() + self.cooldown
+
+    def _call(self, body, headers, timeout=None):
+        endpoint = self.select()
+        try:
+            response = Response(*endpoint.service._call(body, headers, timeout))
+        except Exception:
+            self.release(endpoint, None)
+            raise
+        self.release(endpoint, response)
+        return response
+
+    def stream(self, body, headers=None, timeout=None):
+        """
+        See `HttpService.stream`. The call stays in progress on the
+        selected endpoint until its chunks are all read, or closed.
+        """
+        self.admit()
+        endpoint = self.select()
+        start = time.time()
+        try:
+            status, chunks = endpoint.service.stream(body, headers, timeout)
+        except Exception:
+            self.release(endpoint, None)
+            self.record_outcome(None)
+            raise
+        self.record_outcome(status)
+
+        def released():
+            response = None
+            try:
+                for chunk in chunks:
+                    yield chunk
+                response = Response(status, None, (time.time() - start) * 1000)
+            finally:
+                self.release(endpoint, response)
+        return status, released()
+
+    @property
+    def timeout_error_class(self):
+        return self.endpoints[0].service.timeout_error_class
+
+    @timeout_error_class.setter
+    def timeout_error_class(self, error_class):
+        for endpoint in self.endpoints:
+            endpoint.service.timeout_error_class = error_class
+
+    def stats(self):
+        """
+        :returns list of the stats of the endpoints
+        """
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    @property
+    def protocol(self):
+        return self.endpoints[0].service.protocol
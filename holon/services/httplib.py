@@ -1,17 +1,191 @@
 from __future__ import absolute_import
 from . import HttpService
 from httplib import HTTPConnection, HTTPException, HTTPSConnection
-from socket import timeout, error
+from httplib import BadStatusLine, CannotSendRequest
+from socket import error as SocketError, timeout as SocketTimeout
+import threading
 import time
+import zlib
+
+
+# errors hinting at a connection closed by the server while idling in the pool
+STALE_CONNECTION_ERRORS = (BadStatusLine, CannotSendRequest, SocketError)
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of persistent HTTP/1.1 connections.
+    Idle connections are kept per (host, port, ssl) key, at most `max_size`
+    of them per key, and are dropped once idle for more than `max_idle`
+    seconds.
+    """
+
+    def __init__(self, max_size=10, max_idle=60):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        """
+        Get an idle connection for `key` or build a new one with `factory`.
+
+        :returns (connection, reused)
+        """
+        stale = []
+        connection = None
+        with self._lock:
+            idle = self._idle.get(key)
+            now = time.time()
+            while idle:
+                candidate, released = idle.pop()
+                if now - released > self.max_idle:
+                    stale.append(candidate)
+                else:
+                    connection = candidate
+                    break
+            self.evictions += len(stale)
+            if connection is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        for candidate in stale:
+            candidate.close()
+        if connection is None:
+            return factory(), False
+        return connection, True
+
+    def release(self, key, connection):
+        """
+        Hand a connection back for reuse, closing it if the pool is full.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+    def stats(self):
+        """
+        Counters to check that connections are actually reused.
+        """
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                idle=sum(len(c) for c in self._idle.values()),
+            )
+
+
+# shared by all HttpLibHttpService instances not given a pool of their own
+default_pool = ConnectionPool()
+
+
+class ResponseTooLarge(Exception):
+    """
+    Raised by Decompressor for a response body expanding beyond its
+    max_size.
+    """
+
+
+class Decompressor(object):
+    """
+    Incremental decoder of a response body sent with Content-Encoding gzip
+    or deflate, counting the bytes in and out. Raises ResponseTooLarge once
+    more than `max_size` bytes are decoded, so a small compressed body can't
+    take all memory.
+    """
+
+    def __init__(self, encoding, max_size=None):
+        self.encoding = encoding
+        self.max_size = max_size
+        if encoding == 'gzip':
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._zlib = zlib.decompressobj()
+        self.wire_size = 0
+        self.size = 0
+
+    def _max_length(self):
+        """
+        :returns the bytes to decode at most, one more than allowed to tell
+                 when the limit is exceeded; 0 for no limit
+        """
+        if self.max_size is None:
+            return 0
+        return self.max_size - self.size + 1
+
+    def _checked(self, decoded):
+        self.size += len(decoded)
+        if self.max_size is not None and self.size > self.max_size:
+            raise ResponseTooLarge(u"response body exceeds %i bytes" % self.max_size)
+        return decoded
+
+    def decompress(self, data):
+        try:
+            decoded = self._zlib.decompress(data, self._max_length())
+        except zlib.error:
+            if self.encoding != 'deflate' or self.wire_size:
+                raise
+            # some servers send deflate data without the zlib header
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            decoded = self._zlib.decompress(data, self._max_length())
+        self.wire_size += len(data)
+        return self._checked(decoded)
+
+    def flush(self):
+        return self._checked(self._zlib.flush())
+
+
+def decompressor(response, max_size=None):
+    """
+    :returns a Decompressor for the body of a httplib response, None if it
+             isn't compressed
+    """
+    encoding = (response.getheader('content-encoding') or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return Decompressor('gzip', max_size)
+    if encoding == 'deflate':
+        return Decompressor('deflate', max_size)
+    return None
 
 
 class HttpLibHttpService(HttpService):
     """
     HttpService using python batteries' httplib.
+    Connections are kept alive in a `ConnectionPool`, pass `pool=False` to
+    open a new connection on every call. Responses are asked for gzip or
+    deflate compressed, request bodies of at least `compress_threshold`
+    bytes are sent gzip compressed. Compressed responses decoding to more
+    than `max_response_size` bytes fail with `communication_error_class`.
     """
+    options = ('pool', 'compress_threshold', 'max_response_size')
+    # bytes read at once by stream
+    chunk_size = 16384
+    # bytes a compressed response may decode to, None for no limit
+    max_response_size = 256 * 1024 * 1024
 
     def __init__(self, *args, **kwargs):
+        pool = kwargs.pop('pool', None)
+        self.compress_threshold = kwargs.pop('compress_threshold', self.compress_threshold)
+        self.max_response_size = kwargs.pop('max_response_size', self.max_response_size)
         super(HttpLibHttpService, self).__init__(*args, **kwargs)
+        self.pool = default_pool if pool is None else pool
         if self.ssl:
             self.connection_class = HTTPSConnection
         else:
@@ -22,19 +196,149 @@ class HttpLibHttpService(HttpService):
         return self.connection_class(self.host, self.port,
                                      timeout=self.connect_timeout)
 
-    def _call(self, body, headers):
+    @property
+    def pool_key(self):
+        return self.host, self.port, self.ssl
+
+    def acquire_connection(self):
+        """
+        :returns (connection, reused)
+        """
+        if not self.pool:
+            return self.get_transport(), False
+        return self.pool.acquire(self.pool_key, self.get_transport)
+
+    def release_connection(self, connection, response):
+        if self.pool and not response.will_close:
+            self.pool.release(self.pool_key, connection)
+        else:
+            connection.close()
+
+    def _request(self, connection, body, headers, deadline):
+        if connection.sock is None:
+            connection.timeout = self.connect_timeout
+            if deadline is not None:
+                left = max(deadline - time.time(), 0.001)
+                connection.timeout = min(connection.timeout or left, left)
+            connection.connect()
+        self.set_timeout(connection, deadline)
+        connection.request('POST', self.path, body, headers)
+        return connection.getresponse()
+
+    def set_timeout(self, connection, deadline):
+        """
+        Bound the socket operations of a connection by the time left until
+        deadline, or by connect_timeout if there is none.
+        """
+        if connection.sock is None:
+            # closed by a response which is to close it, reading on
+            return
+        if deadline is None:
+            connection.sock.settimeout(self.connect_timeout)
+        else:
+            connection.sock.settimeout(max(deadline - time.time(), 0.001))
+
+    def deadline(self, start_time, timeout):
+        """
+        :returns time.time() the call may last until, None for no limit
+        """
+        timeout = self.effective_timeout(timeout)
+        return start_time + timeout if timeout is not None else None
+
+    def _send(self, body, headers, deadline=None):
+        """
+        Send a request, retrying once on a new connection if a reused one
+        turns out to be closed by the server.
+
+        :returns (connection, response) once the response headers are in
+        """
+        headers.setdefault('Content-Type', 'application/octet-stream')
+        headers.setdefault('Accept', 'application/json')
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        payload = self.compress(body, headers)
+        connection = None
+        try:
+            connection, reused = self.acquire_connection()
+            try:
+                return connection, self._request(connection, payload, headers, deadline)
+            except STALE_CONNECTION_ERRORS as e:
+                if not reused or isinstance(e, SocketTimeout):
+                    raise
+                # the server dropped the idle connection, retry on a new one
+                connection.close()
+                connection = self.get_transport()
+                return connection, self._request(connection, payload, headers, deadline)
+        except (HTTPException, SocketTimeout, SocketError), e:
+            if connection is not None:
+                connection.close()
+            raise self._error(e, body)
+
+    def _error(self, e, body):
+        error_class = self.timed_out if isinstance(e, SocketTimeout) else self.communication_error_class
+        return error_class(u"%s failed with %s when attempting to make a call to %s with body %s" % (self.__class__.__name__, e.__class__.__name__, self.base_url, body))
+
+    def _call(self, body, headers, timeout=None):
         start_time = time.time()
+        deadline = self.deadline(start_time, timeout)
+        connection, response = self._send(body, headers, deadline)
+        # the status line and headers are in
+        start_transfer_time = time.time()
         try:
-            connection = self.get_transport()
-            response = connection.getresponse()
-        except (HTTPException, timeout, error), e:
-            raise self.communication_error_class(u"%s failed with %s when attempting to make a call to %s with body %s" % (self.__class__.__name__, e.__class__.__name__, self.base_url, body))
-        else:
-            data = unicode(response.read(), "utf-8")
-        finally:
+            self.set_timeout(connection, deadline)
+            data = response.read()
+            wire_size = len(data)
+            decoder = decompressor(response, self.max_response_size)
+            if decoder is not None:
+                data = decoder.decompress(data) + decoder.flush()
+        except (HTTPException, SocketTimeout, SocketError, zlib.error, ResponseTooLarge), e:
             connection.close()
+            raise self._error(e, body)
+        self.release_connection(connection, response)
         end_time = time.time()
-        return response.status, data, (end_time - start_time)*1000
+        return (response.status, data, (end_time - start_time)*1000,
+                (start_transfer_time - start_time)*1000, wire_size, len(data))
+
+    def stream(self, body, headers=None, timeout=None):
+        """See `HttpService.stream`."""
+        deadline = self.deadline(time.time(), timeout)
+        self.admit()
+        try:
+            connection, response = self._send(body, self.prepare_headers(headers),
+                                              deadline)
+        except:
+            self.record_outcome(None)
+            raise
+        self.record_outcome(response.status)
+
+        decoder = decompressor(response, self.max_response_size)
+
+        def chunks():
+            done = False
+            try:
+                while True:
+                    self.set_timeout(connection, deadline)
+                    chunk = response.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if decoder is not None:
+                        chunk = decoder.decompress(chunk)
+                        if not chunk:
+                            continue
+                    yield chunk
+                if decoder is not None:
+                    chunk = decoder.flush()
+                    if chunk:
+                        yield chunk
+                done = True
+            except (HTTPException, SocketTimeout, SocketError, zlib.error, ResponseTooLarge), e:
+                raise self._error(e, body)
+            finally:
+                if done:
+                    self.release_connection(connection, response)
+                else:
+                    # the rest of the response is still on the connection
+                    connection.close()
+        return response.status, chunks()
 
     @property
     def protocol(self):
@@ -1,56 +1,315 @@
 from __future__ import absolute_import
-from . import HttpService
+from . import HttpService, Response
 from StringIO import StringIO
+from collections import deque
 import pycurl
-# import time
+import sys
+import threading
 
 
 assert pycurl.version_info()[1] >= "7.19"
 
 
+def select(multi):
+    """Wait for activity on the transfers of a `pycurl.CurlMulti`, at most
+    as long as libcurl asks for.
+    """
+    timeout = multi.timeout()
+    multi.select(timeout / 1000.0 if timeout >= 0 else 1.0)
+
+
 class PyCurlHttpService(HttpService):
-    """HttpService using extra-fast pycurl."""
+    """HttpService using extra-fast pycurl.
+    Curl handles are configured once and kept per thread, so libcurl can
+    reuse its connections. DNS and SSL session caches are shared between
+    all handles of a service. Responses are asked for compressed, request
+    bodies of at least `compress_threshold` bytes are sent gzip compressed.
+    """
+    options = ('compress_threshold', )
+    # idle curl handles kept per thread
+    max_handles = 16
 
     def __init__(self, *args, **kwargs):
+        self.compress_threshold = kwargs.pop('compress_threshold', self.compress_threshold)
         super(PyCurlHttpService, self).__init__(*args, **kwargs)
         pycurl.global_init(pycurl.GLOBAL_ALL)
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        self._local = threading.local()
 
     @staticmethod
     def get_transport():
         """Helper method to improve testability."""
         return pycurl.Curl()
 
-    def _call(self, body, headers):
-        # to collect response data
-        data = StringIO()
-        # construct curl object
+    def acquire_handle(self):
+        """Get an idle curl handle of the current thread, or configure a new one."""
+        handles = self._idle_handles()
+        if handles:
+            return handles.pop()
         curl = self.get_transport()
-        curl.setopt(pycurl.USERAGENT,      headers.pop('User-Agent', '').encode("utf-8"))
-        curl.setopt(pycurl.TIMEOUT,        self.run_timeout)
-        curl.setopt(pycurl.CONNECTTIMEOUT, self.connect_timeout)
+        if self.connect_timeout is not None:
+            curl.setopt(pycurl.CONNECTTIMEOUT, self.connect_timeout)
         curl.setopt(pycurl.SSL_VERIFYPEER, False)
         curl.setopt(pycurl.URL,            self.base_url.encode("utf-8"))
-        curl.setopt(pycurl.POSTFIELDS,     body.encode("utf8"))
-        curl.setopt(pycurl.WRITEFUNCTION,  data.write)
         curl.setopt(pycurl.ENCODING,       "")
+        curl.setopt(pycurl.SHARE,          self.share)
+        return curl
+
+    def release_handle(self, curl):
+        handles = self._idle_handles()
+        if len(handles) < self.max_handles:
+            handles.append(curl)
+        else:
+            curl.close()
+
+    def _idle_handles(self):
+        try:
+            return self._local.handles
+        except AttributeError:
+            self._local.handles = []
+            return self._local.handles
+
+    def prepare(self, curl, body, headers, timeout=None):
+        """Set the per request options of a curl handle.
+        timeout: seconds the transfer may take, see `HttpService.call`
+        Returns the buffer the response data will be written to.
+        """
+        # to collect response data
+        data = StringIO()
+        curl.setopt(pycurl.USERAGENT,      headers.pop('User-Agent', '').encode("utf-8"))
+        # set on every request, as handles are reused (0 for no limit)
+        timeout = self.effective_timeout(timeout)
+        curl.setopt(pycurl.TIMEOUT_MS,     max(int(timeout * 1000), 1) if timeout is not None else 0)
+        payload = self.compress(body, headers)
+        curl.setopt(pycurl.POSTFIELDS,     payload)
+        curl.setopt(pycurl.WRITEFUNCTION,  data.write)
         curl.setopt(pycurl.HTTPHEADER,     [
             "Content-type: application/octet-stream",
-            "Content-Length: %i" % len(body),
+            "Content-Length: %i" % len(payload),
             "Accept: application/json",
         ] + ['%s: %s' % (k, v) for k, v in headers.items()])
+        return data
+
+    def _call(self, body, headers, timeout=None):
+        curl = self.acquire_handle()
+        data = self.prepare(curl, body, headers, timeout)
 
        # the actual call
         try:
             curl.perform()
-            code = curl.getinfo(pycurl.HTTP_CODE)
-            # start_transfer_time = curl.getinfo(pycurl.STARTTRANSFER_TIME)
-            total_time = curl.getinfo(pycurl.TOTAL_TIME)
-            curl.close()
+            return self.response(curl, data)
         except pycurl.error, err:
             # raise common error class
-            raise self.communication_error_class(err[0], err[1])
-        return code, unicode(data.getvalue(), "utf-8"), total_time
+            raise self.error(err[0], err[1])
+        finally:
+            self.release_handle(curl)
+
+    def error(self, errno, errmsg):
+        """Get the common error class instance for a curl error."""
+        if errno == pycurl.E_OPERATION_TIMEDOUT:
+            return self.timed_out(errno, errmsg)
+        return self.communication_error_class(errno, errmsg)
+
+    @staticmethod
+    def response(curl, data):
+        """Get the Response of a completed transfer."""
+        data = data.getvalue()
+        return Response(curl.getinfo(pycurl.HTTP_CODE),
+                        data,
+                        curl.getinfo(pycurl.TOTAL_TIME) * 1000,
+                        curl.getinfo(pycurl.STARTTRANSFER_TIME) * 1000,
+                        # bytes received, before libcurl decoded them
+                        int(curl.getinfo(pycurl.SIZE_DOWNLOAD)),
+                        len(data))
+
+    def call_many(self, bodies, headers=None, timeout=None):
+        """Perform several calls concurrently on the current thread,
+        driving them with a `pycurl.CurlMulti`.
+        See `HttpService.call_many`.
+        """
+        multi = pycurl.CurlMulti()
+        transfers = []
+        for body in bodies:
+            try:
+                self.admit()
+            except self.communication_error_class as e:
+                # the circuit breaker is open
+                transfers.append((None, e))
+                continue
+            curl = self.acquire_handle()
+            data = self.prepare(curl, body, self.prepare_headers(dict(headers or {})),
+                                timeout)
+            multi.add_handle(curl)
+            transfers.append((curl, data))
+
+        # the actual calls
+        running = len(transfers)
+        while running:
+            ret, running = multi.perform()
+            if ret == pycurl.E_CALL_MULTI_PERFORM:
+                continue
+            if running:
+                select(multi)
+
+        failed = {}
+        queued = True
+        while queued:
+            queued, _, errors = multi.info_read()
+            for curl, errno, errmsg in errors:
+                failed[curl] = (errno, errmsg)
+
+        results = []
+        for curl, data in transfers:
+            if curl is None:
+                results.append(data)
+                continue
+            multi.remove_handle(curl)
+            if curl in failed:
+                # common error class
+                results.append(self.error(*failed[curl]))
+                self.record_outcome(None)
+            else:
+                results.append(self.response(curl, data))
+                self.record_outcome(results[-1].status)
+            self.release_handle(curl)
+        multi.close()
+        return results
+
+    def stream(self, body, headers=None, timeout=None):
+        """Perform a call with a `pycurl.CurlMulti`, handing out the chunks
+        of response data libcurl writes as soon as they arrive.
+        See `HttpService.stream`.
+        """
+        self.admit()
+        curl = self.acquire_handle()
+        self.prepare(curl, body, self.prepare_headers(headers), timeout)
+        received = deque()
+        curl.setopt(pycurl.WRITEFUNCTION, received.append)
+        multi = pycurl.CurlMulti()
+        multi.add_handle(curl)
+
+        def perform():
+            """Transfer what is available, waiting for it if nothing is.
+            Returns whether the transfer is still running.
+            """
+            while True:
+                ret, running = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            _, _, failed = multi.info_read()
+            if failed:
+                _, errno, errmsg = failed[0]
+                # common error class
+                raise self.error(errno, errmsg)
+            if running and not received:
+                select(multi)
+            return running
+
+        def close():
+            multi.remove_handle(curl)
+            multi.close()
+            self.release_handle(curl)
+
+        # the status is known along with the first data
+        try:
+            running = True
+            while running and not received:
+                running = perform()
+        except:
+            close()
+            self.record_outcome(None)
+            raise
+        status = curl.getinfo(pycurl.HTTP_CODE)
+        self.record_outcome(status)
+
+        def chunks(running):
+            try:
+                while True:
+                    while received:
+                        yield received.popleft()
+                    if not running:
+                        break
+                    running = perform()
+            finally:
+                close()
+        return status, chunks(running)
 
     @property
     def protocol(self):
         return self.base_url.split('://')[0].upper()
+
+
+class AsyncPyCurlHttpService(PyCurlHttpService):
+    """PyCurlHttpService running calls concurrently on one thread.
+    Calls started with call_async are driven by one long-lived
+    `pycurl.CurlMulti`, which keeps connections alive across calls. An
+    instance must only be used from a single thread.
+    """
+    options = PyCurlHttpService.options + ('max_connections', )
+
+    def __init__(self, *args, **kwargs):
+        max_connections = kwargs.pop('max_connections', None)
+        super(AsyncPyCurlHttpService, self).__init__(*args, **kwargs)
+        self.multi = pycurl.CurlMulti()
+        if max_connections:
+            self.multi.setopt(pycurl.M_MAX_TOTAL_CONNECTIONS, max_connections)
+        self.transfers = {}
+
+    def call_async(self, body, headers, callback, timeout=None):
+        """See `HttpService.call_async`."""
+        try:
+            self.admit()
+        except self.communication_error_class as e:
+            # the circuit breaker is open
+            callback(e)
+            return
+        curl = self.acquire_handle()
+        data = self.prepare(curl, body, self.prepare_headers(headers), timeout)
+        self.transfers[curl] = (data, callback)
+        self.multi.add_handle(curl)
+
+    def perform(self):
+        """See `HttpService.perform`."""
+        while True:
+            ret, _ = self.multi.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+        # all transfers done are finished even if callbacks raise, the
+        # first error is raised afterwards
+        errors = []
+        queued = True
+        while queued:
+            queued, succeeded, failed = self.multi.info_read()
+            outcomes = [(curl, None) for curl in succeeded] + [
+                # common error class
+                (curl, self.error(errno, errmsg)) for curl, errno, errmsg in failed]
+            for curl, error in outcomes:
+                try:
+                    self._finish(curl, error)
+                except Exception:
+                    errors.append(sys.exc_info())
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return len(self.transfers)
+
+    def run(self, done=None):
+        """See `HttpService.run`."""
+        while self.perform() and not (done and done()):
+            select(self.multi)
+
+    def _finish(self, curl, error):
+        data, callback = self.transfers.pop(curl)
+        try:
+            self.multi.remove_handle(curl)
+            if error is None:
+                outcome = self.response(curl, data)
+            else:
+                outcome = error
+        except pycurl.error, err:
+            outcome = self.error(err[0], err[1])
+        finally:
+            self.release_handle(curl)
+        self.record_outcome(None if isinstance(outcome, Exception) else outcome.status)
+        callback(outcome)
@@ -0,0 +1,188 @@
+"""
+Retries and circuit breaking of the calls of an HttpService.
+
+    reaktor = Reaktor(retry_policy=RetryPolicy(max_attempts=4, deadline=10),
+                      circuit_breaker=CircuitBreaker(),
+                      idempotent=['WSDocMgmt.getDocument'], **config)
+
+Only calls of idempotent functions are retried, and only by
+`HttpService.call`. The circuit breaker guards all calls, the ones of
+`call_many`, `call_async` and `stream` too.
+"""
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """
+    Retries of failed calls with exponential backoff and full jitter, within
+    a total time budget.
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.1, max_backoff=2.0,
+                 multiplier=2.0, jitter=True, deadline=None,
+                 retry_statuses=(502, 503, 504)):
+        """
+        :param max_attempts : calls made at most, including the first one
+        :param backoff : seconds waited before the first retry
+        :param max_backoff : seconds waited at most between attempts
+        :param multiplier : growth of the backoff from attempt to attempt
+        :param jitter : wait a random time up to the backoff, so clients
+                        failing together don't retry together
+        :param deadline : seconds all attempts and waits may take in total
+        :param retry_statuses : http statuses retried like communication
+                                errors
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retries = 0
+        self.gave_up = 0
+        self._lock = threading.Lock()
+
+    def delay(self, attempt):
+        """
+        :returns seconds to wait before the retry following attempt (1-based)
+        """
+        delay = min(self.max_backoff,
+                    self.backoff * self.multiplier ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def sleep(self, seconds):
+        """Helper method to improve testability."""
+        time.sleep(seconds)
+
+    def run(self, attempt_call, retryable, deadline=None):
+        """
+        Call attempt_call() until it succeeds or retries are exhausted.
+
+        :param attempt_call : performs one attempt, returns a Response or
+                              raises
+        :param retryable : tells whether the outcome of an attempt, a Response
+                           or an exception, is worth a retry
+        :param deadline : time.time() after which no retry is started, on
+                          top of the deadline of the policy
+
+        :returns the Response of the last attempt
+        """
+        start = time.time()
+        if self.deadline is not None:
+            deadline = min(deadline or float('inf'), start + self.deadline)
+        attempt = 1
+        while True:
+            try:
+                outcome = attempt_call()
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                outcome = e
+            else:
+                if not retryable(outcome):
+                    return outcome
+
+            delay = self.delay(attempt)
+            if attempt >= self.max_attempts or (
+                    deadline is not None and time.time() + delay > deadline):
+                with self._lock:
+                    self.gave_up += 1
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+            with self._lock:
+                self.retries += 1
+            self.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(retries=self.retries, gave_up=self.gave_up)
+
+
+class CircuitBreaker(object):
+    """
+    Thread-safe circuit breaker. It opens once the share of failed calls
+    among the latest `window` ones reaches `failure_rate`, and then fails
+    calls fast for `reset_timeout` seconds. After that, up to
+    `half_open_calls` probe calls are let through: if they succeed the
+    breaker closes again, otherwise it opens again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_rate=0.5, window=20, min_calls=10,
+                 reset_timeout=30, half_open_calls=1):
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self._outcomes = []
+        self._opened_at = None
+        self._probes = self._probes_passed = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        :returns whether a call may be made now
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._probes = self._probes_passed = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record(self, success):
+        """Count the outcome of a call allowed before."""
+        with self._lock:
+            if self.state == self.OPEN:
+                # a call made before the breaker opened
+                return
+            if self.state == self.HALF_OPEN:
+                if not success:
+                    self._open()
+                else:
+                    self._probes_passed += 1
+                    if self._probes_passed >= self.half_open_calls:
+                        self.state = self.CLOSED
+                return
+            self._outcomes.append(success)
+            if len(self._outcomes) > self.window:
+                del self._outcomes[0]
+            if len(self._outcomes) >= self.min_calls and \
+                    self._failure_rate() >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.state, self._opened_at = self.OPEN, time.time()
+        self._outcomes = []
+        self.opened += 1
+
+    def _failure_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / float(len(self._outcomes))
+
+    def stats(self):
+        """
+        Metrics of the breaker, state being one of 'closed', 'open' and
+        'half_open'.
+        """
+        with self._lock:
+            return dict(state=self.state, opened=self.opened,
+                        rejected=self.rejected,
+                        failure_rate=self._failure_rate())
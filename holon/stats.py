@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Call history and per-function statistics of a Reaktor.
+
+Both are cheap enough to be kept in production: the history is a ring
+buffer of compact records, the statistics are counters and a latency
+histogram per '<interface>.<function>'.
+
+    reaktor.stats.snapshot()['WSDocMgmt.getDocument']['p99']
+"""
+from bisect import bisect_left
+from collections import deque
+import threading
+
+
+# upper bounds (ms) of the buckets of the latency histograms, growing by 25%
+# from 0.5ms to about 2 minutes - so percentiles are off by 25% at most
+BUCKETS = [0.5 * 1.25 ** i for i in range(57)] + [float('inf')]
+
+
+class CallRecord(object):
+    """A call in the history of a Reaktor. Fields can be accessed as
+    attributes as well as items, like the former summary dicts. Their
+    'request' describes the call without its params, which are not kept.
+    """
+    __slots__ = ('function', 'status', 'length', 'received', 'duration',
+                 'request_id', 'cached', 'timestamp', 'headers', 'protocol')
+
+    def __init__(self, function, status, length, received, duration,
+                 request_id, cached, timestamp, headers=None, protocol=None):
+        self.function, self.status = function, status
+        self.length, self.received = length, received
+        self.duration, self.request_id = duration, request_id
+        self.cached, self.timestamp = cached, timestamp
+        self.headers, self.protocol = headers, protocol
+
+    @property
+    def request(self):
+        """Get the description of the request, like 'POST
+        WSAuth.authenticateAnonymous HTTP/1.1'.
+        """
+        function = self.function
+        if isinstance(function, tuple):
+            function = u'[%s]' % u', '.join(function)
+        return u'POST %s %s%s' % (function, self.protocol,
+                                  u' (cached)' if self.cached else u'')
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __repr__(self):
+        return u'<CallRecord %s %s %sms>' % (self.function, self.status, self.duration)
+
+
+class CallHistory(deque):
+    """The latest calls of a Reaktor, as CallRecord's. Slices are lists,
+    like the ones of the former history list.
+    """
+
+    def __init__(self, capacity):
+        super(CallHistory, self).__init__(maxlen=capacity)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        return super(CallHistory, self).__getitem__(index)
+
+
+class MethodStats(object):
+    """Statistics of the calls of a txtr-reaktor function."""
+    __slots__ = ('calls', 'errors', 'cached', 'bytes_sent', 'bytes_received',
+                 'total_time', 'histogram')
+
+    def __init__(self):
+        self.calls = self.errors = self.cached = 0
+        self.bytes_sent = self.bytes_received = 0
+        self.total_time = 0.0
+        self.histogram = [0] * len(BUCKETS)
+
+    def percentile(self, q):
+        """Get the upper bound (ms) of the latency of the q-th percentile."""
+        timed = sum(self.histogram)
+        if not timed:
+            return None
+        rank = q / 100.0 * timed
+        seen = 0
+        for bound, count in zip(BUCKETS, self.histogram):
+            seen += count
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+    def as_dict(self):
+        timed = sum(self.histogram)
+        return dict(
+            calls=self.calls,
+            errors=self.errors,
+            cached=self.cached,
+            bytes_sent=self.bytes_sent,
+            bytes_received=self.bytes_received,
+            mean=self.total_time / timed if timed else None,
+            p50=self.percentile(50),
+            p95=self.percentile(95),
+            p99=self.percentile(99),
+        )
+
+
+class ReaktorStats(object):
+    """Thread-safe statistics of the calls of a Reaktor, per function."""
+
+    def __init__(self):
+        self.methods = {}
+        self._lock = threading.Lock()
+
+    def _get(self, function):
+        try:
+            return self.methods[function]
+        except KeyError:
+            return self.methods.setdefault(function, MethodStats())
+
+    def add(self, function, duration, sent, received, error=False,
+            cached=False):
+        """Count a call.
+        duration: float, ms, None if unknown
+        sent, received: int, bytes
+        """
+        with self._lock:
+            stats = self._get(function)
+            stats.calls += 1
+            stats.bytes_sent += sent
+            stats.bytes_received += received
+            if error:
+                stats.errors += 1
+            if cached:
+                stats.cached += 1
+            elif duration is not None:
+                stats.total_time += duration
+                stats.histogram[bisect_left(BUCKETS, duration)] += 1
+
+    def add_error(self, function):
+        """Count an error of a call counted already, e.g. a ReaktorApiError."""
+        with self._lock:
+            self._get(function).errors += 1
+
+    def snapshot(self):
+        """Get the statistics as dicts, by function."""
+        with self._lock:
+            return dict((function, stats.as_dict())
+                        for function, stats in self.methods.items())
+
+    def reset(self):
+        with self._lock:
+            self.methods = {}
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Incremental decoding of JSON-RPC responses, see Reaktor.stream.
+
+The items of the result array are decoded one by one while the chunks of the
+response arrive, so only the current chunk and item are held in memory no
+matter how large the result is.
+"""
+import codecs
+import json
+
+
+WHITESPACE = u' \t\n\r'
+# characters numbers start with|consist of
+NUMBER_START = u'-0123456789'
+NUMBER_CHARS = u'0123456789+-.eE'
+# characters a single value may take, bounding the data buffered for it
+MAX_VALUE_SIZE = 64 * 1024 * 1024
+
+
+class ResultParser(object):
+    """Iterates the items of the result of a JSON-RPC response given as
+    chunks of (utf-8 encoded) data. The other members of the response, like
+    error and id, are collected in envelope as they are parsed.
+    A result which is not an array is yielded as the only item, a null
+    result not at all.
+    Raises ValueError for malformed data.
+    """
+
+    def __init__(self, chunks, decoder=None, max_value_size=MAX_VALUE_SIZE,
+                 lists_only=False):
+        """Init.
+        chunks: iterable of str or unicode
+        decoder: json.JSONDecoder (or compatible) decoding the values
+        max_value_size: int, characters a value may take before ValueError
+                        is raised, None for no limit
+        lists_only: bool, stop at a result which is not an array instead of
+                    yielding it, list_result tells
+        """
+        self.chunks = iter(chunks)
+        self.decoder = decoder or json.JSONDecoder()
+        self.max_value_size = max_value_size
+        self.lists_only = lists_only
+        self.envelope = {}
+        # whether the result is an array, None until it is parsed
+        self.list_result = None
+        # bytes of data read so far
+        self.received = 0
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer, self._pos = u'', 0
+
+    def __iter__(self):
+        self._expect(u'{')
+        if self._peek() == u'}':
+            return
+        while True:
+            key = self._value()
+            self._expect(u':')
+            if key == u'result':
+                self.list_result = self._peek() == u'['
+                if self.lists_only and not self.list_result:
+                    return
+            if key == u'result' and self.list_result:
+                self._pos += 1
+                if self._peek() == u']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(u',]') == u']':
+                            break
+            else:
+                value = self._value()
+                if key != u'result':
+                    self.envelope[key] = value
+                elif value is not None:
+                    yield value
+            if self._expect(u',}') == u'}':
+                return
+
+    def _fill(self, size=0):
+        """Append the next chunk to the unparsed data, or as many chunks as
+        it takes to append size characters at least.
+        Returns False if there is none.
+        """
+        unparsed = len(self._buffer) - self._pos
+        chunks, appended = [], 0
+        for chunk in self.chunks:
+            self.received += len(chunk)
+            if not isinstance(chunk, unicode):
+                chunk = self._utf8.decode(chunk)
+            chunks.append(chunk)
+            appended += len(chunk)
+            if self.max_value_size is not None and \
+                    unparsed + appended > self.max_value_size:
+                raise ValueError(u"value at %i exceeds %i characters" % (
+                    self.received - unparsed - appended, self.max_value_size))
+            if appended >= size:
+                break
+        if not chunks:
+            return False
+        self._buffer = self._buffer[self._pos:] + u''.join(chunks)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Get the next non-whitespace character, u'' at the end of data."""
+        while True:
+            buffer, pos = self._buffer, self._pos
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self._fill():
+                return u''
+
+    def _expect(self, chars):
+        """Consume the next character, which has to be one of chars."""
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError(u"expected one of '%s' at %i, got '%s'" % (
+                chars, self.received - len(self._buffer) + self._pos, char))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode the next value, reading as many chunks as it spans."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # the value goes on, read three times as much as is buffered
+                # of it before decoding it again, so large values are decoded
+                # a few times only rather than once per chunk
+                if not self._fill(3 * (len(self._buffer) - self._pos)):
+                    raise
+                continue
+            # a number ending the data read so far may go on in the next chunk
+            if self._buffer[self._pos] in NUMBER_START and \
+                    self._number_open(end) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _number_open(self, end):
+        """Whether the number decoded up to end may go on after the data
+        read so far, like '1.' or '2e'.
+        """
+        buffer = self._buffer
+        while end < len(buffer) and buffer[end] in NUMBER_CHARS:
+            end += 1
+        return end == len(buffer)
@@ -1,11 +1,16 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
 from contextlib import contextmanager
 from httplib import HTTPConnection, HTTPSConnection, HTTPException
 from mock import Mock, patch
 from reaktor import *
 from services import HttpService
-from services.httplib import HttpLibHttpService
+from services.httplib import ConnectionPool, HttpLibHttpService
 from services.pycurl import PyCurlHttpService
 import pycurl
+import socket
+import threading
+import time
 import unittest
 
 
@@ -18,6 +23,147 @@ def patch_http_response(request, resp):
         pass
 
 
+class EchoHandler(BaseHTTPRequestHandler):
+    """Answers each POST with its own body."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RpcHandler(EchoHandler):
+    """Answers each JSON-RPC request with its params as result."""
+
+    def do_POST(self):
+        import json
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        body = json.dumps({'result': request['params'], 'id': request['id']})
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class GarbageHandler(RpcHandler):
+    """Answers requests with 'bad' in their params with malformed data."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if 'bad' in body:
+            body = '{"result": garbage'
+        else:
+            import json
+            request = json.loads(body)
+            body = json.dumps({'result': request['params'], 'id': request['id']})
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class GzipHandler(EchoHandler):
+    """Answers each POST with its own body, repeated and gzip compressed.
+    Compressed request bodies are decompressed."""
+    repeat = 100
+
+    def do_POST(self):
+        import gzip
+        import zlib
+        from cStringIO import StringIO
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(body * self.repeat)
+        body = buf.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SlowHandler(EchoHandler):
+    """Answers each POST after a while."""
+    delay = 0.5
+
+    def do_POST(self):
+        time.sleep(self.delay)
+        EchoHandler.do_POST(self)
+
+
+class StallingHandler(EchoHandler):
+    """Answers each POST with its own body, stalling halfway through it."""
+    delay = 0.5
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2])
+        self.wfile.flush()
+        time.sleep(self.delay)
+        self.wfile.write(body[len(body) // 2:])
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, *args):
+        HTTPServer.__init__(self, *args)
+        # the sockets of the connections being served
+        self.connections = set()
+
+    def finish_request(self, request, client_address):
+        self.connections.add(request)
+        try:
+            HTTPServer.finish_request(self, request, client_address)
+        finally:
+            self.connections.discard(request)
+
+    def handle_error(self, request, client_address):
+        import sys
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+        # else a client dropped its connection in the middle of a test
+
+    def close_connections(self, timeout=1):
+        """End idle keep-alive connections and wait for their threads."""
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        deadline = time.time() + timeout
+        while self.connections and time.time() < deadline:
+            time.sleep(0.005)
+
+
+@contextmanager
+def local_server(handler=EchoHandler):
+    """Runs a http server on localhost, yields its port."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05, ))
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.close_connections()
+        server.server_close()
+
+
 class HttpServiceMock(HttpService):
     """This one is useful to test the base service methods."""
     pass
@@ -89,6 +235,14 @@ class ReaktorMetaTestCase(unittest.TestCase):
         r = Reaktor(**r_config)
         self.assertEqual(r.http_service.user_agent, user_agent)
 
+    def test_passes_service_options(self):
+        """Options declared by the http service class are sliced out as well."""
+        pool = ConnectionPool()
+        r = Reaktor(**dict(reaktor_config.items() + [
+            ('http_service', 'services.httplib.HttpLibHttpService'),
+            ('pool', pool)]))
+        self.assertIs(r.http_service.pool, pool)
+
 
 class ReaktorInterfaceTestCase(unittest.TestCase):
     def setUp(self):
@@ -106,7 +260,7 @@ class ReaktorInterfaceTestCase(unittest.TestCase):
                                      headers={'head': 'bang'})
 
 
-@patch('holon.reaktor.id_generator', return_value='')
+@patch('holon.reaktor.next_request_id', return_value='')
 class ReaktorTestCase(unittest.TestCase):
     def setUp(self):
         self.reaktor = Reaktor(**reaktor_config)
@@ -127,6 +281,14 @@ class ReaktorTestCase(unittest.TestCase):
                               data_converter=custom_converter)
             custom_converter.assert_called_with({u'prop': u'value'})
 
+    def test_reaktor_call_timeout(self, _):
+        """The timeout of a call goes to the http service."""
+        self.assertIs(self.reaktor.http_service.timeout_error_class,
+                      ReaktorTimeoutError)
+        with patch_json(self.reaktor, '{"prop":"value"}'):
+            self.reaktor.RpcInterface.Method(1, timeout=2)
+            self.assertEqual(self.reaktor.http_service.call.call_args[1]['timeout'], 2)
+
     def test_reaktor_call_multiple_results(self, _):
         """Multiple results are converted to a list of objects."""
         with patch_json(self.reaktor, '[{"o":1}, {"o":2}, {"o":3}]'):
@@ -144,10 +306,181 @@ class ReaktorTestCase(unittest.TestCase):
             self.reaktor.call('Interface.Method', [])
         self.assertEqual(len(self.reaktor.history), 1)
         self.reaktor.clear()
-        self.assertEqual(self.reaktor.history, [])
+        self.assertEqual(list(self.reaktor.history), [])
 
+    def test_log(self, _):
+        """Requests are logged to holon.request, response data to holon.reaktor."""
+        r = Reaktor(**dict(reaktor_config.items() + [('log_max_length', 5)]))
+        with patch('holon.reaktor.logger_request') as logger_request:
+            with patch('holon.reaktor.logger') as logger:
+                with patch_json(r, '"0123456789"'):
+                    r.call('Interface.Method', ['0123456789'])
+        message = logger_request.info.call_args[0][0]
+        self.assertTrue(message.startswith(u"POST Interface.Method ['012... ("))
+        self.assertTrue(logger.debug.call_args[0][0].startswith(u'{"err... ('))
 
-@patch('holon.reaktor.id_generator', return_value='')
+    def test_truncate(self, _):
+        """Only about max_length characters of data are rendered."""
+        from reaktor import truncate
+        self.assertEqual(truncate('0123456789', None), u'0123456789')
+        self.assertEqual(truncate(u'\xe4' * 10, 3), u'\xe4\xe4\xe4... (7 more)')
+        self.assertEqual(truncate(u'\xe4'.encode('utf-8') * 10, 3),
+                         u'\xe4\xe4\xe4... (14 more bytes)')
+        self.assertEqual(truncate([1, {'a': (2,)}], 100), unicode([1, {'a': (2,)}]))
+        self.assertEqual(truncate(['x' * 10 ** 6, 1], 5), u"['xxx... (truncated)")
+        big = Mock(__repr__=Mock(return_value='r'))
+        self.assertEqual(truncate([0] * 10 + [big], 5), u'[0, 0... (truncated)')
+        self.assertFalse(big.__repr__.called)
+
+    def test_log_lazy(self, _):
+        """Log messages are not built if not logged."""
+        with patch('holon.reaktor.logger_request') as logger_request:
+            logger_request.isEnabledFor.return_value = False
+            with patch('holon.reaktor.truncate') as truncate:
+                with patch_json(self.reaktor, '[]'):
+                    self.reaktor.call('Interface.Method', [])
+        self.assertFalse(logger_request.info.called)
+        self.assertFalse(truncate.called)
+
+    def test_log_sampled(self, _):
+        """Successful requests are sampled, failed ones logged anyway."""
+        r = Reaktor(**dict(reaktor_config.items() + [('log_sample_rate', 0)]))
+        with patch('holon.reaktor.logger_request') as logger_request:
+            with patch_json(r, '[]'):
+                r.call('Interface.Method', [])
+            self.assertFalse(logger_request.info.called)
+            with patch_json(r, status=500):
+                self.assertRaises(ReaktorHttpError, r.call, 'Interface.Method', [])
+            self.assertTrue(logger_request.info.called)
+        self.assertEqual(len(r.history), 2)
+
+    def test_history_bounded(self, _):
+        """Reaktor history keeps the given number of latest calls."""
+        r = Reaktor(**dict(reaktor_config.items() + [('keep_history', 2)]))
+        with patch_json(r, '[]'):
+            for i in range(3):
+                r.call('Interface.Method%i' % i, [])
+        self.assertEqual([record.function for record in r.history],
+                         ['Interface.Method1', 'Interface.Method2'])
+        self.assertEqual(r.history[-1]['status'], 200)
+
+    def test_history_compatible(self, _):
+        """History records have the keys of the former summary dicts, and
+        slices of the history are lists.
+        """
+        with patch_json(self.reaktor, '[]'):
+            for i in range(3):
+                self.reaktor.call('Interface.Method%i' % i, [], headers={'a': 'b'})
+        last = self.reaktor.history[-1]
+        self.assertEqual(last['request'], u'POST Interface.Method2 %s' %
+                         self.reaktor.http_service.protocol)
+        self.assertEqual(last['headers'], {'a': 'b'})
+        self.assertEqual(self.reaktor.history[-2:], list(self.reaktor.history)[1:])
+        self.assertEqual(self.reaktor.history[::2][1].function, 'Interface.Method2')
+
+    def test_stats(self, _):
+        """Statistics are kept per function."""
+        with patch_json(self.reaktor, '[]'):
+            self.reaktor.call('Interface.Method', [])
+            self.reaktor.call('Interface.Method', [])
+        with patch_json(self.reaktor, err='{"reaktorErrorCode":"ILLEGAL_CALL"}'):
+            self.assertRaises(ReaktorIllegalCallError, self.reaktor.call, 'Interface.Method', [])
+        with patch_json(self.reaktor, status=500):
+            self.assertRaises(ReaktorHttpError, self.reaktor.call, 'Interface.Other', [])
+        stats = self.reaktor.stats.snapshot()
+        self.assertEqual(stats['Interface.Method']['calls'], 3)
+        self.assertEqual(stats['Interface.Method']['errors'], 1)
+        self.assertTrue(stats['Interface.Method']['bytes_sent'] > 0)
+        self.assertTrue(stats['Interface.Method']['bytes_received'] > 0)
+        self.assertEqual(stats['Interface.Other']['errors'], 1)
+
+
+class AsyncReaktorTestCase(unittest.TestCase):
+    def test_call(self):
+        """Calls return futures, which run many requests on one thread."""
+        with local_server(RpcHandler) as port:
+            r = AsyncReaktor(**dict(reaktor_config.items() + [
+                ('http_service', 'services.pycurl.AsyncPyCurlHttpService'),
+                ('host', '127.0.0.1'), ('port', port), ('path', '/rpc')]))
+            futures = [r.RpcInterface.Method({'i': i}) for i in range(10)]
+            self.assertFalse(any(f.done for f in futures))
+            self.assertEqual(futures[-1].result(), [{'i': 9}])
+            r.run()
+        self.assertTrue(all(f.done for f in futures))
+        self.assertEqual([f.result()[0].i for f in futures], range(10))
+        self.assertEqual(len(r.history), 10)
+
+    def test_io_error(self):
+        """Communication errors are raised by the future."""
+        r = AsyncReaktor(**dict(reaktor_config.items() + [
+            ('http_service', 'services.pycurl.AsyncPyCurlHttpService'),
+            ('host', '127.0.0.1'), ('port', 1)]))
+        future = r.RpcInterface.Method()
+        self.assertRaises(ReaktorIOError, future.result)
+        self.assertEqual(r.history[0]['status'], 'ERR')
+
+    def test_hooks(self):
+        """Hooks get the timings of the phases of async calls."""
+        from hooks import ReaktorHook
+        hook = Mock(spec=ReaktorHook)
+        with local_server(RpcHandler) as port:
+            r = AsyncReaktor(**dict(reaktor_config.items() + [
+                ('http_service', 'services.pycurl.AsyncPyCurlHttpService'),
+                ('host', '127.0.0.1'), ('port', port), ('path', '/rpc'),
+                ('hooks', [hook])]))
+            r.RpcInterface.Method(1).result()
+        info = hook.after_response.call_args[0][0]
+        self.assertEqual(set(info.timings), set(
+            ['serialize', 'network', 'start_transfer', 'decode', 'convert']))
+
+    def test_malformed_response(self):
+        """A malformed response or a raising data_converter fails its own
+        call only, the others finish."""
+        with local_server(GarbageHandler) as port:
+            r = AsyncReaktor(**dict(reaktor_config.items() + [
+                ('http_service', 'services.pycurl.AsyncPyCurlHttpService'),
+                ('host', '127.0.0.1'), ('port', port), ('path', '/rpc')]))
+            futures = [r.RpcInterface.Method(i) for i in range(3)] + \
+                [r.RpcInterface.Method('bad')] + \
+                [r.call('RpcInterface.Method', [i], data_converter=lambda data: 1 / 0)
+                 for i in range(2)] + \
+                [r.RpcInterface.Method(i) for i in range(3, 6)]
+            r.run()
+            self.assertTrue(all(f.done for f in futures))
+            self.assertEqual([f.result() for f in futures[:3] + futures[-3:]],
+                             [[i] for i in range(6)])
+            self.assertRaises(ValueError, futures[3].result)
+            self.assertRaises(ZeroDivisionError, futures[4].result)
+            self.assertEqual(r.RpcInterface.Method(7).result(), [7])
+
+    def test_failing_callback(self):
+        """A raising done callback doesn't strand the other transfers."""
+        with local_server(RpcHandler) as port:
+            r = AsyncReaktor(**dict(reaktor_config.items() + [
+                ('http_service', 'services.pycurl.AsyncPyCurlHttpService'),
+                ('host', '127.0.0.1'), ('port', port), ('path', '/rpc')]))
+            futures = [r.RpcInterface.Method(i) for i in range(6)]
+            futures[0].add_done_callback(lambda f: 1 / 0)
+            self.assertRaises(ZeroDivisionError, r.run)
+            self.assertTrue(futures[0].done)
+            # the transfers still running go on with the next run
+            r.run()
+            self.assertTrue(all(f.done for f in futures))
+            self.assertEqual(r.http_service.transfers, {})
+
+    @patch('holon.reaktor.next_request_id', return_value='')
+    def test_api_error(self, _):
+        """Errors are mapped just like for synchronous calls."""
+        r = AsyncReaktor(**reaktor_config)
+        with patch_json(r, err='{"reaktorErrorCode":"ILLEGAL_CALL"}'):
+            future = r.RpcInterface.Method()
+        callback = Mock()
+        future.add_done_callback(callback)
+        callback.assert_called_with(future)
+        self.assertRaises(ReaktorIllegalCallError, future.result)
+
+
+@patch('holon.reaktor.next_request_id', return_value='')
 class ReaktorObjectTestCase(unittest.TestCase):
     def setUp(self):
         self.reaktor = Reaktor(**reaktor_config)
@@ -166,12 +499,65 @@ class ReaktorObjectTestCase(unittest.TestCase):
             self.assertTrue(callable(r.name))
             self.assertEqual(r.name(), ["e1", "e2", "e3"])
 
+    def test_enum_name_attribute(self, _):
+        """name is a plain attribute of objects which are not java enums."""
+        o = ReaktorObject({'name': 'value', 'other': 1})
+        self.assertEqual(o.name, 'value')
+
+    def test_attribute_resolution_cached(self, _):
+        """Attribute names are resolved once, getters are reused."""
+        from reaktor import resolve_attribute
+        first, second = ReaktorObject({'prop': 1}), ReaktorObject({'prop': 2})
+        self.assertIs(resolve_attribute('getProp'), resolve_attribute('getProp'))
+        self.assertIs(first.getProp.im_func, second.getProp.im_func)
+        self.assertEqual((first.getProp(), second.getProp()), (1, 2))
+        self.assertRaises(AttributeError, lambda: first.getOther)
+
+    def test_getters_bound_once(self, _):
+        """Getters are bound once per object and not pickled."""
+        import pickle
+        o = ReaktorObject({'prop': 1})
+        self.assertIs(o.getProp, o.getProp)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(o, protocol))
+            self.assertEqual(copy, o)
+            self.assertEqual(copy.__dict__, {})
+            self.assertEqual(copy.getProp(), 1)
+
+    def test_attribute_resolutions_bounded(self, _):
+        """Names beyond the bound are resolved but not kept."""
+        from reaktor import resolve_attribute
+        import reaktor
+        resolution = resolve_attribute('getKept')
+        with patch.object(reaktor, 'MAX_ATTRIBUTES', 0):
+            self.assertEqual(resolve_attribute('getUnkept')[1], 'unkept')
+            self.assertEqual(ReaktorObject({'unkept': 1}).getUnkept(), 1)
+            self.assertIs(resolve_attribute('getKept'), resolution)
+            self.assertIsNot(resolve_attribute('getUnkept'),
+                             resolve_attribute('getUnkept'))
+
     def test_attribute_error(self, _):
         """Reaktor object raises attribute error for element that do not exist in the JSON payload."""
         with patch_json(self.reaktor, '{"prop":"value"}'):
             r = self.reaktor.call('Interface.Whatever', [])
             self.assertRaises(AttributeError, lambda: r.wrong_prop)
 
+    def test_lazy_converter(self, _):
+        """Lazy reaktor objects wrap nested data on first access."""
+        with patch_json(self.reaktor, '{"a":{"b":[{"c":1}]},"d":[[{"e":2}]]}'):
+            r = self.reaktor.call('Interface.Method', [],
+                                  data_converter=ReaktorObject.to_lazy_reaktorobject)
+        self.assertIsInstance(r, ReaktorObject)
+        self.assertIs(type(dict.__getitem__(r, 'a')), dict)
+        self.assertIsInstance(r.a, ReaktorObject)
+        self.assertIs(r.a, r['a'])
+        self.assertEqual(r.a.b[0].getC(), 1)
+        self.assertIs(r.a.b[0], r.a.b[0])
+        self.assertEqual([o.e for l in r.d for o in l], [2])
+        self.assertIsInstance(r.get('d')[0][:1][0], ReaktorObject)
+        self.assertTrue(all(isinstance(v, (ReaktorObject, list)) for v in r.values()))
+        self.assertEqual(r, {"a": {"b": [{"c": 1}]}, "d": [[{"e": 2}]]})
+
     def test_readonly(self, _):
         """Reaktor object are readonly."""
         o = ReaktorObject({'prop': 'val'})
@@ -181,7 +567,7 @@ class ReaktorObjectTestCase(unittest.TestCase):
             del o.prop
 
 
-@patch('holon.reaktor.id_generator', return_value='')
+@patch('holon.reaktor.next_request_id', return_value='')
 class ReaktorErrorTestCase(unittest.TestCase):
     def setUp(self):
         self.reaktor = Reaktor(**reaktor_config)
@@ -247,6 +633,897 @@ class ReaktorErrorTestCase(unittest.TestCase):
                 self.assertIsInstance(e, ReaktorError)
 
 
+@contextmanager
+def patch_batch_json(reaktor, replies, status=200):
+    from services import Response
+    call_orig = reaktor.http_service.call
+    try:
+        reaktor.http_service.call = Mock(return_value=Response(status, replies, 0))
+        yield reaktor.http_service.call
+    finally:
+        reaktor.http_service.call = call_orig
+
+
+@patch('holon.reaktor.next_request_id', side_effect=['a', 'b', 'c'])
+class ReaktorBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reaktor = Reaktor(**reaktor_config)
+
+    def test_batch(self, _):
+        """Calls in a batch are sent in one request, results are matched by id."""
+        replies = u"""[{"result":{"o":2},"id":"b"},{"result":{"o":1},"id":"a"}]"""
+        with patch_batch_json(self.reaktor, replies) as call:
+            with self.reaktor.batch() as batch:
+                first = batch.Interface.Method(1)
+                second = batch.Interface.Method(2)
+                self.assertRaises(RuntimeError, first.result)
+        self.assertEqual(call.call_count, 1)
+        self.assertEqual(first.result().o, 1)
+        self.assertEqual(second.result().o, 2)
+        self.assertEqual(len(self.reaktor.history), 1)
+        self.assertEqual(self.reaktor.history[0]['request_id'], ['a', 'b'])
+
+    def test_batch_call_options(self, _):
+        """fields are applied to the results of batched calls, options of
+        the whole request are refused."""
+        replies = u"""[{"result":[{"o":1,"p":2}],"id":"a"}]"""
+        with patch_batch_json(self.reaktor, replies):
+            with self.reaktor.batch() as batch:
+                pending = batch.Interface.Method(fields=['o'])
+                self.assertRaises(ValueError, batch.Interface.Method, timeout=1)
+                self.assertRaises(ValueError, batch.Interface.Method, headers={})
+                self.assertRaises(ValueError, batch.Interface.Method, intern=True)
+        self.assertEqual(pending.result(), [{'o': 1}])
+        self.assertIsInstance(pending.result()[0], ReaktorObject)
+
+    def test_batch_errors(self, _):
+        """Each call of a batch raises its own error."""
+        replies = u"""[{"result":{},"id":"a"},
+                       {"error":{"reaktorErrorCode":"UNKNOWN_ENTITY_ERROR"},"id":"b"}]"""
+        with patch_batch_json(self.reaktor, replies):
+            first, second, third = self.reaktor.call_many([
+                ('Interface.Method', [1]),
+                ('Interface.Method', [2]),
+                ('Interface.Method', [3]),
+            ])
+        self.assertEqual(first.result(), {})
+        self.assertRaises(ReaktorEntityError, second.result)
+        self.assertRaises(ReaktorJSONRPCError, third.result)
+
+    def test_batch_rejected(self, _):
+        """An error for the whole batch is raised by each call."""
+        replies = u"""{"error":{"reaktorErrorCode":"AUTHENTICATION_INVALID"},"id":null}"""
+        with patch_batch_json(self.reaktor, replies):
+            first, second = self.reaktor.call_many([
+                ('Interface.Method', []), ('Interface.Method', [])])
+        self.assertRaises(ReaktorAuthError, first.result)
+        self.assertRaises(ReaktorAuthError, second.result)
+
+    def test_batch_http_error(self, _):
+        """Http errors are raised when sending the batch."""
+        with patch_batch_json(self.reaktor, u'', status=503):
+            batch = self.reaktor.batch()
+            pending = batch.Interface.Method()
+            self.assertRaises(ReaktorHttpError, batch.send)
+        self.assertRaises(ReaktorHttpError, pending.result)
+
+
+@patch('holon.reaktor.next_request_id', return_value='')
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        from cache import ResponseCache
+        self.cache = ResponseCache({'Interface.Cached': 60})
+        self.reaktor = Reaktor(**dict(reaktor_config.items() + [('cache', self.cache)]))
+
+    def test_cached_call(self, _):
+        """Results of cacheable functions are served from the cache."""
+        with patch_json(self.reaktor, '{"prop":"value"}') as call:
+            first = self.reaktor.call('Interface.Cached', [1, {'b': 2, 'a': 1}])
+            second = self.reaktor.call('Interface.Cached', [1, {'a': 1, 'b': 2}])
+        self.assertEqual(call.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertIsInstance(second, ReaktorObject)
+        self.assertEqual([h['cached'] for h in self.reaktor.history], [False, True])
+        self.assertEqual(self.cache.stats(), dict(hits=1, misses=1))
+
+    def test_not_cached(self, _):
+        """Only listed functions and successful calls are cached."""
+        with patch_json(self.reaktor, '{}') as call:
+            self.reaktor.call('Interface.Method', [])
+            self.reaktor.call('Interface.Method', [])
+        self.assertEqual(call.call_count, 2)
+        with patch_json(self.reaktor, err='{"reaktorErrorCode":"ILLEGAL_CALL"}') as call:
+            self.assertRaises(ReaktorIllegalCallError, self.reaktor.call, 'Interface.Cached', [])
+            self.assertRaises(ReaktorIllegalCallError, self.reaktor.call, 'Interface.Cached', [])
+        self.assertEqual(call.call_count, 2)
+
+    def test_invalidate(self, _):
+        with patch_json(self.reaktor, 'null') as call:
+            self.reaktor.call('Interface.Cached', [1])
+            self.reaktor.call('Interface.Cached', [2])
+            self.cache.invalidate('Interface.Cached', [1])
+            self.reaktor.call('Interface.Cached', [1])
+            self.reaktor.call('Interface.Cached', [2])
+            self.assertEqual(call.call_count, 3)
+            self.cache.invalidate('Interface.Cached')
+            self.reaktor.call('Interface.Cached', [2])
+            self.assertEqual(call.call_count, 4)
+            self.cache.invalidate()
+            self.reaktor.call('Interface.Cached', [2])
+            self.assertEqual(call.call_count, 5)
+
+    def test_invalidate_shared(self, _):
+        """Invalidating a function invalidates it for all caches sharing the
+        backend, including the ones created afterwards.
+        """
+        from cache import ResponseCache
+        other = ResponseCache(self.cache.methods, backend=self.cache.backend)
+        other.set('Interface.Cached', [1], '1')
+        self.assertEqual(self.cache.get('Interface.Cached', [1]), '1')
+        self.cache.invalidate('Interface.Cached')
+        self.assertIsNone(other.get('Interface.Cached', [1]))
+        later = ResponseCache(self.cache.methods, backend=self.cache.backend)
+        self.assertIsNone(later.get('Interface.Cached', [1]))
+        # only the generation is left in the local backend
+        self.assertEqual(len(self.cache.backend), 1)
+        self.cache.backend.clear()
+        self.assertIsNone(other.get('Interface.Cached', [1]))
+
+
+def wait_for(condition, timeout=5):
+    """Wait until condition() holds."""
+    import time
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.001)
+
+
+class StatsTestCase(unittest.TestCase):
+    def test_percentiles(self):
+        from stats import ReaktorStats
+        stats = ReaktorStats()
+        for duration in range(1, 101):
+            stats.add('f', duration, 10, 100)
+        snapshot = stats.snapshot()['f']
+        self.assertEqual(snapshot['calls'], 100)
+        self.assertEqual(snapshot['mean'], 50.5)
+        self.assertTrue(50 <= snapshot['p50'] < 50 * 1.25)
+        self.assertTrue(95 <= snapshot['p95'] < 95 * 1.25)
+        self.assertTrue(99 <= snapshot['p99'] < 99 * 1.25)
+
+    def test_cached(self):
+        """Cached calls don't count for latencies."""
+        from stats import ReaktorStats
+        stats = ReaktorStats()
+        stats.add('f', 0, 0, 100, cached=True)
+        self.assertEqual(stats.snapshot()['f']['cached'], 1)
+        self.assertIsNone(stats.snapshot()['f']['p50'])
+
+
+@patch('holon.reaktor.next_request_id', return_value='')
+class HooksTestCase(unittest.TestCase):
+    def setUp(self):
+        from hooks import MetricsCollector, ReaktorHook
+        self.hook = Mock(spec=ReaktorHook)
+        self.metrics = MetricsCollector()
+        self.reaktor = Reaktor(**dict(reaktor_config.items() + [
+            ('hooks', [self.hook, self.metrics])]))
+
+    def test_phases(self, _):
+        with patch_json(self.reaktor, res='{"o":1}'):
+            self.reaktor.RpcInterface.Method(1)
+        info = self.hook.before_send.call_args[0][0]
+        self.assertIs(self.hook.after_response.call_args[0][0], info)
+        self.assertEqual(info.function, 'RpcInterface.Method')
+        self.assertEqual(set(info.timings),
+                         set(['serialize', 'network', 'decode', 'convert']))
+        self.assertFalse(self.hook.on_error.called)
+
+    def test_error(self, _):
+        with patch_json(self.reaktor, status=500):
+            self.assertRaises(ReaktorHttpError, self.reaktor.RpcInterface.Method)
+        self.assertIsInstance(self.hook.on_error.call_args[0][1], ReaktorHttpError)
+        self.assertFalse(self.hook.after_response.called)
+        self.assertIn('holon_call_errors_total{function="RpcInterface.Method",'
+                      'error="ReaktorHttpError"} 1', self.metrics.prometheus_text())
+
+    def test_failing_hook(self, _):
+        """Errors of hooks don't fail calls."""
+        self.hook.after_response.side_effect = ValueError
+        with patch_json(self.reaktor, res='{"o":1}'):
+            self.assertEqual(self.reaktor.RpcInterface.Method().o, 1)
+
+    def test_batch(self, _):
+        with patch_batch_json(self.reaktor, u'[{"result":{},"id":""}]'):
+            with self.reaktor.batch() as batch:
+                batch.Interface.Method()
+        info = self.hook.after_response.call_args[0][0]
+        self.assertEqual(info.function, 'Interface.Method')
+        self.assertIn('network', info.timings)
+        self.assertIn('convert', info.timings)
+
+    def test_prometheus_text(self, _):
+        with patch_json(self.reaktor, res='{"o":1}'):
+            self.reaktor.RpcInterface.Method()
+            self.reaktor.RpcInterface.Method()
+        text = self.metrics.prometheus_text()
+        self.assertIn('# TYPE holon_call_phase_seconds histogram', text)
+        self.assertIn('holon_call_phase_seconds_count{function="RpcInterface.Method",'
+                      'phase="network"} 2', text)
+        self.assertIn('holon_call_phase_seconds_bucket{function="RpcInterface.Method",'
+                      'phase="network",le="+Inf"} 2', text)
+        self.assertEqual(self.metrics.snapshot()[
+            ('RpcInterface.Method', 'convert')]['count'], 2)
+
+    def test_start_transfer(self, _):
+        from services import Response
+        self.reaktor.http_service.call = Mock(
+            return_value=Response(200, u'{"result":{},"id":""}', 3, 2))
+        self.reaktor.RpcInterface.Method()
+        info = self.hook.after_response.call_args[0][0]
+        self.assertEqual(info.timings['start_transfer'], 2)
+
+    def test_response_sizes(self, _):
+        from services import Response
+        self.reaktor.http_service.call = Mock(
+            return_value=Response(200, u'{"result":{},"id":""}', 3, 2, 12, 21))
+        self.reaktor.RpcInterface.Method()
+        self.reaktor.RpcInterface.Method()
+        text = self.metrics.prometheus_text()
+        self.assertIn('holon_response_bytes_total{function="RpcInterface.Method",'
+                      'encoding="wire"} 24', text)
+        self.assertIn('holon_response_bytes_total{function="RpcInterface.Method",'
+                      'encoding="decoded"} 42', text)
+
+
+@patch('holon.reaktor.next_request_id', return_value='')
+class StreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reaktor = Reaktor(**reaktor_config)
+
+    def patch_stream(self, data, status=200, size=3):
+        chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        self.reaktor.http_service.stream = Mock(return_value=(status, iter(chunks)))
+
+    def test_parser(self, _):
+        from streaming import ResultParser
+        data = '{"result":[{"a":1},23456,"x",[1,2]],"error":null,"id":"q"}'
+        for size in (1, 2, 5, len(data)):
+            parser = ResultParser([data[i:i + size] for i in range(0, len(data), size)])
+            self.assertEqual(list(parser), [{'a': 1}, 23456, 'x', [1, 2]])
+            self.assertEqual(parser.envelope, {'error': None, 'id': 'q'})
+            self.assertEqual(parser.received, len(data))
+
+    def test_parser_numbers(self, _):
+        """Numbers split across chunks are decoded as a whole."""
+        from streaming import ResultParser
+        data = '{"result":[1.5,-2e3,3.25E-2,40],"id":"q"}'
+        for split in range(1, len(data)):
+            self.assertEqual(list(ResultParser([data[:split], data[split:]])),
+                             [1.5, -2000.0, 0.0325, 40])
+
+    def test_parser_large_value(self, _):
+        """Values spanning many chunks are decoded a few times only."""
+        import json
+        from streaming import ResultParser
+        data = json.dumps({'result': {'k%i' % i: i for i in range(10 ** 4)}, 'id': 'q'})
+        decoder = json.JSONDecoder()
+        decoder.raw_decode = Mock(side_effect=decoder.raw_decode)
+        parser = ResultParser([data[i:i + 100] for i in range(0, len(data), 100)], decoder)
+        self.assertEqual(len(list(parser)[0]), 10 ** 4)
+        self.assertTrue(decoder.raw_decode.call_count < 20)
+
+    def test_parser_malformed(self, _):
+        from streaming import ResultParser
+        self.assertRaises(ValueError, list, ResultParser(['{"result":[1 2]}']))
+        # the rest of the data is not buffered for a malformed value
+        chunks = iter(['{"result":[{"a":x'] + ['1' * 10] * 10 ** 6)
+        self.assertRaises(ValueError, list, ResultParser(chunks, max_value_size=100))
+        self.assertTrue(next(chunks, None))
+
+    def test_stream(self, _):
+        self.patch_stream('{"result":[{"o":1},{"o":2}],"id":""}')
+        items = self.reaktor.stream('Interface.Method', [])
+        self.assertEqual([item.o for item in items], [1, 2])
+        self.assertEqual(self.reaktor.history[0]['received'], 36)
+
+    def test_stream_api_error(self, _):
+        """Errors sent before the result are raised before any item."""
+        self.patch_stream('{"error":{"reaktorErrorCode":"ILLEGAL_CALL"},"result":[{}],"id":""}')
+        items = self.reaktor.stream('Interface.Method', [])
+        self.assertRaises(ReaktorApiError, next, items)
+
+    def test_stream_invalid_id(self, _):
+        self.patch_stream('{"result":[{"o":1}],"id":"other"}')
+        items = self.reaktor.stream('Interface.Method', [])
+        self.assertEqual(next(items).o, 1)
+        self.assertRaises(ReaktorJSONRPCError, next, items)
+
+    def test_stream_http_error(self, _):
+        self.patch_stream('Bad Gateway', status=502)
+        self.assertRaises(ReaktorHttpError, list,
+                          self.reaktor.stream('Interface.Method', []))
+
+    def test_stream_services(self, _):
+        records = [{'i': i, 'name': u'document %i' % i} for i in range(2000)]
+        with local_server(RpcHandler) as port:
+            for service in ('services.httplib.HttpLibHttpService',
+                            'services.pycurl.PyCurlHttpService'):
+                r = Reaktor(**dict(reaktor_config.items() + [
+                    ('http_service', service), ('host', '127.0.0.1'),
+                    ('port', port), ('path', '/rpc')]))
+                r.http_service.chunk_size = 1000
+                items = r.stream('RpcInterface.Method', records)
+                self.assertEqual([item.i for item in items], range(2000))
+                self.assertEqual(r.history[0]['status'], 200)
+
+
+class PaginateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reaktor = Reaktor(**reaktor_config)
+        self.calls = []
+
+        def call(function, args, data_converter=None, headers=None, timeout=None):
+            self.calls.append(args)
+            token, offset, size = args
+            return range(offset, min(offset + size, 10))
+        self.reaktor.call = call
+
+    def test_sequential(self):
+        pages = self.reaktor.paginate('Interface.Method', ['token', 0, 0], 1, 2,
+                                      page_size=4, prefetch=False)
+        self.assertEqual(list(pages), range(10))
+        self.assertEqual(self.calls, [['token', 0, 4], ['token', 4, 4], ['token', 8, 4]])
+
+    def test_prefetch(self):
+        """The next page is fetched while the current one is consumed."""
+        pages = iter(self.reaktor.paginate('Interface.Method', ['token', 0, 0], 1, 2,
+                                           page_size=5))
+        self.assertEqual(next(pages), 0)
+        wait_for(lambda: len(self.calls) == 2)
+        self.assertEqual(list(pages), range(1, 10))
+
+    def test_concurrency(self):
+        pages = self.reaktor.paginate('Interface.Method', ['token', 0, 0], 1, 2,
+                                      page_size=2, concurrency=4, start=1)
+        self.assertEqual(list(pages), range(1, 10))
+        self.assertTrue(set([1, 3, 5, 7, 9]) <= set(args[1] for args in self.calls))
+
+    def test_error(self):
+        self.reaktor.call = Mock(side_effect=ReaktorIOError())
+        pages = self.reaktor.paginate('Interface.Method', [0, 0], 0, 1)
+        self.assertRaises(ReaktorIOError, list, pages)
+
+
+class GatherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reaktor = Reaktor(**reaktor_config)
+
+        def call(function, args, data_converter=None, headers=None, timeout=None):
+            if args[0] == 'error':
+                raise ReaktorEntityError()
+            if args[0] == 'slow':
+                time.sleep(0.5)
+            return args[0]
+        self.reaktor.call = call
+
+    def test_map(self):
+        results = self.reaktor.map('Interface.Method', [[i] for i in range(20)])
+        self.assertEqual(results, range(20))
+
+    def test_errors(self):
+        """Errors are returned in place, other calls go on."""
+        results = self.reaktor.gather([('Interface.Method', [1]),
+                                       ('Interface.Method', ['error']),
+                                       ('Interface.Method', [3])])
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], ReaktorEntityError)
+        self.assertEqual(results[2], 3)
+
+    def test_timeout(self):
+        results = self.reaktor.map('Interface.Method', [[1], ['slow'], [3]],
+                                   timeout=0.1)
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], ReaktorTimeoutError)
+        self.assertEqual(results[2], 3)
+
+    def test_fork(self):
+        """Forked processes run calls on a pool of their own."""
+        import os
+        self.assertEqual(self.reaktor.map('Interface.Method', [[1]]), [1])
+        pid = os.fork()
+        if not pid:
+            try:
+                results = self.reaktor.map('Interface.Method', [[1], [2]])
+                os._exit(0 if results == [1, 2] else 1)
+            except BaseException:
+                os._exit(2)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            time.sleep(0.01)
+        else:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+            self.fail('calls of the forked process hang')
+        self.assertEqual(status, 0)
+
+    def test_services(self):
+        """Each worker reuses its transport."""
+        with local_server(RpcHandler) as port:
+            for service in ('services.httplib.HttpLibHttpService',
+                            'services.pycurl.PyCurlHttpService'):
+                r = Reaktor(**dict(reaktor_config.items() + [
+                    ('http_service', service), ('host', '127.0.0.1'),
+                    ('port', port), ('path', '/rpc'), ('max_workers', 4)]))
+                with patch.object(r.http_service, 'get_transport',
+                                  wraps=r.http_service.get_transport) as transport:
+                    results = r.map('RpcInterface.Method', [[i] for i in range(40)])
+                self.assertEqual(results, [[i] for i in range(40)])
+                self.assertTrue(transport.call_count <= 4)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def run_concurrently(self, flights, function, count=5):
+        from cache import SingleFlight
+        release = threading.Event()
+        outcomes = []
+
+        def leader():
+            release.wait()
+            return function()
+
+        def call():
+            try:
+                outcomes.append(flights.do('key', leader))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: flights.stats()['shared'] == count - 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_shared_value(self):
+        from cache import SingleFlight
+        flights, function = SingleFlight(), Mock(return_value=42)
+        self.assertEqual(self.run_concurrently(flights, function), [42] * 5)
+        self.assertEqual(function.call_count, 1)
+        self.assertEqual(flights.stats(), dict(calls=1, shared=4, in_flight=0))
+
+    def test_shared_error(self):
+        from cache import SingleFlight
+        error = ReaktorIOError()
+        outcomes = self.run_concurrently(SingleFlight(), Mock(side_effect=error))
+        self.assertEqual(outcomes, [error] * 5)
+
+
+@patch('holon.reaktor.next_request_id', return_value='')
+class CoalesceTestCase(unittest.TestCase):
+    def test_coalesced_calls(self, _):
+        """Concurrent identical calls are sent once, each caller gets its own objects."""
+        from services import Response
+        r = Reaktor(**dict(reaktor_config.items() + [('coalesce', ['Interface.Method'])]))
+        release = threading.Event()
+
+        def call(*args, **kwargs):
+            release.wait()
+            return Response(200, u'{"result":{"o":1},"id":""}', 0)
+
+        r.http_service.call = Mock(side_effect=call)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            r.call('Interface.Method', [1]))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: r.flights.stats()['shared'] == 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(r.http_service.call.call_count, 1)
+        self.assertEqual(results, [{'o': 1}] * 3)
+        self.assertEqual(len(set(id(result) for result in results)), 3)
+
+    def test_not_coalesced(self, _):
+        r = Reaktor(**dict(reaktor_config.items() + [('coalesce', ['Interface.Other'])]))
+        self.assertIsNone(r.coalescing_key('Interface.Method', [], None))
+        r = Reaktor(**dict(reaktor_config.items() + [('coalesce', True)]))
+        self.assertIsNotNone(r.coalescing_key('Interface.Method', [], None))
+
+    def test_coalesced_async_calls(self, _):
+        with local_server(RpcHandler) as port:
+            r = AsyncReaktor(**dict(reaktor_config.items() + [
+                ('http_service', 'services.pycurl.AsyncPyCurlHttpService'),
+                ('host', '127.0.0.1'), ('port', port), ('path', '/rpc'),
+                ('coalesce', True)]))
+            first, second = r.RpcInterface.Method(1), r.RpcInterface.Method(1)
+            other = r.RpcInterface.Method(2)
+            r.run()
+        self.assertEqual((first.result(), second.result(), other.result()), ([1], [1], [2]))
+        self.assertEqual(len(r.history), 2)
+        self.assertEqual(r.in_flight, {})
+
+
+class LocalCacheTestCase(unittest.TestCase):
+    def test_lru(self):
+        from cache import LocalCache
+        cache = LocalCache(max_size=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_ttl(self):
+        from cache import LocalCache
+        cache = LocalCache()
+        cache.set('a', 1, -1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class CodecTestCase(unittest.TestCase):
+    def test_default_codec(self):
+        """The preferred installed codec is used by default."""
+        from codec import available_codecs
+        r = Reaktor(**reaktor_config)
+        self.assertEqual(r.codec.name, available_codecs()[0])
+
+    def test_named_codec(self):
+        r = Reaktor(**dict(reaktor_config.items() + [('codec', 'json')]))
+        self.assertEqual(r.codec.name, 'json')
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            Reaktor(**dict(reaktor_config.items() + [('codec', 'yaml')]))
+
+    def test_codecs_decode_bytes(self):
+        """All codecs decode utf-8 encoded bytes."""
+        from codec import available_codecs, get_codec
+        for name in available_codecs():
+            codec = get_codec(name)
+            data = codec.decode(u'{"a": ["\\u00e4", "\xe4"]}'.encode('utf-8'))
+            self.assertEqual(data, {u'a': [u'\xe4', u'\xe4']})
+            self.assertEqual(codec.decode(codec.encode(data)), data)
+
+    def test_codecs_decode_unicode(self):
+        """All codecs decode strings into unicode, ASCII ones too."""
+        from codec import available_codecs, get_codec
+        for name in available_codecs():
+            codec = get_codec(name)
+            hooks = [None, dict] if codec.object_hooks else [None]
+            for hook in hooks:
+                data = codec.decode('{"a": ["b"]}', object_pairs_hook=hook)
+                self.assertIs(type(data.keys()[0]), unicode, name)
+                self.assertIs(type(data[u'a'][0]), unicode, name)
+
+    def test_object_hooks(self):
+        from codec import available_codecs, get_codec
+        names = available_codecs(object_hooks=True)
+        self.assertIn('json', names)
+        self.assertNotIn('ujson', names)
+        self.assertEqual(get_codec(object_hooks=True).name, names[0])
+        for name in names:
+            data = get_codec(name).decode('{"a": [{"b": 1}]}',
+                                          object_pairs_hook=ReaktorObject)
+            self.assertIsInstance(data, ReaktorObject)
+            self.assertIsInstance(data.a[0], ReaktorObject)
+            self.assertEqual(data.a[0].b, 1)
+
+
+@patch('holon.reaktor.next_request_id', return_value='')
+class DecodeObjectsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reaktor = Reaktor(**reaktor_config)
+
+    def test_object_codec(self, _):
+        """A codec without object hooks is not used to decode objects."""
+        r = Reaktor(**dict(reaktor_config.items() + [('codec', 'ujson')]))
+        self.assertTrue(r.object_codec.object_hooks)
+        r = Reaktor(**dict(reaktor_config.items() + [('codec', 'json')]))
+        self.assertIs(r.object_codec, r.codec)
+        r = Reaktor(**dict(reaktor_config.items() + [('decode_objects', False)]))
+        self.assertIsNone(r.object_codec)
+
+    @patch.object(ReaktorObject, 'to_reaktorobject')
+    def test_single_pass(self, to_reaktorobject, _):
+        """Results are ReaktorObject's without a conversion afterwards."""
+        with patch_json(self.reaktor, '[{"o":{"p":1}}, 2]'):
+            r = self.reaktor.RpcInterface.Method()
+        self.assertFalse(to_reaktorobject.called)
+        self.assertIsInstance(r[0], ReaktorObject)
+        self.assertIsInstance(r[0].o, ReaktorObject)
+        self.assertEqual((r[0].o.p, r[1]), (1, 2))
+
+    def test_unicode(self, _):
+        """Strings of results are unicode whichever way they are decoded."""
+        from codec import available_codecs
+        from services import Response
+        data = '{"error":null,"result":[{"a":"b"}],"id":""}'
+        for codec in available_codecs():
+            for options, data_converter in (({}, None), ({}, lambda result: result),
+                                            ({'coalesce': True}, None)):
+                options['codec'] = codec
+                reaktor = Reaktor(**dict(reaktor_config.items() + options.items()))
+                reaktor.http_service.call = Mock(return_value=Response(200, data, 0))
+                r = reaktor.call('Interface.Method', [], data_converter=data_converter)
+                key, value = r[0].items()[0]
+                self.assertIs(type(key), unicode, codec)
+                self.assertIs(type(value), unicode, codec)
+
+    def test_no_result(self, _):
+        with patch_json(self.reaktor, res='{}'):
+            self.assertIsInstance(self.reaktor.RpcInterface.Method(), ReaktorObject)
+        with patch_json(self.reaktor, res='null'):
+            self.assertIsNone(self.reaktor.RpcInterface.Method())
+
+    def test_envelope_checks(self, _):
+        with patch_json(self.reaktor, id='other'):
+            self.assertRaises(ReaktorJSONRPCError, self.reaktor.RpcInterface.Method)
+        with patch_json(self.reaktor, err='{"message":"m","javaClassName":"x"}'):
+            self.assertRaises(ReaktorApiError, self.reaktor.RpcInterface.Method)
+
+    def test_data_converter(self, _):
+        """Custom data converters still get plain dicts and lists."""
+        converter = Mock()
+        with patch_json(self.reaktor, '{"o":{"p":1}}'):
+            self.reaktor.call('Interface.Method', [], data_converter=converter)
+        self.assertIs(type(converter.call_args[0][0]), dict)
+        self.assertIs(type(converter.call_args[0][0]['o']), dict)
+
+    def test_batch(self, _):
+        with patch_batch_json(self.reaktor, u'[{"result":{"o":{"p":1}},"id":""}]'):
+            with self.reaktor.batch() as batch:
+                first = batch.Interface.Method()
+        self.assertIsInstance(first.result().o, ReaktorObject)
+
+    def test_stream(self, _):
+        self.reaktor.http_service.stream = Mock(return_value=(
+            200, iter(['{"result":[{"o":', '{"p":1}}],"id":""}'])))
+        items = list(self.reaktor.stream('Interface.Method', []))
+        self.assertIsInstance(items[0].o, ReaktorObject)
+
+
+
+@patch('holon.reaktor.next_request_id', return_value='')
+class KeyTranslatorTestCase(unittest.TestCase):
+    AUTHOR = '20514d7d-7591-49a4-a62d-f5c02a8f5edd'
+    RESULT = '[{"attributes":{"%s":"Hart","other":1}}]' % AUTHOR
+
+    def setUp(self):
+        from translate import KeyTranslator
+        self.translator = KeyTranslator()
+
+    def reaktor(self, **kwargs):
+        return Reaktor(**dict(reaktor_config.items() + kwargs.items() + [
+            ('key_translator', self.translator)]))
+
+    def test_object_pairs_hook(self, _):
+        o = self.translator.object_pairs_hook([(self.AUTHOR, 'Hart'), ('other', 1)])
+        self.assertIsInstance(o, ReaktorObject)
+        self.assertEqual(o, {'author': 'Hart', 'other': 1})
+        self.translator.keep_ids = True
+        o = self.translator.object_pairs_hook([(self.AUTHOR, 'Hart')])
+        self.assertEqual(o, {'author': 'Hart', self.AUTHOR: 'Hart'})
+
+    def test_to_reaktorobject(self, _):
+        o = self.translator.to_reaktorobject([{'a': {self.AUTHOR: 'Hart'}}])
+        self.assertIsInstance(o[0].a, ReaktorObject)
+        self.assertEqual(o[0].a.author, 'Hart')
+
+    def test_update_and_load(self, _):
+        from StringIO import StringIO
+        self.translator.update({'a': 'b'})
+        self.translator.load(StringIO('{"c": "d"}'))
+        self.assertEqual(self.translator.to_reaktorobject({'a': 1, 'c': 2}),
+                         {'b': 1, 'd': 2})
+        self.assertEqual(self.translator.names[self.AUTHOR], 'author')
+
+    def test_reaktor(self, _):
+        """Keys are translated while decoding."""
+        for reaktor in (self.reaktor(), self.reaktor(decode_objects=False),
+                        self.reaktor(coalesce=True)):
+            with patch_json(reaktor, self.RESULT):
+                r = reaktor.RpcInterface.Method()
+            self.assertEqual(r[0].attributes, {'author': 'Hart', 'other': 1})
+
+    def test_data_converter(self, _):
+        """Custom data converters get the keys as they are."""
+        converter = Mock()
+        reaktor = self.reaktor()
+        with patch_json(reaktor, self.RESULT):
+            reaktor.call('Interface.Method', [], data_converter=converter)
+        self.assertIn(self.AUTHOR, converter.call_args[0][0][0]['attributes'])
+
+
+
+class DecodingTestCase(unittest.TestCase):
+    RESULT = ('[{"documentID":"a","attributes":{"title":"T","author":"A"},'
+              '"categories":[{"name":"c","id":1}],"size":1},'
+              '{"documentID":"b","attributes":{"title":"U"},"size":2}]')
+
+    def test_compile_fields(self):
+        from decoding import compile_fields
+        self.assertEqual(compile_fields(['a.b', 'a.c.d', 'e']),
+                         {'a': {'b': True, 'c': {'d': True}}, 'e': True})
+        self.assertEqual(compile_fields(['a', 'a.b']), {'a': True})
+
+    def test_project(self):
+        from decoding import compile_fields, project
+        value = {'a': [{'b': 1, 'c': 2}, {'c': 3}], 'd': 4, 'e': 5}
+        self.assertEqual(project(value, compile_fields(['a.b', 'd', 'x'])),
+                         {'a': [{'b': 1}, {}], 'd': 4})
+
+    def test_interner(self):
+        from decoding import Interner
+        hook = Interner(max_length=3).hook(dict)
+        first = hook([(u'key', u'abc'), (u'long', u'abcd')])
+        second = hook([(u''.join([u'k', u'ey']), u''.join([u'ab', u'c'])),
+                       (u'long', u''.join([u'ab', u'cd']))])
+        self.assertIs(first.keys()[0], second.keys()[0])
+        self.assertIs(first[u'key'], second[u'key'])
+        self.assertIsNot(first[u'long'], second[u'long'])
+
+    def test_interner_limits(self):
+        """Long keys are not interned, a full table takes no new strings but
+        keeps the ones it has."""
+        from decoding import Interner
+        interner = Interner(max_length=3, max_key_length=4, max_size=2)
+        hook = interner.hook(dict)
+        hook([(u'key', u'abc'), (u'longkey', 1)])
+        self.assertEqual(set(interner.strings), set([u'key', u'abc']))
+        first = hook([(u''.join([u'k', u'ey']), u''.join([u'x', u'y']))])
+        self.assertIs(first.keys()[0], interner.strings[u'key'])
+        self.assertEqual(len(interner.strings), 2)
+
+    @patch('holon.reaktor.next_request_id', return_value='')
+    def test_fields(self, _):
+        reaktor = Reaktor(**reaktor_config)
+        with patch_json(reaktor, self.RESULT):
+            documents = reaktor.call('Interface.Method', [],
+                                     fields=['documentID', 'attributes.title', 'categories.name'])
+        self.assertEqual(documents, [{'documentID': 'a', 'attributes': {'title': 'T'},
+                                      'categories': [{'name': 'c'}]},
+                                     {'documentID': 'b', 'attributes': {'title': 'U'}}])
+        self.assertIsInstance(documents[0].attributes, ReaktorObject)
+        with patch_json(reaktor, '{"documentID":"a","size":1}'):
+            document = reaktor.RpcInterface.Method(fields=['size'])
+        self.assertEqual(document, {'size': 1})
+        with patch_json(reaktor, 'null'):
+            self.assertIsNone(reaktor.call('Interface.Method', [], fields=['size']))
+        with patch_json(reaktor, err='{"message":"m","javaClassName":"x"}'):
+            self.assertRaises(ReaktorApiError, reaktor.call, 'Interface.Method', [],
+                              fields=['size'])
+
+    @patch('holon.reaktor.next_request_id', return_value='')
+    def test_fields_large_result(self, _):
+        """Results larger than a chunk are projected alike."""
+        from decoding import CHUNK_SIZE
+        reaktor = Reaktor(**reaktor_config)
+        result = '{%s}' % ','.join('"k%i":"%s"' % (i, 'v' * 100) for i in range(2000))
+        self.assertTrue(len(result) > 2 * CHUNK_SIZE)
+        with patch_json(reaktor, result):
+            self.assertEqual(reaktor.call('Interface.Method', [], fields=['k1', 'k1999']),
+                             {'k1': 'v' * 100, 'k1999': 'v' * 100})
+        with patch_json(reaktor, '[%s, %s]' % (result, result)):
+            self.assertEqual(reaktor.call('Interface.Method', [], fields=['k7']),
+                             [{'k7': 'v' * 100}] * 2)
+
+    @patch('holon.reaktor.next_request_id', return_value='')
+    def test_intern(self, _):
+        reaktor = Reaktor(**reaktor_config)
+        with patch_json(reaktor, self.RESULT):
+            first = reaktor.call('Interface.Method', [], intern=True)
+        with patch_json(reaktor, self.RESULT):
+            second = reaktor.call('Interface.Method', [], intern=True)
+        self.assertEqual(first, second)
+        self.assertIs(first[0].attributes.title, second[0].attributes.title)
+        self.assertIs([key for key in first[1] if key == 'size'][0],
+                      [key for key in second[0] if key == 'size'][0])
+
+    @patch('holon.reaktor.next_request_id', return_value='')
+    def test_not_cached(self, _):
+        """Projected results are not cached, but served from full ones."""
+        from cache import ResponseCache
+        reaktor = Reaktor(**dict(reaktor_config.items() +
+                                 [('cache', ResponseCache({'Interface.Cached': 60}))]))
+        with patch_json(reaktor, '{"a":1,"b":2}') as call:
+            self.assertEqual(reaktor.call('Interface.Cached', [], fields=['a']), {'a': 1})
+            self.assertEqual(reaktor.call('Interface.Cached', []), {'a': 1, 'b': 2})
+            self.assertEqual(reaktor.call('Interface.Cached', [], fields=['b']), {'b': 2})
+        self.assertEqual(call.call_count, 2)
+
+    @patch('holon.reaktor.next_request_id', return_value='')
+    def test_async(self, _):
+        reaktor = AsyncReaktor(**reaktor_config)
+        with patch_json(reaktor, self.RESULT):
+            documents = reaktor.call('Interface.Method', [], fields=['size']).result()
+        self.assertEqual(documents, [{'size': 1}, {'size': 2}])
+
+
+class RecordSetTestCase(unittest.TestCase):
+    RESULT = [{'documentID': 'a', 'size': 1, 'status': {'name': 'PUBLISHED'}},
+              {'documentID': 'b', 'size': 3},
+              {'documentID': 'c', 'size': 2, 'tags': ['x']}]
+
+    def setUp(self):
+        from records import RecordSet
+        self.records = RecordSet.from_result([dict(r) for r in self.RESULT])
+
+    def test_from_result(self):
+        from records import RecordSet
+        self.assertIsInstance(self.records, RecordSet)
+        self.assertEqual(sorted(self.records.keys), ['documentID', 'size', 'status', 'tags'])
+        self.assertIsInstance(RecordSet.from_result({'a': 1}), ReaktorObject)
+        self.assertEqual(RecordSet.from_result([1, 2]), [1, 2])
+        self.assertEqual(RecordSet.from_result([]), [])
+
+    def test_record_access(self):
+        first, second = self.records[0], self.records[-2]
+        self.assertEqual(first.documentID, 'a')
+        self.assertEqual(first.getDocumentID(), 'a')
+        self.assertEqual(first['size'], 1)
+        self.assertIsInstance(first.status, ReaktorObject)
+        self.assertEqual(first.status.name(), 'PUBLISHED')
+        self.assertIs(first.status, self.records[0].status)
+        self.assertNotIn('status', second)
+        self.assertEqual(second.get('status', 'none'), 'none')
+        self.assertRaises(AttributeError, getattr, second, 'status')
+        self.assertRaises(KeyError, lambda: second['tags'])
+        self.assertEqual(second, {'documentID': 'b', 'size': 3})
+        self.assertEqual(sorted(second), ['documentID', 'size'])
+        self.assertRaises(RuntimeError, setattr, first, 'size', 2)
+        self.assertRaises(IndexError, lambda: self.records[3])
+
+    def test_column(self):
+        self.assertEqual(self.records.column('size'), [1, 3, 2])
+        self.assertEqual(self.records.column('tags', []), [[], [], ['x']])
+        self.assertEqual(self.records.column('unknown'), [None] * 3)
+
+    def test_where_and_filter(self):
+        records = self.records.where('size', lambda size: size > 1)
+        self.assertEqual(records.column('documentID'), ['b', 'c'])
+        records = self.records.filter(lambda record: 'tags' in record)
+        self.assertEqual(records.column('documentID'), ['c'])
+        self.assertEqual([r.documentID for r in self.records[1:]], ['b', 'c'])
+
+    def test_nested_records(self):
+        """Columns of dicts in all records are stored as RecordSet's too."""
+        from records import RecordSet
+        records = RecordSet([{'id': i, 'price': {'amount': i, 'currency': 'EUR'}}
+                             for i in range(3)])
+        self.assertIsInstance(records.columns['price'], RecordSet)
+        self.assertEqual(records.column('price').column('amount'), [0, 1, 2])
+        self.assertEqual(records[1].price.getCurrency(), 'EUR')
+        self.assertEqual(records.where('price', lambda p: p.amount > 0).column('id'), [1, 2])
+        self.assertEqual(records[1:].column('price').column('amount'), [1, 2])
+        document = records[2].to_reaktorobject()
+        self.assertIs(type(document.price), ReaktorObject)
+        self.assertEqual(document, {'id': 2, 'price': {'amount': 2, 'currency': 'EUR'}})
+
+    def test_to_list(self):
+        documents = self.records.to_list()
+        self.assertEqual(documents, self.RESULT)
+        self.assertIsInstance(documents[0], ReaktorObject)
+
+    @patch('holon.reaktor.next_request_id', return_value='')
+    def test_reaktor(self, _):
+        from records import RecordSet
+        reaktor = Reaktor(**reaktor_config)
+        with patch_json(reaktor, '[{"a":1},{"a":2}]'):
+            r = reaktor.RpcInterface.Method(data_converter=RecordSet.from_result)
+        self.assertEqual(r.column('a'), [1, 2])
+
+
 class IdGeneratorTestCase(unittest.TestCase):
     def test_generate_id(self):
         i = id_generator()
@@ -256,6 +1533,35 @@ class IdGeneratorTestCase(unittest.TestCase):
         self.assertNotEqual(i, j)
 
 
+class RequestIdsTestCase(unittest.TestCase):
+    def test_unique(self):
+        from reaktor import RequestIds
+        ids = RequestIds()
+        self.assertEqual(len(set(ids() for _ in range(1000))), 1000)
+        self.assertNotEqual(RequestIds()(), RequestIds()())
+
+    @patch('os.getpid', return_value=-1)
+    def test_fork(self, _):
+        """Forked processes get a prefix of their own."""
+        from reaktor import RequestIds
+        ids = RequestIds()
+        prefix = ids.prefix
+        with patch('os.getpid', return_value=-2):
+            ids()
+        self.assertNotEqual(ids.prefix, prefix)
+
+    def test_envelope(self):
+        """Request envelopes are encoded from a template per function."""
+        import json
+        from codec import get_codec
+        codec = get_codec()
+        post = codec.encode_request(u'Interface.Method', [1, {u'a': u'\xe4'}], 'abc1')
+        self.assertEqual(json.loads(post), {u'method': u'Interface.Method',
+                                            u'params': [1, {u'a': u'\xe4'}],
+                                            u'id': u'abc1'})
+        self.assertIn(u'Interface.Method', codec._envelopes)
+
+
 class HttpServiceTestCase(unittest.TestCase):
     def test_protocol_not_implemented(self):
         s = HttpService()
@@ -277,13 +1583,286 @@ class HttpServiceTestCase(unittest.TestCase):
         s = HttpService('host', 42, 'path')
         s._call = Mock(return_value=(200, 'data', 3))
         s.call('body')
-        s._call.assert_called_with('body', {})
+        s._call.assert_called_with('body', {}, None)
 
     def test_call_with_user_agent(self):
         s = HttpService('host', 42, 'path', user_agent='test agent')
         s._call = Mock(return_value=(200, 'data', 3))
         s.call('body')
-        s._call.assert_called_with('body', {'User-Agent': 'test agent'})
+        s._call.assert_called_with('body', {'User-Agent': 'test agent'}, None)
+
+    def test_call_timeout(self):
+        s = HttpService('host', 42, 'path', run_timeout=10)
+        s._call = Mock(return_value=(200, 'data', 3))
+        s.call('body', timeout=2)
+        self.assertTrue(0 < s._call.call_args[0][2] <= 2)
+        self.assertEqual(s.effective_timeout(None), 10)
+        self.assertEqual(s.effective_timeout(20), 10)
+
+    def test_deadline_passed(self):
+        """No attempt is started once the deadline passed."""
+        from services.resilience import RetryPolicy
+        s = HttpService('host', 42, 'path', communication_error_class=ReaktorIOError)
+        s.timeout_error_class = ReaktorTimeoutError
+        s.retry_policy = RetryPolicy(max_attempts=5, backoff=0)
+        s._call = Mock(side_effect=lambda *args: time.sleep(0.03) or (503, '', 30))
+        self.assertEqual(s.call('body', retry=True, timeout=0.05).status, 503)
+        self.assertEqual(s._call.call_count, 2)
+        self.assertRaises(ReaktorTimeoutError, s.call, 'body', timeout=0)
+
+    def test_compress(self):
+        import zlib
+        s = HttpService('host', 42, 'path')
+        headers = {}
+        self.assertEqual(s.compress(u'"\xe9t\xe9"', headers), '"\xc3\xa9t\xc3\xa9"')
+        self.assertEqual(headers, {})
+        s.compress_threshold = 4
+        body = s.compress(u'"\xe9t\xe9"', headers)
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), '"\xc3\xa9t\xc3\xa9"')
+        self.assertEqual(headers, {'Content-Encoding': 'gzip'})
+
+    def test_call_many(self):
+        s = HttpService('host', 42, 'path', communication_error_class=ReaktorIOError)
+        s._call = Mock(side_effect=[(200, 'data', 3), ReaktorIOError()])
+        r = s.call_many(['first', 'second'])
+        self.assertEqual(r[0], (200, 'data', 3, None, None, None))
+        self.assertIsInstance(r[1], ReaktorIOError)
+
+
+class ResilienceTestCase(unittest.TestCase):
+    def setUp(self):
+        from services.resilience import RetryPolicy
+        self.service = HttpServiceMock('host', 42, 'path',
+                                       communication_error_class=ReaktorIOError)
+        self.service.retry_policy = RetryPolicy(max_attempts=3)
+        self.service.retry_policy.sleep = Mock()
+
+    def test_retry(self):
+        self.service._call = Mock(side_effect=[ReaktorIOError(), (503, '', 1),
+                                               (200, 'data', 1)])
+        self.assertEqual(self.service.call('body', retry=True).data, 'data')
+        self.assertEqual(self.service.retry_policy.stats(), dict(retries=2, gave_up=0))
+        delays = [c[0][0] for c in self.service.retry_policy.sleep.call_args_list]
+        self.assertTrue(0 <= delays[0] <= 0.1 and 0 <= delays[1] <= 0.2)
+
+    def test_no_retry(self):
+        """Calls not flagged as retryable fail right away."""
+        self.service._call = Mock(side_effect=[ReaktorIOError(), (200, 'data', 1)])
+        self.assertRaises(ReaktorIOError, self.service.call, 'body')
+
+    def test_give_up(self):
+        self.service._call = Mock(return_value=(502, '', 1))
+        self.assertEqual(self.service.call('body', retry=True).status, 502)
+        self.assertEqual(self.service._call.call_count, 3)
+        self.service._call = Mock(side_effect=ReaktorIOError())
+        self.service.retry_policy.deadline = 0
+        self.assertRaises(ReaktorIOError, self.service.call, 'body', retry=True)
+        self.assertEqual(self.service._call.call_count, 1)
+
+    def test_circuit_breaker(self):
+        from services.resilience import CircuitBreaker
+        breaker = CircuitBreaker(window=4, min_calls=4, reset_timeout=0.05)
+        self.service.circuit_breaker = breaker
+        self.service._call = Mock(return_value=(500, '', 1))
+        for _ in range(4):
+            self.service.call('body')
+        self.assertEqual(breaker.stats()['state'], 'open')
+        # fails fast, without retries
+        self.assertRaises(ReaktorIOError, self.service.call, 'body', retry=True)
+        self.assertEqual(self.service._call.call_count, 4)
+        self.assertEqual(breaker.stats()['rejected'], 1)
+
+        time.sleep(0.05)
+        self.service._call = Mock(return_value=(200, 'data', 1))
+        self.service.call('body')
+        self.assertEqual(breaker.stats()['state'], 'closed')
+
+    def test_circuit_breaker_async(self):
+        """Calls of an AsyncReaktor are guarded by its circuit breaker."""
+        from services.resilience import CircuitBreaker
+        breaker = CircuitBreaker(window=2, min_calls=2, reset_timeout=60)
+        r = AsyncReaktor(**dict(reaktor_config.items() + [
+            ('http_service', 'services.pycurl.AsyncPyCurlHttpService'),
+            ('host', '127.0.0.1'), ('port', 1), ('path', '/rpc'),
+            ('circuit_breaker', breaker)]))
+        futures = [r.RpcInterface.Method(), r.RpcInterface.Method()]
+        r.run()
+        for future in futures:
+            self.assertRaises(ReaktorIOError, future.result)
+        self.assertEqual(breaker.stats()['state'], 'open')
+        future = r.RpcInterface.Method()
+        self.assertTrue(future.done)
+        self.assertRaises(ReaktorIOError, future.result)
+        self.assertEqual(breaker.stats()['rejected'], 1)
+        self.assertEqual(r.http_service.transfers, {})
+
+    def test_circuit_breaker_transfers(self):
+        """Transfers not made through call are guarded too."""
+        from services.resilience import CircuitBreaker
+
+        def service(cls):
+            s = cls('127.0.0.1', 1, '/rpc', communication_error_class=ReaktorIOError)
+            s.circuit_breaker = CircuitBreaker(window=2, min_calls=2, reset_timeout=60)
+            return s
+
+        s = service(PyCurlHttpService)
+        s.call_many(['first', 'second'])
+        self.assertEqual(s.circuit_breaker.stats()['state'], 'open')
+        self.assertIsInstance(s.call_many(['third'])[0], ReaktorIOError)
+        self.assertEqual(s.circuit_breaker.stats()['rejected'], 1)
+
+        for cls in (PyCurlHttpService, HttpLibHttpService):
+            s = service(cls)
+            for _ in range(2):
+                self.assertRaises(ReaktorIOError, s.stream, 'body')
+            self.assertEqual(s.circuit_breaker.stats()['state'], 'open', cls)
+            self.assertRaises(ReaktorIOError, s.stream, 'body')
+            self.assertEqual(s.circuit_breaker.stats()['rejected'], 1, cls)
+
+    def test_half_open_failure(self):
+        from services.resilience import CircuitBreaker
+        breaker = CircuitBreaker(window=2, min_calls=2, reset_timeout=0)
+        for _ in range(2):
+            breaker.record(False)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # one probe at a time
+        breaker.record(False)
+        self.assertEqual(breaker.stats()['opened'], 2)
+
+    def test_half_open_other_error(self):
+        """Probes failing with any error give back their slot."""
+        from services.resilience import CircuitBreaker
+        breaker = CircuitBreaker(window=2, min_calls=2, reset_timeout=0)
+        self.service.circuit_breaker = breaker
+        for _ in range(2):
+            breaker.record(False)
+        self.service._call = Mock(side_effect=ValueError())
+        for _ in range(3):
+            self.assertRaises(ValueError, self.service.call, 'body')
+        self.assertEqual(self.service._call.call_count, 3)
+        self.service._call = Mock(return_value=(200, 'data', 1))
+        self.assertEqual(self.service.call('body').data, 'data')
+        self.assertEqual(breaker.stats()['state'], 'closed')
+
+    @patch('holon.reaktor.next_request_id', return_value='')
+    def test_idempotent(self, _):
+        """Reaktor retries the calls of idempotent functions only."""
+        from services.resilience import RetryPolicy
+        policy = RetryPolicy(backoff=0)
+        r = Reaktor(**dict(reaktor_config.items() + [
+            ('retry_policy', policy), ('idempotent', ['RpcInterface.Read'])]))
+        r.http_service._call = Mock(side_effect=[
+            (503, '', 1), (200, '{"result":1,"id":""}', 1), (503, '', 1)])
+        self.assertEqual(r.RpcInterface.Read(), 1)
+        self.assertRaises(ReaktorHttpError, r.RpcInterface.Write)
+        self.assertEqual(policy.stats()['retries'], 1)
+
+
+class EndpointSetHttpServiceTestCase(unittest.TestCase):
+    def service(self, balancing='round_robin', **kwargs):
+        from services.balancing import EndpointSetHttpService
+        s = EndpointSetHttpService(
+            path='/rpc', communication_error_class=ReaktorIOError,
+            endpoints=['a:1', 'b:2', ('c', 3)], balancing=balancing,
+            backend='tests.HttpServiceMock', **kwargs)
+        for endpoint in s.endpoints:
+            endpoint.service._call = Mock(return_value=(200, 'data', 1))
+        return s
+
+    def calls(self, s):
+        return [e.service._call.call_count for e in s.endpoints]
+
+    def test_endpoints(self):
+        s = self.service()
+        self.assertEqual([e.service.base_url for e in s.endpoints],
+                         [u'http://a:1/rpc', u'http://b:2/rpc', u'http://c:3/rpc'])
+        self.assertRaises(ValueError, self.service, balancing='random')
+
+    def test_round_robin(self):
+        s = self.service()
+        for _ in range(6):
+            s.call('body')
+        self.assertEqual(self.calls(s), [2, 2, 2])
+
+    def test_least_outstanding(self):
+        s = self.service('least_outstanding')
+        s.endpoints[0].outstanding = s.endpoints[2].outstanding = 1
+        s.call('body')
+        self.assertEqual(self.calls(s), [0, 1, 0])
+
+    def test_ewma(self):
+        s = self.service('ewma')
+        for endpoint, ewma in zip(s.endpoints, (50, 5, 20)):
+            endpoint.ewma = ewma
+        for _ in range(3):
+            s.call('body')
+        self.assertEqual(self.calls(s), [0, 3, 0])
+        self.assertTrue(s.endpoints[1].ewma < 5)
+
+    def test_ejection(self):
+        s = self.service(eject_after=2, cooldown=0.05)
+        s.endpoints[0].service._call.side_effect = ReaktorIOError()
+        for _ in range(6):
+            try:
+                s.call('body')
+            except ReaktorIOError:
+                pass
+        self.assertTrue(s.stats()[0]['ejected'])
+        s.call('body')
+        s.call('body')
+        self.assertEqual(self.calls(s)[0], 2)
+        time.sleep(0.05)
+        self.assertFalse(s.stats()[0]['ejected'])
+
+    def test_failover(self):
+        """Retried calls go to another endpoint."""
+        from services.resilience import RetryPolicy
+        s = self.service()
+        s.retry_policy = RetryPolicy(backoff=0)
+        s.endpoints[0].service._call.side_effect = ReaktorIOError()
+        self.assertEqual(s.call('body', retry=True).data, 'data')
+        self.assertEqual(self.calls(s), [1, 1, 0])
+
+    def test_stream(self):
+        """Streamed calls are in progress until their chunks are read."""
+        s = self.service()
+        status, chunks = s.stream('body')
+        self.assertEqual(status, 200)
+        self.assertEqual(s.stats()[0]['outstanding'], 1)
+        self.assertEqual(''.join(chunks), 'data')
+        self.assertEqual(s.stats()[0]['outstanding'], 0)
+        self.assertEqual(s.stats()[0]['calls'], 1)
+        s.endpoints[1].service._call.side_effect = ReaktorIOError()
+        self.assertRaises(ReaktorIOError, s.stream, 'body')
+        self.assertEqual(s.stats()[1]['errors'], 1)
+        self.assertEqual(s.stats()[1]['outstanding'], 0)
+
+    def test_backend_options(self):
+        """Options the backend doesn't support are rejected."""
+        from services.balancing import EndpointSetHttpService
+        s = EndpointSetHttpService(path='/rpc', endpoints=['a:1'],
+                                   backend='services.pycurl.PyCurlHttpService',
+                                   compress_threshold=10)
+        self.assertEqual(s.endpoints[0].service.compress_threshold, 10)
+        self.assertRaises(ValueError, EndpointSetHttpService, path='/rpc',
+                          endpoints=['a:1'], backend='services.pycurl.PyCurlHttpService',
+                          max_response_size=1024)
+
+    def test_reaktor(self):
+        """Each endpoint keeps a connection pool of its own."""
+        with local_server(RpcHandler) as first:
+            with local_server(RpcHandler) as second:
+                r = Reaktor(**dict(reaktor_config.items() + [
+                    ('http_service', 'services.balancing.EndpointSetHttpService'),
+                    ('endpoints', ['127.0.0.1:%i' % first, '127.0.0.1:%i' % second]),
+                    ('path', '/rpc')]))
+                for i in range(4):
+                    self.assertEqual(r.RpcInterface.Method(i), [i])
+        for endpoint in r.http_service.stats():
+            self.assertEqual(endpoint['calls'], 2)
+        pools = [e.service.pool for e in r.http_service.endpoints]
+        self.assertIsNot(pools[0], pools[1])
+        self.assertEqual([pool.stats()['hits'] for pool in pools], [1, 1])
 
 
 class HttpLibHttpServiceTestCase(unittest.TestCase):
@@ -307,7 +1886,7 @@ class HttpLibHttpServiceTestCase(unittest.TestCase):
         s = HttpLibHttpService('host', 42, 'path')
         r = s._call('body', {})
         self.assertIsInstance(r, tuple)
-        self.assertEqual(len(r), 3)
+        self.assertEqual(len(r), 6)
 
     @patch('holon.services.httplib.HttpLibHttpService.get_transport')
     def test_call_helper_exception(self, transport):
@@ -318,6 +1897,124 @@ class HttpLibHttpServiceTestCase(unittest.TestCase):
         with self.assertRaises(s.communication_error_class):
             s._call('body', {})
 
+    @patch('holon.services.httplib.HttpLibHttpService.get_transport')
+    def test_call_helper_reuses_connection(self, transport):
+        response = Mock(status=200, will_close=False)
+        response.read = Mock(return_value='data!')
+        transport.return_value = Mock(getresponse=Mock(return_value=response))
+        s = HttpLibHttpService('host', 42, 'path', pool=ConnectionPool())
+        s._call('body', {})
+        s._call('body', {})
+        self.assertEqual(transport.call_count, 1)
+        self.assertEqual(s.pool.stats()['hits'], 1)
+        self.assertEqual(s.pool.stats()['misses'], 1)
+
+    @patch('holon.services.httplib.HttpLibHttpService.get_transport')
+    def test_call_helper_reconnects_stale_connection(self, transport):
+        from httplib import BadStatusLine
+        response = Mock(status=200, will_close=False)
+        response.read = Mock(return_value='data!')
+        stale = Mock(getresponse=Mock(side_effect=BadStatusLine('')))
+        fresh = Mock(getresponse=Mock(return_value=response))
+        transport.return_value = fresh
+        pool = ConnectionPool()
+        pool.release(('host', 42, False), stale)
+        s = HttpLibHttpService('host', 42, 'path', pool=pool)
+        self.assertEqual(s._call('body', {})[0], 200)
+        self.assertTrue(stale.close.called)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_decompressor(self):
+        import zlib
+        from services.httplib import Decompressor
+        data = 'reaktor' * 100
+        for encoding, compressor in (
+                ('gzip', zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)),
+                ('deflate', zlib.compressobj()),
+                ('deflate', zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS))):
+            compressed = compressor.compress(data) + compressor.flush()
+            decoder = Decompressor(encoding)
+            decoded = ''.join(decoder.decompress(compressed[i:i + 5])
+                              for i in range(0, len(compressed), 5))
+            self.assertEqual(decoded + decoder.flush(), data)
+            self.assertEqual((decoder.wire_size, decoder.size),
+                             (len(compressed), len(data)))
+
+    def test_decompressor_max_size(self):
+        import zlib
+        from services.httplib import Decompressor, ResponseTooLarge
+        compressed = zlib.compress('\0' * 10 ** 7)
+        decoder = Decompressor('deflate', max_size=700)
+        self.assertEqual(decoder.decompress(compressed[:10]), '')
+        self.assertRaises(ResponseTooLarge, decoder.decompress, compressed[10:])
+        self.assertEqual(decoder.size, 701)
+        decoder = Decompressor('deflate', max_size=10 ** 7)
+        self.assertEqual(len(decoder.decompress(compressed) + decoder.flush()), 10 ** 7)
+
+    def test_compression(self):
+        with local_server(GzipHandler) as port:
+            s = HttpLibHttpService('127.0.0.1', port, '/rpc', compress_threshold=4,
+                                   communication_error_class=ReaktorIOError)
+            r = s.call('"body"')
+            self.assertEqual(r.data, '"body"' * 100)
+            self.assertEqual(r.size, 600)
+            self.assertTrue(r.wire_size < 100)
+            status, chunks = s.stream('"body"')
+            self.assertEqual(''.join(chunks), '"body"' * 100)
+            s.max_response_size = 599
+            self.assertRaises(ReaktorIOError, s.call, '"body"')
+            status, chunks = s.stream('"body"')
+            self.assertRaises(ReaktorIOError, ''.join, chunks)
+
+    def test_timeout(self):
+        with local_server(SlowHandler) as port:
+            s = HttpLibHttpService('127.0.0.1', port, '/rpc', run_timeout=0.1,
+                                   communication_error_class=ReaktorIOError)
+            s.timeout_error_class = ReaktorTimeoutError
+            self.assertRaises(ReaktorTimeoutError, s.call, 'body')
+            s.run_timeout = None
+            start = time.time()
+            self.assertRaises(ReaktorTimeoutError, s.call, 'body', timeout=0.1)
+            self.assertTrue(time.time() - start < 0.4)
+            self.assertEqual(s.call('body', timeout=2).data, 'body')
+
+    def test_timeout_reading_body(self):
+        """Calls timing out while the body is read raise timeout_error_class."""
+        with local_server(StallingHandler) as port:
+            s = HttpLibHttpService('127.0.0.1', port, '/rpc',
+                                   communication_error_class=ReaktorIOError)
+            s.timeout_error_class = ReaktorTimeoutError
+            self.assertRaises(ReaktorTimeoutError, s.call, 'body', timeout=0.1)
+            status, chunks = s.stream('body', timeout=0.1)
+            self.assertEqual(status, 200)
+            self.assertRaises(ReaktorTimeoutError, ''.join, chunks)
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def test_max_size(self):
+        pool = ConnectionPool(max_size=1)
+        first, second = Mock(), Mock()
+        pool.release('key', first)
+        pool.release('key', second)
+        self.assertTrue(second.close.called)
+        self.assertEqual(pool.acquire('key', Mock()), (first, True))
+
+    def test_idle_eviction(self):
+        pool = ConnectionPool(max_idle=-1)
+        connection, factory = Mock(), Mock()
+        pool.release('key', connection)
+        self.assertEqual(pool.acquire('key', factory), (factory.return_value, False))
+        self.assertTrue(connection.close.called)
+        self.assertEqual(pool.stats()['evictions'], 1)
+
+    def test_clear(self):
+        pool = ConnectionPool()
+        connection = Mock()
+        pool.release('key', connection)
+        pool.clear()
+        self.assertTrue(connection.close.called)
+        self.assertEqual(pool.stats()['idle'], 0)
+
 
 class PyCurlHttpServiceTestCase(unittest.TestCase):
     def test_protocol(self):
@@ -329,7 +2026,7 @@ class PyCurlHttpServiceTestCase(unittest.TestCase):
         s = PyCurlHttpService('host', 42, 'path')
         r = s._call('body', {})
         self.assertIsInstance(r, tuple)
-        self.assertEqual(len(r), 3)
+        self.assertEqual(len(r), 6)
 
     @patch('holon.services.pycurl.PyCurlHttpService.get_transport')
     def test_call_helper_exception(self, transport):
@@ -339,3 +2036,45 @@ class PyCurlHttpServiceTestCase(unittest.TestCase):
         s = PyCurlHttpService('host', 42, 'path')
         with self.assertRaises(s.communication_error_class):
             s._call('body', {})
+
+    @patch('holon.services.pycurl.PyCurlHttpService.get_transport')
+    def test_call_helper_reuses_handle(self, transport):
+        s = PyCurlHttpService('host', 42, 'path')
+        s._call('body', {})
+        s._call('body', {})
+        self.assertEqual(transport.call_count, 1)
+        self.assertFalse(transport.return_value.close.called)
+
+    def test_call_many(self):
+        with local_server() as port:
+            s = PyCurlHttpService('127.0.0.1', port, '/rpc',
+                                  communication_error_class=ReaktorIOError)
+            r = s.call_many([u'"%i"' % i for i in range(5)])
+        self.assertEqual([resp.status for resp in r], [200] * 5)
+        self.assertEqual([resp.data for resp in r], [u'"%i"' % i for i in range(5)])
+
+    def test_call_many_error(self):
+        s = PyCurlHttpService('127.0.0.1', 1, '/rpc',
+                              communication_error_class=ReaktorIOError)
+        r = s.call_many([u'"0"'])
+        self.assertIsInstance(r[0], ReaktorIOError)
+
+    def test_timeout(self):
+        with local_server(SlowHandler) as port:
+            s = PyCurlHttpService('127.0.0.1', port, '/rpc',
+                                  communication_error_class=ReaktorIOError)
+            s.timeout_error_class = ReaktorTimeoutError
+            self.assertRaises(ReaktorTimeoutError, s.call, 'body', timeout=0.1)
+            # the limit of a call does not stick to the handle
+            self.assertEqual(s.call('body').data, 'body')
+            r = s.call_many(['body'], timeout=0.1)
+            self.assertIsInstance(r[0], ReaktorTimeoutError)
+
+    def test_compression(self):
+        with local_server(GzipHandler) as port:
+            s = PyCurlHttpService('127.0.0.1', port, '/rpc', compress_threshold=4,
+                                  communication_error_class=ReaktorIOError)
+            r = s.call('"body"')
+        self.assertEqual(r.data, '"body"' * 100)
+        self.assertEqual(r.size, 600)
+        self.assertTrue(r.wire_size < 100)